@@ -14,6 +14,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 import environ
+from kombu import Queue
 
 # Initialize environment variables
 env = environ.Env(
@@ -152,16 +153,104 @@ MESSAGE_STORAGE = 'django.contrib.messages.storage.session.SessionStorage'
 SESSION_ENGINE = 'django.contrib.sessions.backends.db'  # Default session engine
 
 # Add Celery configuration
-CELERY_BROKER_URL = 'redis://localhost:6379/0'
-CELERY_RESULT_BACKEND = 'redis://localhost:6379/0'
+CELERY_BROKER_URL = env('CELERY_BROKER_URL', default='redis://localhost:6379/0')
+CELERY_RESULT_BACKEND = env('CELERY_RESULT_BACKEND', default='redis://localhost:6379/0')
+
+# Queues: realtime (heartbeats), exports (export and import file jobs) and
+# maintenance (dispatch and cleanup). A worker started without -Q consumes
+# all of them; production runs exports on their own workers so housekeeping
+# never waits behind a large export.
+CELERY_TASK_QUEUES = (
+    Queue('realtime'),
+    Queue('exports'),
+    Queue('maintenance'),
+)
+CELERY_TASK_DEFAULT_QUEUE = 'maintenance'
+CELERY_TASK_ROUTES = {
+    'magus.tasks.check_heartbeats': {'queue': 'realtime'},
+    'magus.tasks.handle_missed_heartbeat': {'queue': 'realtime'},
+    'magus.tasks.send_csv_export_email': {'queue': 'exports'},
+    'magus.tasks.send_scheduled_export_batch': {'queue': 'exports'},
+    'magus.tasks.send_scheduled_export': {'queue': 'exports'},
+    'magus.tasks.build_export_artifact': {'queue': 'exports'},
+    'magus.tasks.import_task_file': {'queue': 'exports'},
+    'magus.tasks.dispatch_scheduled_exports': {'queue': 'maintenance'},
+    'magus.tasks.purge_export_artifacts': {'queue': 'maintenance'},
+    'magus.tasks.purge_deletion_tombstones': {'queue': 'maintenance'},
+}
+
+# Worker profile, set per worker container: concurrency (default: CPU count)
+# and messages reserved per process. Use a prefetch of 1 for long export jobs
+# so queued work is not held behind one that is still running.
+CELERY_WORKER_CONCURRENCY = env.int('CELERY_WORKER_CONCURRENCY', default=None)
+CELERY_WORKER_PREFETCH_MULTIPLIER = env.int('CELERY_WORKER_PREFETCH_MULTIPLIER', default=4)
+
+# Export jobs get SoftTimeLimitExceeded after the soft limit and are killed
+# at the hard limit (seconds)
+EXPORT_TASK_SOFT_TIME_LIMIT = env.int('EXPORT_TASK_SOFT_TIME_LIMIT', default=10 * 60)
+EXPORT_TASK_TIME_LIMIT = env.int('EXPORT_TASK_TIME_LIMIT', default=EXPORT_TASK_SOFT_TIME_LIMIT + 60)
 
 CELERY_BEAT_SCHEDULE = {
     'check-heartbeats-every-minute': {
         'task': 'magus.tasks.check_heartbeats',
         'schedule': 60.0,  # Run every minute
     },
+    'dispatch-scheduled-exports-every-minute': {
+        'task': 'magus.tasks.dispatch_scheduled_exports',
+        'schedule': 60.0,  # Run every minute
+    },
+    'purge-export-artifacts-hourly': {
+        'task': 'magus.tasks.purge_export_artifacts',
+        'schedule': 3600.0,  # Run every hour
+    },
+    'purge-deletion-tombstones-daily': {
+        'task': 'magus.tasks.purge_deletion_tombstones',
+        'schedule': 86400.0,  # Run every day
+    },
 }
 
+# Scheduled exports claimed per transaction by the dispatcher
+SCHEDULED_EXPORT_BATCH_SIZE = env.int('SCHEDULED_EXPORT_BATCH_SIZE', default=500)
+# Scheduled export emails sent per worker job over one mail connection
+SCHEDULED_EXPORT_EMAIL_BATCH_SIZE = env.int('SCHEDULED_EXPORT_EMAIL_BATCH_SIZE', default=50)
+# Task deletion tombstones are dropped once every incremental export with
+# deletions has sent them, and after this long regardless (paused exports)
+TASK_DELETION_RETENTION = timedelta(days=env.int('TASK_DELETION_RETENTION_DAYS', default=90))
+
+# Export artifacts: files written by Celery workers and handed to nginx.
+# The directory must be shared by web and worker containers, and mapped by
+# nginx to the internal location named in EXPORT_ACCEL_REDIRECT_PREFIX.
+# Leave the prefix empty to have Django serve the files itself (development).
+EXPORT_ARTIFACT_ROOT = env('EXPORT_ARTIFACT_ROOT', default=os.path.join(BASE_DIR, 'exports'))
+EXPORT_ACCEL_REDIRECT_PREFIX = env('EXPORT_ACCEL_REDIRECT_PREFIX', default='')
+EXPORT_ARTIFACT_TTL = env.int('EXPORT_ARTIFACT_TTL', default=24 * 3600)  # Seconds kept on disk
+EXPORT_DOWNLOAD_LINK_MAX_AGE = env.int('EXPORT_DOWNLOAD_LINK_MAX_AGE', default=300)  # Seconds
+# Total size of cached export artifacts before least recently used ones are evicted
+EXPORT_CACHE_MAX_BYTES = env.int('EXPORT_CACHE_MAX_BYTES', default=1024 ** 3)
+
+# Email delivery
+EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_HOST = env('EMAIL_HOST', default='localhost')
+EMAIL_PORT = env.int('EMAIL_PORT', default=25)
+EMAIL_USE_TLS = env.bool('EMAIL_USE_TLS', default=False)
+EMAIL_HOST_USER = env('EMAIL_HOST_USER', default='')
+EMAIL_HOST_PASSWORD = env('EMAIL_HOST_PASSWORD', default='')
+EMAIL_TIMEOUT = env.int('EMAIL_TIMEOUT', default=30)  # Seconds
+DEFAULT_FROM_EMAIL = env('DEFAULT_FROM_EMAIL', default='noreply@magus.local')
+# Retries per message on transient SMTP errors, waiting EMAIL_RETRY_BACKOFF
+# seconds and doubling the wait after each attempt
+EMAIL_SEND_RETRIES = env.int('EMAIL_SEND_RETRIES', default=3)
+EMAIL_RETRY_BACKOFF = env.float('EMAIL_RETRY_BACKOFF', default=1.0)
+
+# Task imports: uploads up to TASK_IMPORT_SYNC_MAX_BYTES are imported within
+# the request; larger ones are saved to TASK_IMPORT_ROOT (shared by web and
+# worker containers) and imported by a Celery job.
+TASK_IMPORT_ROOT = env('TASK_IMPORT_ROOT', default=os.path.join(BASE_DIR, 'imports'))
+TASK_IMPORT_SYNC_MAX_BYTES = env.int('TASK_IMPORT_SYNC_MAX_BYTES', default=1024 ** 2)
+
+# Most operations accepted by one /api/tasks/batch/ request
+TASK_BATCH_MAX_OPERATIONS = env.int('TASK_BATCH_MAX_OPERATIONS', default=500)
+
 
 LOGGING = {
     'version': 1,
@@ -373,10 +462,22 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.redis.RedisCache',
         'LOCATION': env('REDIS_URL', default='redis://localhost:6379/0'),
-        'OPTIONS': {
-            'CLIENT_CLASS': 'django_redis.client.DefaultClient',
-        },
         'KEY_PREFIX': 'magus',
         'TIMEOUT': 300,
     }
 }
+
+# Lifetime of cached analytics responses (seconds). Entries are also
+# invalidated immediately by the per-user data version on any change.
+ANALYTICS_CACHE_TIMEOUT = env.int('ANALYTICS_CACHE_TIMEOUT', default=300)
+
+# Longest task the ranged analytics queries look back for: tasks overlapping
+# a range are searched from range start minus this, so the scan stays a
+# bounded (user, start_time) index range. A task running longer only counts
+# toward ranges that start within this span of its start; the daily rollups
+# are always exact.
+ANALYTICS_MAX_TASK_DURATION = timedelta(days=env.int('ANALYTICS_MAX_TASK_DAYS', default=31))
+
+# Lifetime of a user's cached open task pointer (seconds). Pointers are keyed
+# by the data version, so this only frees those left behind by a change.
+CURRENT_TASK_CACHE_TIMEOUT = env.int('CURRENT_TASK_CACHE_TIMEOUT', default=3600)
@@ -1,5 +1,19 @@
+from collections import defaultdict
+
 from django.contrib import admin
-from .models import Profile, TaskType, Task, APIKey, ScheduledExport
+from django.db import transaction
+
+from .batching import apply_task_batch
+from .models import (
+    APIKey,
+    DailyRollup,
+    ExportArtifact,
+    Profile,
+    ScheduledExport,
+    Task,
+    TaskImport,
+    TaskType,
+)
 
 
 @admin.register(Profile)
@@ -60,6 +74,28 @@ class TaskAdmin(admin.ModelAdmin):
             return f"{int(hours)}h {int(minutes)}m"
         return "⏱️ Ongoing"
     get_duration.short_description = 'Duration'
+    
+    def delete_queryset(self, request, queryset):
+        """Bulk delete through the batch path, which keeps rollups and tombstones in step"""
+        by_user = defaultdict(list)
+        for task in queryset.select_related('user__profile'):
+            by_user[task.user_id].append(task)
+        
+        with transaction.atomic():
+            for tasks in by_user.values():
+                apply_task_batch(tasks[0].user, deleted=tasks)
+
+
+@admin.register(DailyRollup)
+class DailyRollupAdmin(admin.ModelAdmin):
+    list_display = ['user', 'day', 'task_type', 'total_seconds', 'task_count', 'interrupted_count']
+    search_fields = ['user__username', 'task_type__name']
+    date_hierarchy = 'day'
+    readonly_fields = ['user', 'day', 'task_type', 'total_seconds', 'task_count', 'interrupted_count', 'updated_at']
+    
+    def has_add_permission(self, request):
+        """Rollups are derived from tasks (rebuild with manage.py rebuild_rollups)"""
+        return False
 
 
 @admin.register(APIKey)
@@ -78,6 +114,34 @@ class APIKeyAdmin(admin.ModelAdmin):
 class ScheduledExportAdmin(admin.ModelAdmin):
     list_display = ['user', 'frequency', 'email_to', 'is_active', 'last_sent', 'next_scheduled']
     search_fields = ['user__username', 'email_to']
-    list_filter = ['frequency', 'is_active']
+    list_filter = ['frequency', 'is_active', 'incremental']
     readonly_fields = ['created_at', 'updated_at', 'last_sent']
     list_editable = ['is_active']
+
+
+@admin.register(ExportArtifact)
+class ExportArtifactAdmin(admin.ModelAdmin):
+    list_display = ['user', 'export_format', 'start_date', 'end_date', 'status', 'size', 'created_at']
+    search_fields = ['user__username']
+    list_filter = ['status', 'export_format']
+    readonly_fields = ['user', 'export_format', 'start_date', 'end_date', 'status', 'file_name', 'size',
+                       'error', 'created_at', 'completed_at']
+    
+    def has_add_permission(self, request):
+        """Artifacts are written by export jobs (queue them through the API)"""
+        return False
+
+
+@admin.register(TaskImport)
+class TaskImportAdmin(admin.ModelAdmin):
+    list_display = ['user', 'import_format', 'status', 'processed_rows', 'total_rows', 'created_count',
+                    'skipped_count', 'created_at']
+    search_fields = ['user__username']
+    list_filter = ['status', 'import_format']
+    readonly_fields = ['user', 'import_format', 'create_types', 'status', 'file_name', 'total_rows',
+                       'processed_rows', 'created_count', 'skipped_count', 'errors', 'error',
+                       'created_at', 'completed_at']
+    
+    def has_add_permission(self, request):
+        """Imports are run by import jobs (upload files through the API)"""
+        return False
@@ -0,0 +1,572 @@
+"""
+Database-side aggregation helpers for analytics endpoints
+"""
+from datetime import UTC, datetime, timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count, F, Q, Sum
+
+from .dates import local_day_range
+from .models import Task, TaskType
+
+TASK_TYPE_FIELDS = ('task_type', 'task_type__name', 'task_type__emoji', 'task_type__color')
+GRANULARITIES = ('hour', 'day', 'week', 'month')
+
+# Local calendar periods: step in wall-clock time so DST days keep their length
+_LOCAL_SERIES_SQL = """
+    SELECT s AT TIME ZONE %(tz)s AS bucket_start,
+           (s + %(step)s::interval) AT TIME ZONE %(tz)s AS bucket_end
+    FROM generate_series(
+        date_trunc(%(unit)s, t.start_time AT TIME ZONE %(tz)s),
+        t.end_time AT TIME ZONE %(tz)s,
+        %(step)s::interval
+    ) AS s
+"""
+
+# Hours: step in absolute time from the first local hour, so DST changes
+# never produce duplicate or missing buckets
+_HOUR_SERIES_SQL = """
+    SELECT s AS bucket_start, s + interval '1 hour' AS bucket_end
+    FROM generate_series(
+        date_trunc('hour', t.start_time AT TIME ZONE %(tz)s) AT TIME ZONE %(tz)s,
+        t.end_time,
+        interval '1 hour'
+    ) AS s
+"""
+
+_CLIPPED_PERIODS_SQL = """
+    SELECT b.bucket_start,
+           tt.id AS task_type,
+           tt.name AS task_type__name,
+           tt.emoji AS task_type__emoji,
+           tt.color AS task_type__color,
+           SUM(COALESCE(EXTRACT(EPOCH FROM upper(p.overlap) - lower(p.overlap)), 0))::float8 AS total,
+           COUNT(*) FILTER (WHERE p.starts_here) AS task_count,
+           COUNT(*) FILTER (WHERE p.starts_here AND t.interrupted) AS interrupted_count
+    FROM {task_table} t
+    JOIN {task_type_table} tt ON tt.id = t.task_type_id
+    CROSS JOIN LATERAL ({series}) AS b
+    CROSS JOIN LATERAL (
+        SELECT tstzrange(t.start_time, t.end_time)
+                   * tstzrange(b.bucket_start, b.bucket_end)
+                   * tstzrange(%(range_start)s, %(range_end)s) AS overlap,
+               t.start_time >= b.bucket_start AND t.start_time < b.bucket_end
+                   AND t.start_time >= %(range_start)s AND t.start_time < %(range_end)s AS starts_here
+    ) AS p
+    WHERE t.user_id = %(user_id)s
+      AND t.end_time IS NOT NULL
+      AND t.start_time >= %(scan_start)s
+      AND t.start_time < %(range_end)s
+      AND t.end_time >= %(range_start)s
+      {task_type_filter}
+      AND (p.starts_here OR NOT isempty(p.overlap))
+    GROUP BY b.bucket_start, tt.id
+"""
+
+# Per task type (and overall, via the empty grouping set) session length stats
+_SESSION_TYPE_STATS_SQL = """
+    SELECT tt.id AS task_type,
+           tt.name AS task_type__name,
+           tt.emoji AS task_type__emoji,
+           tt.color AS task_type__color,
+           COUNT(*) AS session_count,
+           COUNT(*) FILTER (WHERE t.interrupted) AS interrupted_count,
+           SUM(d.seconds) AS total,
+           AVG(d.seconds) AS mean,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY d.seconds) AS median,
+           percentile_cont(0.9) WITHIN GROUP (ORDER BY d.seconds) AS p90,
+           MAX(d.seconds) AS longest
+    FROM {task_table} t
+    JOIN {task_type_table} tt ON tt.id = t.task_type_id
+    CROSS JOIN LATERAL (
+        SELECT EXTRACT(EPOCH FROM t.end_time - t.start_time)::float8 AS seconds
+    ) AS d
+    WHERE {session_filter}
+    GROUP BY GROUPING SETS ((tt.id, tt.name, tt.emoji, tt.color), ())
+"""
+
+# Gaps between consecutive sessions of the same local day, and the longest
+# focus streak: sessions chained by breaks of at most max_gap, ended by an
+# interruption (gaps-and-islands over the session sequence)
+_SESSION_SEQUENCE_SQL = """
+    WITH sessions AS (
+        SELECT t.id, t.start_time, t.end_time,
+               EXTRACT(EPOCH FROM t.end_time - t.start_time)::float8 AS seconds,
+               (t.start_time AT TIME ZONE %(tz)s)::date AS local_day,
+               LAG(t.end_time) OVER w AS prev_end,
+               LAG(t.interrupted) OVER w AS prev_interrupted,
+               LAG((t.start_time AT TIME ZONE %(tz)s)::date) OVER w AS prev_day
+        FROM {task_table} t
+        WHERE {session_filter}
+        WINDOW w AS (ORDER BY t.start_time, t.id)
+    ),
+    flagged AS (
+        SELECT s.*,
+               CASE WHEN s.prev_day = s.local_day
+                    THEN GREATEST(EXTRACT(EPOCH FROM s.start_time - s.prev_end), 0)::float8
+               END AS gap,
+               (s.prev_end IS NULL
+                OR s.prev_interrupted
+                OR s.start_time - s.prev_end > %(max_gap)s) AS starts_streak
+        FROM sessions s
+    ),
+    streaks AS (
+        SELECT f.*,
+               SUM(CASE WHEN f.starts_streak THEN 1 ELSE 0 END) OVER (ORDER BY f.start_time, f.id) AS streak_id
+        FROM flagged f
+    )
+    SELECT g.gap_count, g.gap_mean, g.gap_median, g.gap_p90, g.gap_longest,
+           b.streak_start, b.streak_end, b.streak_sessions, b.streak_total
+    FROM (
+        SELECT COUNT(gap) AS gap_count,
+               AVG(gap) AS gap_mean,
+               percentile_cont(0.5) WITHIN GROUP (ORDER BY gap) AS gap_median,
+               percentile_cont(0.9) WITHIN GROUP (ORDER BY gap) AS gap_p90,
+               MAX(gap) AS gap_longest
+        FROM flagged
+    ) AS g
+    LEFT JOIN LATERAL (
+        SELECT MIN(start_time) AS streak_start,
+               MAX(end_time) AS streak_end,
+               COUNT(*) AS streak_sessions,
+               SUM(seconds) AS streak_total
+        FROM streaks
+        GROUP BY streak_id
+        ORDER BY streak_total DESC, streak_start
+        LIMIT 1
+    ) AS b ON true
+"""
+
+_SESSION_FILTER_SQL = """
+    t.user_id = %(user_id)s
+    AND t.end_time IS NOT NULL
+    AND t.start_time >= %(range_start)s
+    AND t.start_time < %(range_end)s
+"""
+
+
+def format_duration(seconds):
+    """Format a number of seconds as 'Xh Ym'"""
+    return f"{int(seconds // 3600)}h {int((seconds % 3600) // 60)}m"
+
+
+def task_type_totals(queryset):
+    """
+    Group completed tasks by task type in a single query.
+
+    Task type metadata is pulled in through the same query, so callers never
+    touch Task or TaskType instances.
+
+    Returns a list of dicts with task type metadata, total_duration (seconds),
+    task_count and interrupted_count.
+    """
+    rows = (
+        queryset.filter(end_time__isnull=False)
+        .order_by()
+        .values(*TASK_TYPE_FIELDS)
+        .annotate(**_total_annotations())
+    )
+
+    return [_task_type_item(row) for row in rows]
+
+
+def rollup_task_type_totals(queryset):
+    """
+    Group DailyRollup rows by task type in a single query.
+
+    Returns the same dicts as task_type_totals().
+    """
+    rows = (
+        queryset.order_by()
+        .values(*TASK_TYPE_FIELDS)
+        .annotate(**_rollup_annotations())
+    )
+
+    return [_task_type_item(row) for row in rows]
+
+
+def rollup_day_task_type_totals(queryset):
+    """
+    Return DailyRollup rows as (day, task type) items.
+
+    Returns the same dicts as task_type_totals() with an extra 'date' key.
+    """
+    rows = (
+        queryset.order_by()
+        .values('day', *TASK_TYPE_FIELDS)
+        .annotate(**_rollup_annotations())
+    )
+
+    return _day_items(rows)
+
+
+def bucket_by_day(rows, start_date, end_date):
+    """
+    Spread (day, task type) rows over every day between start_date and end_date.
+
+    Days without tracked time are zero-filled, so clients never have to patch
+    gaps in the series.
+
+    Args:
+        rows: Rows carrying their local day under 'date' 
+        start_date: First day of the range (inclusive)
+        end_date: Last day of the range (inclusive)
+
+    Returns:
+        (daily, totals) where daily is one entry per day with its per-type
+        durations, and totals are per-task-type rows for summarize_task_types()
+    """
+    days = []
+    current_date = start_date
+    while current_date <= end_date:
+        days.append((current_date, current_date.isoformat()))
+        current_date += timedelta(days=1)
+
+    return fill_buckets(rows, days, row_key='date', label='date')
+
+
+def clipped_period_totals(user, granularity, tzinfo, start=None, end=None, task_type_ids=None):
+    """
+    Group completed tasks by (period, task type), splitting tasks across periods.
+
+    Each task interval is expanded with generate_series() into the local
+    periods it overlaps and clipped to each period (and to [start, end)) with
+    tstzrange intersection, all in a single query. A task that runs past
+    midnight therefore adds to both days. task_count and interrupted_count
+    count a task only in the period where it started.
+
+    With a start bound, tasks are looked up from start minus
+    ANALYTICS_MAX_TASK_DURATION, so the (user, start_time) index bounds the
+    scan from both sides.
+
+    Args:
+        user: Owner of the tasks
+        granularity: One of GRANULARITIES
+        tzinfo: Timezone the periods are aligned to
+        start: Optional aware datetime lower bound (inclusive)
+        end: Optional aware datetime upper bound (exclusive)
+        task_type_ids: Optional list of task type IDs to include
+
+    Returns the same dicts as task_type_totals() with an extra 'bucket' key
+    holding the bucket key used by bucket_starts().
+    """
+    min_time = datetime.min.replace(tzinfo=UTC)
+    params = {
+        'user_id': user.pk,
+        'scan_start': start - settings.ANALYTICS_MAX_TASK_DURATION if start else min_time,
+        'tz': str(tzinfo),
+        'unit': granularity,
+        'step': f'1 {granularity}',
+        'range_start': start or min_time,
+        'range_end': end or datetime.max.replace(tzinfo=UTC),
+        'task_type_ids': list(task_type_ids or []),
+    }
+    sql = _CLIPPED_PERIODS_SQL.format(
+        task_table=Task._meta.db_table,
+        task_type_table=TaskType._meta.db_table,
+        series=_HOUR_SERIES_SQL if granularity == 'hour' else _LOCAL_SERIES_SQL,
+        task_type_filter='AND t.task_type_id = ANY(%(task_type_ids)s)' if task_type_ids else '',
+    )
+
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        columns = [col[0] for col in cursor.description]
+        rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+
+    items = []
+    for row in rows:
+        item = _task_type_item(row)
+        item['bucket'] = _bucket_key(row['bucket_start'], granularity, tzinfo)
+        items.append(item)
+    return items
+
+
+def session_statistics(user, tzinfo, start, end, max_gap, task_type_ids=None):
+    """
+    Compute session length, gap and streak statistics in the database.
+
+    A session is a completed task that started within [start, end). Lengths
+    use percentile_cont() per task type and overall; gaps (between sessions
+    that start on the same local day) and the longest focus streak come from
+    window functions over the ordered sessions. Two queries in total,
+    whatever the range.
+
+    Args:
+        user: Owner of the tasks
+        tzinfo: Timezone deciding which sessions share a day
+        start: Aware datetime lower bound (inclusive)
+        end: Aware datetime upper bound (exclusive)
+        max_gap: Longest break (timedelta) that still continues a streak
+        task_type_ids: Optional list of task type IDs to include
+
+    Returns:
+        dict with 'task_types' (one item per type), 'overall', 'gaps' and
+        'longest_streak' (None when there are no sessions); durations are
+        in seconds
+    """
+    min_time = datetime.min.replace(tzinfo=UTC)
+    params = {
+        'user_id': user.pk,
+        'scan_start': start - settings.ANALYTICS_MAX_TASK_DURATION if start else min_time,
+        'tz': str(tzinfo),
+        'range_start': start,
+        'range_end': end,
+        'max_gap': max_gap,
+        'task_type_ids': list(task_type_ids or []),
+    }
+    session_filter = _SESSION_FILTER_SQL
+    if task_type_ids:
+        session_filter += ' AND t.task_type_id = ANY(%(task_type_ids)s)'
+    tables = {
+        'task_table': Task._meta.db_table,
+        'task_type_table': TaskType._meta.db_table,
+        'session_filter': session_filter,
+    }
+
+    with connection.cursor() as cursor:
+        cursor.execute(_SESSION_TYPE_STATS_SQL.format(**tables), params)
+        columns = [col[0] for col in cursor.description]
+        type_rows = [dict(zip(columns, values)) for values in cursor.fetchall()]
+
+        cursor.execute(_SESSION_SEQUENCE_SQL.format(**tables), params)
+        columns = [col[0] for col in cursor.description]
+        sequence = dict(zip(columns, cursor.fetchone()))
+
+    task_types = []
+    overall = _session_item({'session_count': 0, 'interrupted_count': 0})
+    for row in type_rows:
+        if row['task_type'] is None:
+            overall = _session_item(row)
+        else:
+            task_types.append({
+                'task_type_id': row['task_type'],
+                'task_type_name': row['task_type__name'],
+                'task_type_emoji': row['task_type__emoji'],
+                'task_type_color': row['task_type__color'],
+                **_session_item(row),
+            })
+    task_types.sort(key=lambda x: x['session_count'], reverse=True)
+
+    longest_streak = None
+    if sequence['streak_sessions']:
+        longest_streak = {
+            'start': sequence['streak_start'],
+            'end': sequence['streak_end'],
+            'session_count': sequence['streak_sessions'],
+            'total_duration': sequence['streak_total'],
+        }
+
+    return {
+        'task_types': task_types,
+        'overall': overall,
+        'gaps': {
+            'count': sequence['gap_count'],
+            'mean': sequence['gap_mean'],
+            'median': sequence['gap_median'],
+            'p90': sequence['gap_p90'],
+            'longest': sequence['gap_longest'],
+        },
+        'longest_streak': longest_streak,
+    }
+
+
+def bucket_starts(granularity, start_date, end_date, tzinfo):
+    """
+    List every bucket covering the local dates start_date..end_date.
+
+    Hour buckets are keyed by their UTC instant and labelled with the local
+    time; day, week (ISO, Monday first) and month buckets are keyed and
+    labelled by their first local date.
+
+    Returns:
+        Ordered list of (key, label) pairs
+    """
+    buckets = []
+    if granularity == 'hour':
+        current, end = local_day_range(tzinfo, start_date, end_date)
+        while current < end:
+            buckets.append((current, current.astimezone(tzinfo).isoformat()))
+            current += timedelta(hours=1)
+        return buckets
+
+    if granularity == 'week':
+        current = start_date - timedelta(days=start_date.weekday())
+    elif granularity == 'month':
+        current = start_date.replace(day=1)
+    else:
+        current = start_date
+
+    while current <= end_date:
+        buckets.append((current, current.isoformat()))
+        if granularity == 'day':
+            current += timedelta(days=1)
+        elif granularity == 'week':
+            current += timedelta(weeks=1)
+        else:
+            current = (current + timedelta(days=32)).replace(day=1)
+    return buckets
+
+
+def fill_buckets(rows, buckets, row_key='bucket', label='bucket'):
+    """
+    Spread (bucket, task type) rows over an ordered list of buckets.
+
+    Buckets without tracked time are zero-filled.
+
+    Args:
+        rows: Task type items carrying their bucket key under row_key
+        buckets: Ordered (key, label value) pairs
+        row_key: Item key holding the bucket key
+        label: Name of the field holding the bucket label in the output
+
+    Returns:
+        (series, totals) where series is one entry per bucket with its
+        per-type durations, and totals are per-task-type rows for
+        summarize_task_types()
+    """
+    series = {
+        key: {
+            label: label_value,
+            'total_duration': 0,
+            'task_types': [],
+        }
+        for key, label_value in buckets
+    }
+
+    for row in rows:
+        entry = series.get(row[row_key])
+        if entry is not None:
+            entry['total_duration'] += row['total_duration']
+            entry['task_types'].append({
+                'task_type_id': row['task_type_id'],
+                'total_duration': row['total_duration'],
+            })
+
+    series = list(series.values())
+    for entry in series:
+        entry['total_formatted'] = format_duration(entry['total_duration'])
+        entry['task_types'].sort(key=lambda x: x['total_duration'], reverse=True)
+
+    return series, combine_task_types(rows, row_key=row_key)
+
+
+def combine_task_types(rows, row_key='date'):
+    """
+    Sum per-period task type rows into one row per task type.
+
+    Args:
+        rows: Task type items carrying their period under row_key
+        row_key: Item key holding the period, dropped from the output
+
+    Returns:
+        Per-task-type rows for summarize_task_types()
+    """
+    totals = {}
+    for row in rows:
+        type_id = row['task_type_id']
+        if type_id not in totals:
+            totals[type_id] = {key: value for key, value in row.items() if key != row_key}
+        else:
+            for field in ('total_duration', 'task_count', 'interrupted_count'):
+                totals[type_id][field] += row[field]
+    return list(totals.values())
+
+
+def summarize_task_types(totals, counts=('task_count', 'interrupted_count')):
+    """
+    Build the per-task-type summary used by analytics responses.
+
+    Args:
+        totals: Rows as returned by task_type_totals()
+        counts: Count fields to keep in each item (endpoints expose different ones)
+
+    Returns:
+        (summary, total_tracked) where summary is sorted by duration descending
+    """
+    total_tracked = sum(item['total_duration'] for item in totals)
+
+    summary = []
+    for item in totals:
+        entry = {
+            'task_type_id': item['task_type_id'],
+            'task_type_name': item['task_type_name'],
+            'task_type_emoji': item['task_type_emoji'],
+            'task_type_color': item['task_type_color'],
+            'total_duration': item['total_duration'],
+        }
+        for field in counts:
+            entry[field] = item[field]
+        entry['duration_formatted'] = format_duration(item['total_duration'])
+        entry['percentage'] = (item['total_duration'] / total_tracked * 100) if total_tracked > 0 else 0
+        summary.append(entry)
+
+    summary.sort(key=lambda x: x['total_duration'], reverse=True)
+
+    return summary, total_tracked
+
+
+def _total_annotations():
+    """Aggregates shared by every grouped analytics query"""
+    return {
+        'total': Sum(F('end_time') - F('start_time')),
+        'task_count': Count('id'),
+        'interrupted_count': Count('id', filter=Q(interrupted=True)),
+    }
+
+
+def _rollup_annotations():
+    """Aggregates over DailyRollup rows, named like _total_annotations()"""
+    return {
+        'total': Sum('total_seconds'),
+        'task_count': Sum('task_count'),
+        'interrupted_count': Sum('interrupted_count'),
+    }
+
+
+def _task_type_item(row):
+    """Convert a grouped values() row into an analytics item"""
+    total = row['total']
+    if isinstance(total, timedelta):
+        total = total.total_seconds()
+    return {
+        'task_type_id': row['task_type'],
+        'task_type_name': row['task_type__name'],
+        'task_type_emoji': row['task_type__emoji'],
+        'task_type_color': row['task_type__color'],
+        'total_duration': total,
+        'task_count': row['task_count'],
+        'interrupted_count': row['interrupted_count'],
+    }
+
+
+def _session_item(row):
+    """Convert a session stats row into length and interruption figures"""
+    count = row['session_count']
+    return {
+        'session_count': count,
+        'interrupted_count': row['interrupted_count'],
+        'interruption_rate': (row['interrupted_count'] / count) if count else 0,
+        'total_duration': row.get('total') or 0,
+        'mean_duration': row.get('mean'),
+        'median_duration': row.get('median'),
+        'p90_duration': row.get('p90'),
+        'longest_duration': row.get('longest'),
+    }
+
+
+def _bucket_key(value, granularity, tzinfo):
+    """Normalize a truncated datetime into the key used by bucket_starts()"""
+    if granularity == 'hour':
+        return value
+    return value.astimezone(tzinfo).date()
+
+
+def _day_items(rows):
+    """Convert grouped values() rows that carry a 'day' into analytics items"""
+    items = []
+    for row in rows:
+        item = _task_type_item(row)
+        item['date'] = row['day']
+        items.append(item)
+    return items
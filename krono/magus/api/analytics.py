@@ -1,13 +1,84 @@
-from django.db.models import Sum, F
-from django.db.models.functions import TruncDate
-from django.utils import timezone
+from django.db.models import Sum
 from datetime import timedelta, datetime
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
 
-from magus.models import Task
+from magus.aggregates import (
+    GRANULARITIES,
+    bucket_by_day,
+    bucket_starts,
+    clipped_period_totals,
+    combine_task_types,
+    fill_buckets,
+    format_duration,
+    rollup_day_task_type_totals,
+    rollup_task_type_totals,
+    session_statistics,
+    summarize_task_types,
+)
+from magus.caching import cached_analytics, conditional_on_user_data
+from magus.dates import local_day_range, local_today, user_timezone
+from magus.models import DailyRollup
+
+
+# Widgets served by the dashboard endpoint, in response order
+DASHBOARD_WIDGETS = ('summary', 'weekly', 'monthly', 'heatmap')
+
+
+def _day_payload(day, totals, counts=('task_count', 'interrupted_count')):
+    """Build a single-day response (summary and daily endpoints)"""
+    summary, total_tracked = summarize_task_types(totals, counts=counts)
+    return {
+        'date': day.isoformat(),
+        'total_tracked': total_tracked,
+        'total_tracked_formatted': format_duration(total_tracked),
+        'task_types': summary,
+    }
+
+
+def _weekly_payload(start_date, end_date, day_rows):
+    """Build the weekly response from (day, task type) rows"""
+    daily_data, totals = bucket_by_day(day_rows, start_date, end_date)
+    summary, total_tracked = summarize_task_types(totals, counts=())
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'daily_data': daily_data,
+        'task_types': summary,  # Changed from task_type_summary for consistency
+        'total_tracked': total_tracked,
+        'total_tracked_formatted': format_duration(total_tracked),
+    }
+
+
+def _monthly_payload(start_date, end_date, totals):
+    """Build the monthly response from per-task-type totals"""
+    summary, total_tracked = summarize_task_types(totals, counts=('task_count',))
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'task_types': summary,  # Changed from task_type_summary for consistency
+        'total_tracked': total_tracked,
+        'total_tracked_formatted': format_duration(total_tracked),
+    }
+
+
+def _heatmap_payload(start_date, end_date, day_totals):
+    """Build the heatmap response from (day, seconds) pairs in day order"""
+    heatmap = []
+    for day, seconds in day_totals:
+        hours = seconds / 3600
+        heatmap.append({
+            'date': day.isoformat(),
+            'hours': round(hours, 2),
+            'level': min(4, int(hours // 2)),  # 0-4 intensity levels
+        })
+    return {
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'heatmap': heatmap,
+    }
 
 
 @extend_schema(
@@ -17,64 +88,19 @@ from magus.models import Task
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('summary')
 def summary_today(request):
     """
     Get today's summary of time tracked per task type.
     
     Returns total duration for each task type tracked today.
     """
-    today = timezone.now().date()
-    
-    tasks = Task.objects.filter(
-        user=request.user,
-        start_time__date=today,
-        end_time__isnull=False  # Only completed tasks
-    ).select_related('task_type')
-    
-    # Group by task type and sum durations
-    summary = []
-    task_types = {}
-    
-    for task in tasks:
-        type_id = task.task_type.id
-        if type_id not in task_types:
-            task_types[type_id] = {
-                'task_type_id': type_id,
-                'task_type_name': task.task_type.name,
-                'task_type_emoji': task.task_type.emoji,
-                'task_type_color': task.task_type.color,
-                'total_duration': 0,
-                'task_count': 0,
-                'interrupted_count': 0,
-            }
-        
-        duration = task.duration
-        task_types[type_id]['total_duration'] += duration
-        task_types[type_id]['task_count'] += 1
-        if task.interrupted:
-            task_types[type_id]['interrupted_count'] += 1
-    
-    summary = list(task_types.values())
-    
-    # Calculate total time tracked today
-    total_tracked = sum(item['total_duration'] for item in summary)
-    
-    # Format durations
-    for item in summary:
-        hours = int(item['total_duration'] // 3600)
-        minutes = int((item['total_duration'] % 3600) // 60)
-        item['duration_formatted'] = f"{hours}h {minutes}m"
-        item['percentage'] = (item['total_duration'] / total_tracked * 100) if total_tracked > 0 else 0
+    today = local_today(request.user)
     
-    # Sort by duration descending
-    summary.sort(key=lambda x: x['total_duration'], reverse=True)
+    rollups = DailyRollup.objects.filter(user=request.user, day=today)
     
-    return Response({
-        'date': today.isoformat(),
-        'total_tracked': total_tracked,
-        'total_tracked_formatted': f"{int(total_tracked // 3600)}h {int((total_tracked % 3600) // 60)}m",
-        'task_types': summary,
-    })
+    return Response(_day_payload(today, rollup_task_type_totals(rollups)))
 
 
 @extend_schema(
@@ -87,6 +113,8 @@ def summary_today(request):
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('daily')
 def daily_breakdown(request):
     """Get daily breakdown for a specific date"""
     date_str = request.query_params.get('date')
@@ -97,47 +125,11 @@ def daily_breakdown(request):
         except ValueError:
             return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
     else:
-        target_date = timezone.now().date()
+        target_date = local_today(request.user)
     
-    # Reuse summary logic
-    tasks = Task.objects.filter(
-        user=request.user,
-        start_time__date=target_date,
-        end_time__isnull=False
-    ).select_related('task_type')
-    
-    task_types = {}
-    for task in tasks:
-        type_id = task.task_type.id
-        if type_id not in task_types:
-            task_types[type_id] = {
-                'task_type_id': type_id,
-                'task_type_name': task.task_type.name,
-                'task_type_emoji': task.task_type.emoji,
-                'task_type_color': task.task_type.color,
-                'total_duration': 0,
-                'task_count': 0,
-            }
-        task_types[type_id]['total_duration'] += task.duration
-        task_types[type_id]['task_count'] += 1
-    
-    summary = list(task_types.values())
-    total_tracked = sum(item['total_duration'] for item in summary)
-    
-    for item in summary:
-        hours = int(item['total_duration'] // 3600)
-        minutes = int((item['total_duration'] % 3600) // 60)
-        item['duration_formatted'] = f"{hours}h {minutes}m"
-        item['percentage'] = (item['total_duration'] / total_tracked * 100) if total_tracked > 0 else 0
-    
-    summary.sort(key=lambda x: x['total_duration'], reverse=True)
+    rollups = DailyRollup.objects.filter(user=request.user, day=target_date)
     
-    return Response({
-        'date': target_date.isoformat(),
-        'total_tracked': total_tracked,
-        'total_tracked_formatted': f"{int(total_tracked // 3600)}h {int((total_tracked % 3600) // 60)}m",
-        'task_types': summary,
-    })
+    return Response(_day_payload(target_date, rollup_task_type_totals(rollups), counts=('task_count',)))
 
 
 @extend_schema(
@@ -151,6 +143,8 @@ def daily_breakdown(request):
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('weekly')
 def weekly_breakdown(request):
     """Get weekly breakdown (last 7 days by default)"""
     end_date_str = request.query_params.get('end_date')
@@ -162,7 +156,7 @@ def weekly_breakdown(request):
         except ValueError:
             return Response({'error': 'Invalid end_date format'}, status=400)
     else:
-        end_date = timezone.now().date()
+        end_date = local_today(request.user)
     
     if start_date_str:
         try:
@@ -172,66 +166,14 @@ def weekly_breakdown(request):
     else:
         start_date = end_date - timedelta(days=6)  # Last 7 days
     
-    # Get daily summaries
-    daily_data = []
-    current_date = start_date
-    
-    while current_date <= end_date:
-        tasks = Task.objects.filter(
-            user=request.user,
-            start_time__date=current_date,
-            end_time__isnull=False
-        )
-        
-        total = sum(task.duration for task in tasks)
-        daily_data.append({
-            'date': current_date.isoformat(),
-            'total_duration': total,
-            'total_formatted': f"{int(total // 3600)}h {int((total % 3600) // 60)}m",
-        })
-        
-        current_date += timedelta(days=1)
-    
-    # Overall summary by task type
-    tasks = Task.objects.filter(
+    # Per-day and per-type totals for the whole range in one query
+    rollups = DailyRollup.objects.filter(
         user=request.user,
-        start_time__date__gte=start_date,
-        start_time__date__lte=end_date,
-        end_time__isnull=False
-    ).select_related('task_type')
-    
-    task_types = {}
-    for task in tasks:
-        type_id = task.task_type.id
-        if type_id not in task_types:
-            task_types[type_id] = {
-                'task_type_id': type_id,
-                'task_type_name': task.task_type.name,
-                'task_type_emoji': task.task_type.emoji,
-                'task_type_color': task.task_type.color,
-                'total_duration': 0,
-            }
-        task_types[type_id]['total_duration'] += task.duration
-    
-    summary = list(task_types.values())
-    total_tracked = sum(item['total_duration'] for item in summary)
-    
-    for item in summary:
-        hours = int(item['total_duration'] // 3600)
-        minutes = int((item['total_duration'] % 3600) // 60)
-        item['duration_formatted'] = f"{hours}h {minutes}m"
-        item['percentage'] = (item['total_duration'] / total_tracked * 100) if total_tracked > 0 else 0
-    
-    summary.sort(key=lambda x: x['total_duration'], reverse=True)
+        day__gte=start_date,
+        day__lte=end_date,
+    )
     
-    return Response({
-        'start_date': start_date.isoformat(),
-        'end_date': end_date.isoformat(),
-        'daily_data': daily_data,
-        'task_types': summary,  # Changed from task_type_summary for consistency
-        'total_tracked': total_tracked,
-        'total_tracked_formatted': f"{int(total_tracked // 3600)}h {int((total_tracked % 3600) // 60)}m",
-    })
+    return Response(_weekly_payload(start_date, end_date, rollup_day_task_type_totals(rollups)))
 
 
 @extend_schema(
@@ -245,6 +187,8 @@ def weekly_breakdown(request):
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('monthly')
 def monthly_breakdown(request):
     """Get monthly breakdown"""
     end_date_str = request.query_params.get('end_date')
@@ -256,7 +200,7 @@ def monthly_breakdown(request):
         except ValueError:
             return Response({'error': 'Invalid end_date format'}, status=400)
     else:
-        end_date = timezone.now().date()
+        end_date = local_today(request.user)
     
     if start_date_str:
         try:
@@ -267,46 +211,13 @@ def monthly_breakdown(request):
         # First day of current month
         start_date = end_date.replace(day=1)
     
-    tasks = Task.objects.filter(
+    rollups = DailyRollup.objects.filter(
         user=request.user,
-        start_time__date__gte=start_date,
-        start_time__date__lte=end_date,
-        end_time__isnull=False
-    ).select_related('task_type')
-    
-    task_types = {}
-    for task in tasks:
-        type_id = task.task_type.id
-        if type_id not in task_types:
-            task_types[type_id] = {
-                'task_type_id': type_id,
-                'task_type_name': task.task_type.name,
-                'task_type_emoji': task.task_type.emoji,
-                'task_type_color': task.task_type.color,
-                'total_duration': 0,
-                'task_count': 0,
-            }
-        task_types[type_id]['total_duration'] += task.duration
-        task_types[type_id]['task_count'] += 1
-    
-    summary = list(task_types.values())
-    total_tracked = sum(item['total_duration'] for item in summary)
-    
-    for item in summary:
-        hours = int(item['total_duration'] // 3600)
-        minutes = int((item['total_duration'] % 3600) // 60)
-        item['duration_formatted'] = f"{hours}h {minutes}m"
-        item['percentage'] = (item['total_duration'] / total_tracked * 100) if total_tracked > 0 else 0
-    
-    summary.sort(key=lambda x: x['total_duration'], reverse=True)
+        day__gte=start_date,
+        day__lte=end_date,
+    )
     
-    return Response({
-        'start_date': start_date.isoformat(),
-        'end_date': end_date.isoformat(),
-        'task_types': summary,  # Changed from task_type_summary for consistency
-        'total_tracked': total_tracked,
-        'total_tracked_formatted': f"{int(total_tracked // 3600)}h {int((total_tracked % 3600) // 60)}m",
-    })
+    return Response(_monthly_payload(start_date, end_date, rollup_task_type_totals(rollups)))
 
 
 @extend_schema(
@@ -320,6 +231,8 @@ def monthly_breakdown(request):
 )
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('heatmap')
 def heatmap_data(request):
     """
     Get heatmap data showing activity levels per day.
@@ -330,41 +243,331 @@ def heatmap_data(request):
     start_date_str = request.query_params.get('start_date')
     
     if end_date_str:
-        end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        try:
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({'error': 'Invalid end_date format'}, status=400)
     else:
-        end_date = timezone.now().date()
+        end_date = local_today(request.user)
     
     if start_date_str:
-        start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        try:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        except ValueError:
+            return Response({'error': 'Invalid start_date format'}, status=400)
     else:
         start_date = end_date - timedelta(days=89)  # ~3 months
     
-    # Get all tasks in date range
-    tasks = Task.objects.filter(
+    # Daily totals straight from the rollups
+    days = DailyRollup.objects.filter(
         user=request.user,
-        start_time__date__gte=start_date,
-        start_time__date__lte=end_date,
-        end_time__isnull=False
-    ).annotate(
-        date=TruncDate('start_time')
-    ).values('date').annotate(
-        total_duration=Sum(F('end_time') - F('start_time'))
+        day__gte=start_date,
+        day__lte=end_date,
+    ).order_by('day').values('day').annotate(
+        total=Sum('total_seconds')
     )
     
-    # Convert to dict for easy lookup
-    heatmap = []
-    for item in tasks:
-        total_seconds = item['total_duration'].total_seconds()
-        hours = total_seconds / 3600
-        heatmap.append({
-            'date': item['date'].isoformat(),
-            'hours': round(hours, 2),
-            'level': min(4, int(hours // 2)),  # 0-4 intensity levels
-        })
+    return Response(_heatmap_payload(
+        start_date,
+        end_date,
+        ((item['day'], item['total']) for item in days),
+    ))
+
+
+
+def _task_type_ids(request):
+    """Parse the task_type filter (repeated or comma-separated IDs); raises ValueError"""
+    return [
+        int(value)
+        for param in request.query_params.getlist('task_type')
+        for value in param.split(',')
+        if value
+    ]
+
+# Default span (days before end_date) for each timeseries granularity
+TIMESERIES_DEFAULT_SPANS = {
+    'hour': 0,
+    'day': 29,
+    'week': 83,
+    'month': 364,
+}
+MAX_TIMESERIES_BUCKETS = 2000
+
+
+@extend_schema(
+    tags=['analytics'],
+    parameters=[
+        OpenApiParameter(name='granularity', type=str, enum=list(GRANULARITIES),
+                         description='Bucket size (default: day)'),
+        OpenApiParameter(name='start_date', type=str, description='Start date YYYY-MM-DD'),
+        OpenApiParameter(name='end_date', type=str, description='End date YYYY-MM-DD'),
+        OpenApiParameter(name='task_type', type=int, many=True,
+                         description='Only include these task type IDs (repeat or comma-separate)'),
+    ],
+    responses={
+        200: OpenApiResponse(description='Zero-filled time series'),
+        400: OpenApiResponse(description='Invalid parameters'),
+    },
+    description='Get tracked time bucketed by hour, day, week or month in the user\'s timezone',
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('timeseries')
+def timeseries(request):
+    """
+    Get a zero-filled time series of tracked time.
+    
+    All buckets are computed in one grouped query using the user's timezone,
+    so a chart needs a single request whatever its range or bucket size.
+    Tasks that span several buckets are split across them.
+    """
+    granularity = request.query_params.get('granularity', 'day')
+    if granularity not in GRANULARITIES:
+        return Response(
+            {'error': f"Invalid granularity. Use one of: {', '.join(GRANULARITIES)}"},
+            status=400
+        )
+    
+    end_date_str = request.query_params.get('end_date')
+    start_date_str = request.query_params.get('start_date')
+    
+    try:
+        if end_date_str:
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        else:
+            end_date = local_today(request.user)
+        
+        if start_date_str:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        else:
+            start_date = end_date - timedelta(days=TIMESERIES_DEFAULT_SPANS[granularity])
+    except ValueError:
+        return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
+    
+    if start_date > end_date:
+        return Response({'error': 'start_date must be on or before end_date'}, status=400)
+    
+    try:
+        task_type_ids = _task_type_ids(request)
+    except ValueError:
+        return Response({'error': 'task_type must be a list of integer IDs'}, status=400)
+    
+    tz = user_timezone(request.user)
+    buckets = bucket_starts(granularity, start_date, end_date, tz)
+    if len(buckets) > MAX_TIMESERIES_BUCKETS:
+        return Response(
+            {'error': f'Range too large for {granularity} buckets (max {MAX_TIMESERIES_BUCKETS})'},
+            status=400
+        )
+    
+    range_start, range_end = local_day_range(tz, start_date, end_date)
+    rows = clipped_period_totals(
+        request.user,
+        granularity,
+        tz,
+        start=range_start,
+        end=range_end,
+        task_type_ids=task_type_ids,
+    )
+    
+    series, totals = fill_buckets(
+        rows,
+        buckets,
+        label='start',
+    )
+    summary, total_tracked = summarize_task_types(totals, counts=('task_count',))
     
     return Response({
+        'granularity': granularity,
+        'timezone': str(tz),
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
-        'heatmap': heatmap,
+        'buckets': series,
+        'task_types': summary,
+        'total_tracked': total_tracked,
+        'total_tracked_formatted': format_duration(total_tracked),
     })
 
+
+def _dashboard_ranges(today):
+    """Default (start, end) local dates of each dashboard widget"""
+    return {
+        'summary': (today, today),
+        'weekly': (today - timedelta(days=6), today),
+        'monthly': (today.replace(day=1), today),
+        'heatmap': (today - timedelta(days=89), today),
+    }
+
+
+@extend_schema(
+    tags=['analytics'],
+    parameters=[
+        OpenApiParameter(name='widgets', type=str, many=True, enum=list(DASHBOARD_WIDGETS),
+                         description='Widgets to include (repeat or comma-separate; default: all)'),
+    ],
+    responses={
+        200: OpenApiResponse(description='Requested widgets keyed by name'),
+        400: OpenApiResponse(description='Unknown widget'),
+    },
+    description='Get several analytics widgets in one request',
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('dashboard')
+def dashboard(request):
+    """
+    Get the summary, weekly, monthly and heatmap widgets in one request.
+    
+    Each widget has the same shape as its own endpoint with default
+    parameters. They are all derived from a single rollup query over the
+    widest range any requested widget needs.
+    """
+    widgets = []
+    for param in request.query_params.getlist('widgets'):
+        for name in param.split(','):
+            if not name or name in widgets:
+                continue
+            if name not in DASHBOARD_WIDGETS:
+                return Response(
+                    {'error': f"Unknown widget '{name}'. Use any of: {', '.join(DASHBOARD_WIDGETS)}"},
+                    status=400
+                )
+            widgets.append(name)
+    widgets = widgets or list(DASHBOARD_WIDGETS)
+    
+    today = local_today(request.user)
+    ranges = {name: span for name, span in _dashboard_ranges(today).items() if name in widgets}
+    
+    rows = rollup_day_task_type_totals(DailyRollup.objects.filter(
+        user=request.user,
+        day__gte=min(start for start, _ in ranges.values()),
+        day__lte=today,
+    ))
+    
+    data = {}
+    for name in DASHBOARD_WIDGETS:
+        if name not in ranges:
+            continue
+        start_date, end_date = ranges[name]
+        widget_rows = [row for row in rows if start_date <= row['date'] <= end_date]
+        if name == 'summary':
+            data[name] = _day_payload(today, combine_task_types(widget_rows))
+        elif name == 'weekly':
+            data[name] = _weekly_payload(start_date, end_date, widget_rows)
+        elif name == 'monthly':
+            data[name] = _monthly_payload(start_date, end_date, combine_task_types(widget_rows))
+        else:
+            day_totals = {}
+            for row in widget_rows:
+                day_totals[row['date']] = day_totals.get(row['date'], 0) + row['total_duration']
+            data[name] = _heatmap_payload(start_date, end_date, sorted(day_totals.items()))
+    
+    return Response({
+        'date': today.isoformat(),
+        'widgets': data,
+    })
+
+
+# Default span (days before end_date) of the session statistics
+SESSION_STATS_DEFAULT_SPAN = 29
+# Default and largest break (minutes) that still continues a focus streak
+SESSION_STREAK_MAX_GAP = 5
+SESSION_STREAK_MAX_GAP_LIMIT = 24 * 60
+
+
+@extend_schema(
+    tags=['analytics'],
+    parameters=[
+        OpenApiParameter(name='start_date', type=str, description='Start date YYYY-MM-DD'),
+        OpenApiParameter(name='end_date', type=str, description='End date YYYY-MM-DD'),
+        OpenApiParameter(name='task_type', type=int, many=True,
+                         description='Only include these task type IDs (repeat or comma-separate)'),
+        OpenApiParameter(name='max_gap', type=int,
+                         description=f'Longest break in minutes that continues a focus streak '
+                                     f'(default: {SESSION_STREAK_MAX_GAP})'),
+    ],
+    responses={
+        200: OpenApiResponse(description='Session statistics'),
+        400: OpenApiResponse(description='Invalid parameters'),
+    },
+    description='Get session length percentiles, interruption rates, gaps and the longest focus streak',
+)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@conditional_on_user_data(depends_on_day=True)
+@cached_analytics('sessions')
+def session_stats(request):
+    """
+    Get statistics about sessions (completed tasks) started in a date range.
+    
+    Median and p90 session lengths, interruption rates, gaps between
+    sessions and the longest focus streak are all computed in the database
+    with percentile_cont() and window functions, so no task rows are loaded.
+    """
+    end_date_str = request.query_params.get('end_date')
+    start_date_str = request.query_params.get('start_date')
+    
+    try:
+        if end_date_str:
+            end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
+        else:
+            end_date = local_today(request.user)
+        
+        if start_date_str:
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
+        else:
+            start_date = end_date - timedelta(days=SESSION_STATS_DEFAULT_SPAN)
+    except ValueError:
+        return Response({'error': 'Invalid date format. Use YYYY-MM-DD'}, status=400)
+    
+    if start_date > end_date:
+        return Response({'error': 'start_date must be on or before end_date'}, status=400)
+    
+    try:
+        task_type_ids = _task_type_ids(request)
+    except ValueError:
+        return Response({'error': 'task_type must be a list of integer IDs'}, status=400)
+    
+    try:
+        max_gap = int(request.query_params.get('max_gap', SESSION_STREAK_MAX_GAP))
+    except ValueError:
+        max_gap = -1
+    if not 0 <= max_gap <= SESSION_STREAK_MAX_GAP_LIMIT:
+        return Response(
+            {'error': f'max_gap must be a whole number of minutes from 0 to {SESSION_STREAK_MAX_GAP_LIMIT}'},
+            status=400
+        )
+    
+    tz = user_timezone(request.user)
+    range_start, range_end = local_day_range(tz, start_date, end_date)
+    stats = session_statistics(
+        request.user,
+        tz,
+        range_start,
+        range_end,
+        max_gap=timedelta(minutes=max_gap),
+        task_type_ids=task_type_ids,
+    )
+    
+    streak = stats['longest_streak']
+    if streak is not None:
+        streak = {
+            'start': streak['start'].astimezone(tz).isoformat(),
+            'end': streak['end'].astimezone(tz).isoformat(),
+            'session_count': streak['session_count'],
+            'total_duration': streak['total_duration'],
+            'total_formatted': format_duration(streak['total_duration']),
+        }
+    
+    return Response({
+        'timezone': str(tz),
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'max_gap_minutes': max_gap,
+        'task_types': stats['task_types'],
+        'overall': stats['overall'],
+        'gaps': stats['gaps'],
+        'longest_streak': streak,
+    })
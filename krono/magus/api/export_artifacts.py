@@ -0,0 +1,151 @@
+from datetime import timedelta
+
+from django.core import signing
+from django.db import transaction
+from django.urls import reverse
+from drf_spectacular.utils import OpenApiResponse, extend_schema, extend_schema_view
+from rest_framework import serializers, status, viewsets
+from rest_framework.decorators import (
+    api_view,
+    authentication_classes,
+    permission_classes,
+)
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.response import Response
+
+from magus.artifacts import (
+    artifact_from_token,
+    artifact_response,
+    cached_artifact,
+    delete_artifact,
+    download_token,
+    export_cache_key,
+)
+from magus.dates import local_today
+from magus.exporting import DEFAULT_EXPORT_FORMAT, EXPORT_FORMATS, get_export_format
+from magus.models import ExportArtifact
+from magus.tasks import build_export_artifact
+
+
+class ExportArtifactSerializer(serializers.ModelSerializer):
+    """Serializer for export artifacts, with a signed download link once ready"""
+
+    format = serializers.ChoiceField(
+        source='export_format',
+        choices=list(EXPORT_FORMATS),
+        default=DEFAULT_EXPORT_FORMAT,
+    )
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ExportArtifact
+        fields = [
+            'id',
+            'format',
+            'start_date',
+            'end_date',
+            'status',
+            'size',
+            'error',
+            'created_at',
+            'completed_at',
+            'download_url',
+        ]
+        read_only_fields = ['id', 'status', 'size', 'error', 'created_at', 'completed_at']
+
+    def validate(self, attrs):
+        """Default to the last 30 local days and check the range"""
+        today = local_today(self.context['request'].user)
+        attrs.setdefault('end_date', today)
+        attrs.setdefault('start_date', attrs['end_date'] - timedelta(days=30))
+        if attrs['start_date'] > attrs['end_date']:
+            raise serializers.ValidationError({'start_date': 'Must be on or before end_date'})
+        return attrs
+
+    def get_download_url(self, obj):
+        """Short-lived signed link, issued fresh on every read of a ready artifact"""
+        if obj.status != 'ready':
+            return None
+        path = reverse('api:export_artifact_download', args=[download_token(obj)])
+        return self.context['request'].build_absolute_uri(path)
+
+
+@extend_schema_view(
+    list=extend_schema(tags=['export'], description='List export artifacts'),
+    create=extend_schema(tags=['export'], description='Queue an export to be written to disk'),
+    retrieve=extend_schema(tags=['export'], description='Get export status and, once ready, a download link'),
+    destroy=extend_schema(tags=['export'], description='Delete an export artifact'),
+)
+class ExportArtifactViewSet(viewsets.ModelViewSet):
+    """
+    ViewSet for disk-spooled exports.
+
+    Creating an artifact queues a Celery job that writes the file; poll it
+    until status is 'ready', then follow download_url.
+    """
+    serializer_class = ExportArtifactSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete']
+
+    def get_queryset(self):
+        """Filter by current user"""
+        return ExportArtifact.objects.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        """Reuse an identical ready export, or queue the job once the artifact row is committed"""
+        data = serializer.validated_data
+        cache_key = export_cache_key(
+            self.request.user,
+            data['start_date'],
+            data['end_date'],
+            get_export_format(data['export_format']),
+        )
+        existing = cached_artifact(self.request.user, cache_key) if cache_key else None
+        if existing is not None:
+            serializer.instance = existing
+            return
+
+        artifact = serializer.save(user=self.request.user, cache_key=cache_key or '')
+        transaction.on_commit(lambda: build_export_artifact.delay(artifact.id))
+
+    def perform_destroy(self, instance):
+        """Remove the file along with the artifact"""
+        delete_artifact(instance)
+
+
+@extend_schema(
+    tags=['export'],
+    responses={
+        200: OpenApiResponse(description='Export file'),
+        404: OpenApiResponse(description='Unknown link or artifact not available'),
+        410: OpenApiResponse(description='Download link expired'),
+    },
+    description='Download an export artifact through a signed link (no authentication header needed)',
+)
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([AllowAny])
+def download_export_artifact(request, token):
+    """
+    Serve an export artifact from a signed link.
+
+    The signature is the credential, so links can be opened directly by a
+    browser. The file body itself is sent by nginx (X-Accel-Redirect).
+    """
+    try:
+        artifact = artifact_from_token(token)
+    except signing.SignatureExpired:
+        return Response({'error': 'Download link expired'}, status=status.HTTP_410_GONE)
+    except signing.BadSignature:
+        artifact = None
+
+    if artifact is None:
+        return Response({'error': 'Export not found'}, status=status.HTTP_404_NOT_FOUND)
+
+    try:
+        return artifact_response(artifact)
+    except FileNotFoundError:
+        # Evicted from the export cache since the link was issued
+        return Response({'error': 'Export no longer available'}, status=status.HTTP_410_GONE)
@@ -1,17 +1,45 @@
-import csv
-import io
-from datetime import datetime
-from django.utils import timezone
+from datetime import datetime, timedelta
+from django.http import StreamingHttpResponse
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
+from rest_framework.negotiation import DefaultContentNegotiation
 from drf_spectacular.utils import extend_schema, OpenApiResponse, OpenApiParameter
 
-from magus.models import Task
+from magus.artifacts import artifact_response, cache_while_streaming, cached_artifact, export_cache_key
+from magus.dates import local_today
+from magus.exporting import (
+    DEFAULT_EXPORT_FORMAT,
+    EXPORT_FORMATS,
+    export_blocks,
+    export_filename,
+    get_export_format,
+    user_export_records,
+)
 from magus.tasks import send_csv_export_email
 
 
+class ExportContentNegotiation(DefaultContentNegotiation):
+    """
+    Content negotiation for export views.
+    
+    ?format= selects the export format here rather than a DRF renderer, so
+    responses that are not exports (errors) are always rendered as JSON.
+    """
+    
+    def select_renderer(self, request, renderers, format_suffix=None):
+        """Pick the first configured renderer, ignoring ?format="""
+        renderer = renderers[0]
+        return renderer, renderer.media_type
+
+
+def export_negotiation(view):
+    """Use ExportContentNegotiation on a function view (apply above @api_view)"""
+    view.cls.content_negotiation_class = ExportContentNegotiation
+    return view
+
+
 @extend_schema(
     tags=['export'],
     request={
@@ -21,21 +49,23 @@ from magus.tasks import send_csv_export_email
                 'start_date': {'type': 'string', 'description': 'YYYY-MM-DD'},
                 'end_date': {'type': 'string', 'description': 'YYYY-MM-DD'},
                 'email_to': {'type': 'string', 'format': 'email'},
+                'format': {'type': 'string', 'enum': list(EXPORT_FORMATS),
+                           'description': f'Export format (default: {DEFAULT_EXPORT_FORMAT})'},
             },
             'required': ['email_to']
         }
     },
     responses={
-        200: OpenApiResponse(description='CSV export queued successfully'),
+        200: OpenApiResponse(description='Export queued successfully'),
         400: OpenApiResponse(description='Invalid request'),
     },
-    description='Generate CSV export and send via email',
+    description='Generate an export and send via email',
 )
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def export_csv(request):
     """
-    Generate CSV export of time tracking data and email it.
+    Generate an export of time tracking data and email it.
     
     Queues a Celery task to generate and send the export asynchronously.
     """
@@ -49,17 +79,22 @@ def export_csv(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     
+    try:
+        export_format = get_export_format(request.data.get('format'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
     # Parse dates
     try:
         if start_date_str:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
         else:
-            start_date = timezone.now().date() - timezone.timedelta(days=30)
+            start_date = local_today(request.user) - timedelta(days=30)
         
         if end_date_str:
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
         else:
-            end_date = timezone.now().date()
+            end_date = local_today(request.user)
     except ValueError:
         return Response(
             {'error': 'Invalid date format. Use YYYY-MM-DD'},
@@ -71,11 +106,13 @@ def export_csv(request):
         request.user.id,
         start_date.isoformat(),
         end_date.isoformat(),
-        email_to
+        email_to,
+        export_format.name,
     )
     
     return Response({
-        'message': f'CSV export queued. You will receive it at {email_to} shortly.',
+        'message': f'Export queued. You will receive it at {email_to} shortly.',
+        'format': export_format.name,
         'start_date': start_date.isoformat(),
         'end_date': end_date.isoformat(),
     })
@@ -83,93 +120,70 @@ def export_csv(request):
 
 @extend_schema(
     tags=['export'],
-    responses={200: OpenApiResponse(description='Download CSV file')},
+    responses={200: OpenApiResponse(description='Download export file')},
     parameters=[
         OpenApiParameter(name='start_date', type=str, description='YYYY-MM-DD'),
         OpenApiParameter(name='end_date', type=str, description='YYYY-MM-DD'),
+        OpenApiParameter(name='format', type=str, enum=list(EXPORT_FORMATS),
+                         description=f'Export format (default: {DEFAULT_EXPORT_FORMAT})'),
     ],
-    description='Download CSV export directly (no email)',
+    description='Download an export directly (no email)',
 )
+@export_negotiation
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def download_csv(request):
     """
-    Generate and download CSV export directly.
+    Generate and download an export directly.
     
-    Useful for immediate downloads without email.
+    Useful for immediate downloads without email. Rows are streamed from a
+    server-side cursor, so memory stays bounded and the first bytes are sent
+    right away. The stream is also stored as a cached artifact, so repeat
+    requests for unchanged data are served from disk.
     """
-    from django.http import HttpResponse
-    
     start_date_str = request.query_params.get('start_date')
     end_date_str = request.query_params.get('end_date')
     
+    try:
+        export_format = get_export_format(request.query_params.get('format'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
     # Parse dates
     try:
         if start_date_str:
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
         else:
-            start_date = timezone.now().date() - timezone.timedelta(days=30)
+            start_date = local_today(request.user) - timedelta(days=30)
         
         if end_date_str:
             end_date = datetime.strptime(end_date_str, '%Y-%m-%d').date()
         else:
-            end_date = timezone.now().date()
+            end_date = local_today(request.user)
     except ValueError:
         return Response(
             {'error': 'Invalid date format. Use YYYY-MM-DD'},
             status=status.HTTP_400_BAD_REQUEST
         )
     
-    # Get tasks
-    tasks = Task.objects.filter(
-        user=request.user,
-        start_time__date__gte=start_date,
-        start_time__date__lte=end_date,
-        end_time__isnull=False
-    ).select_related('task_type').order_by('start_time')
+    # Unchanged data: serve the export stored by an earlier identical request
+    cache_key = export_cache_key(request.user, start_date, end_date, export_format)
+    artifact = cached_artifact(request.user, cache_key) if cache_key else None
+    if artifact is not None:
+        response = artifact_response(artifact)
+        response['X-Export-Cache'] = 'HIT'
+        return response
     
-    # Generate CSV
-    output = io.StringIO()
-    writer = csv.writer(output)
-    
-    # Header
-    writer.writerow([
-        'Date',
-        'Task Type',
-        'Start Time',
-        'End Time',
-        'Duration (HH:MM:SS)',
-        'Interrupted',
-        'Notes',
-        'Edited'
-    ])
-    
-    # Rows
-    for task in tasks:
-        duration_seconds = task.duration
-        hours = int(duration_seconds // 3600)
-        minutes = int((duration_seconds % 3600) // 60)
-        seconds = int(duration_seconds % 60)
-        duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-        
-        # Convert to user timezone (would use profile timezone in production)
-        start_local = timezone.localtime(task.start_time)
-        end_local = timezone.localtime(task.end_time) if task.end_time else None
-        
-        writer.writerow([
-            start_local.strftime('%Y-%m-%d'),
-            task.task_type.name,
-            start_local.strftime('%Y-%m-%d %H:%M:%S'),
-            end_local.strftime('%Y-%m-%d %H:%M:%S') if end_local else '',
-            duration_str,
-            'Yes' if task.interrupted else 'No',
-            task.notes,
-            'Yes' if task.edited_by_user else 'No',
-        ])
+    records = user_export_records(request.user, start_date, end_date)
+    blocks = export_blocks(export_format, records)
+    if cache_key:
+        blocks = cache_while_streaming(request.user, start_date, end_date, export_format, cache_key, blocks)
     
-    # Create response
-    response = HttpResponse(output.getvalue(), content_type='text/csv')
-    response['Content-Disposition'] = f'attachment; filename="magus_export_{start_date}_{end_date}.csv"'
+    # Stream the export as it is produced instead of building it in memory
+    response = StreamingHttpResponse(blocks, content_type=export_format.content_type)
+    filename = export_filename(export_format, start_date, end_date)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['X-Export-Cache'] = 'MISS'
     
     return response
 
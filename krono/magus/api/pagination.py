@@ -0,0 +1,167 @@
+"""
+Keyset (cursor) pagination for the task list
+
+Pages are selected by position, (ordering field, id) of the last row seen,
+rather than by OFFSET, so every page costs the same index range scan however
+deep the client has scrolled, and rows inserted or deleted meanwhile never
+shift a page. The id tiebreaker makes positions unique even when several
+tasks share a start time. Counting the whole result is optional.
+"""
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+Cursor = namedtuple('Cursor', ['value', 'pk', 'reverse'])
+
+
+class TaskCursorPagination(BasePagination):
+    """
+    Paginate tasks by (start_time, id), or by end_time or created_at.
+
+    The ordering comes from the view's ?ordering= parameter (first field
+    only). Opaque cursors in the next/previous links point at the first or
+    last row of the page; ?count=true adds the total number of rows.
+    Positions must be datetimes; a NULL (the open task's end_time) sorts
+    after every value.
+    """
+
+    page_size = api_settings.PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    ordering_fields = ('start_time', 'end_time', 'created_at')
+    default_ordering = '-start_time'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return one page of rows after (or, going back, before) the cursor position"""
+        self.request = request
+        self.field, self.descending = self.get_ordering(request, queryset, view)
+        self.nullable = queryset.model._meta.get_field(self.field).null
+        cursor = self.decode_cursor(request)
+
+        self.count = None
+        if request.query_params.get(self.count_query_param, '').lower() in ('true', '1', 'yes'):
+            self.count = queryset.count()
+
+        reverse = cursor is not None and cursor.reverse
+        descending = self.descending != reverse
+        if cursor is not None:
+            queryset = queryset.filter(self._beyond(cursor.value, cursor.pk, descending))
+
+        # NULLs placed explicitly, to match _beyond() on every backend
+        if descending:
+            ordering = (F(self.field).desc(nulls_first=True), F('pk').desc())
+        else:
+            ordering = (F(self.field).asc(nulls_last=True), F('pk').asc())
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        """Wrap a page with its links (and the total, when requested)"""
+        body = {'next': self.get_next_link(), 'previous': self.get_previous_link()}
+        if self.count is not None:
+            body['count'] = self.count
+        body['results'] = data
+        return Response(body)
+
+    def get_paginated_response_schema(self, schema):
+        """OpenAPI schema of a paginated response"""
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'count': {'type': 'integer', 'description': 'Total rows, only with ?count=true'},
+                'results': schema,
+            },
+        }
+
+    def get_schema_operation_parameters(self, view):
+        """OpenAPI query parameters of the paginator"""
+        return [
+            {
+                'name': self.cursor_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Cursor from a next or previous link',
+                'schema': {'type': 'string'},
+            },
+            {
+                'name': self.count_query_param,
+                'required': False,
+                'in': 'query',
+                'description': 'Include the total number of rows (costs a COUNT query)',
+                'schema': {'type': 'boolean'},
+            },
+        ]
+
+    def get_ordering(self, request, queryset, view):
+        """Return (field, descending) from ?ordering=, falling back to the default"""
+        ordering = OrderingFilter().get_ordering(request, queryset, view) or [self.default_ordering]
+        term = ordering[0]
+        if term.lstrip('-') not in self.ordering_fields:
+            term = self.default_ordering
+        return term.lstrip('-'), term.startswith('-')
+
+    def get_next_link(self):
+        """Link to the page after this one"""
+        if not (self.has_next and self.page):
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        """Link to the page before this one"""
+        if not (self.has_previous and self.page):
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    def encode_cursor(self, row, reverse):
+        """Return the URL of the page next to a row"""
+        value = getattr(row, self.field)
+        payload = [value.isoformat() if value is not None else None, row.pk, reverse]
+        token = base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        """Parse the ?cursor= parameter, or return None for the first page"""
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            value, pk, reverse = json.loads(base64.urlsafe_b64decode(token.encode()))
+            value = datetime.fromisoformat(value) if value is not None else None
+            return Cursor(value=value, pk=int(pk), reverse=bool(reverse))
+        except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def _beyond(self, value, pk, descending):
+        """Filter for rows after (value, pk) in the given direction, NULLs sorting last"""
+        op = 'lt' if descending else 'gt'
+        field = self.field
+        if value is None:
+            beyond = Q(**{f'{field}__isnull': True, f'pk__{op}': pk})
+            return beyond | Q(**{f'{field}__isnull': False}) if descending else beyond
+
+        beyond = Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'pk__{op}': pk})
+        if self.nullable and not descending:
+            beyond |= Q(**{f'{field}__isnull': True})
+        return beyond
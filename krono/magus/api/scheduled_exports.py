@@ -16,6 +16,8 @@ class ScheduledExportSerializer(serializers.ModelSerializer):
             'frequency',
             'email_to',
             'is_active',
+            'incremental',
+            'include_deletions',
             'last_sent',
             'next_scheduled',
             'created_at',
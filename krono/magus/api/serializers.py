@@ -116,7 +116,13 @@ class TaskTypeSerializer(serializers.ModelSerializer):
 
 
 class TaskSerializer(serializers.ModelSerializer):
-    """Task serializer with nested task type"""
+    """
+    Task serializer with nested task type.
+
+    List responses can opt into a compact representation: task_type as an
+    ID (the task types being sent once alongside, see TaskViewSet.list())
+    and a sparse fieldset.
+    """
     
     task_type_detail = TaskTypeSerializer(source='task_type', read_only=True)
     task_type = serializers.PrimaryKeyRelatedField(
@@ -143,7 +149,13 @@ class TaskSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at', 'updated_at', 'duration']
     
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, fields=None, side_load_types=False, **kwargs):
+        """
+        Args:
+            fields: Only render these fields
+            side_load_types: Render task_type as an ID instead of nesting
+                task_type_detail
+        """
         super().__init__(*args, **kwargs)
         # Set queryset for task_type based on request user
         request = self.context.get('request')
@@ -152,6 +164,18 @@ class TaskSerializer(serializers.ModelSerializer):
                 user=request.user,
                 is_archived=False
             )
+        
+        if side_load_types:
+            self.fields.pop('task_type_detail')
+            self.fields['task_type'] = serializers.IntegerField(source='task_type_id', read_only=True)
+        
+        if fields is not None:
+            readable = {name for name, field in self.fields.items() if not field.write_only}
+            unknown = set(fields) - readable
+            if unknown:
+                raise serializers.ValidationError({'fields': f"Unknown fields: {', '.join(sorted(unknown))}"})
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
     
     def get_duration(self, obj):
         """Calculate duration in seconds"""
@@ -0,0 +1,164 @@
+from django.conf import settings
+from rest_framework import serializers
+
+from magus.batching import apply_task_batch
+from magus.models import Task, TaskType
+
+from .serializers import TaskSerializer
+
+BATCH_OPERATIONS = ('create', 'update', 'delete')
+
+STATUS_CODES = {'create': 201, 'update': 200, 'delete': 204}
+
+
+class BatchTaskSerializer(TaskSerializer):
+    """
+    Task serializer for the items of a batch.
+
+    Task types are looked up in context['task_types'] (prefetched once per
+    batch) instead of with one query per item.
+    """
+
+    task_type = serializers.IntegerField(write_only=True)
+
+    def validate_task_type(self, value):
+        """Resolve the task type from the prefetched active task types"""
+        task_type = self.context['task_types'].get(value)
+        if task_type is None:
+            raise serializers.ValidationError('Invalid task type ID.')
+        return task_type
+
+    def validate(self, attrs):
+        """Validate task times, including a partial update against the stored ones"""
+        if self.instance is not None:
+            start_time = attrs.get('start_time', self.instance.start_time)
+            end_time = attrs.get('end_time', self.instance.end_time)
+            if end_time and end_time <= start_time:
+                raise serializers.ValidationError(
+                    {"end_time": "End time must be after start time."}
+                )
+        return super().validate(attrs)
+
+
+class TaskOperationSerializer(serializers.Serializer):
+    """One operation of a batch: create (data), update (id, partial data) or delete (id)"""
+
+    op = serializers.ChoiceField(choices=BATCH_OPERATIONS)
+    id = serializers.IntegerField(required=False)
+    data = serializers.DictField(required=False, default=dict)
+
+    def validate(self, attrs):
+        """Require the task ID for updates and deletes"""
+        if attrs['op'] != 'create' and 'id' not in attrs:
+            raise serializers.ValidationError({'id': 'This field is required for updates and deletes.'})
+        return attrs
+
+
+class TaskBatchSerializer(serializers.Serializer):
+    """
+    Create, update and delete tasks in one request.
+
+    All operations are validated together before anything is written (with
+    three queries, whatever the batch size); if any is invalid, the errors
+    are returned per operation and nothing is applied. Otherwise the batch
+    is written in one transaction (see magus.batching).
+    """
+
+    operations = TaskOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, operations):
+        """Validate every operation against the user's tasks and task types"""
+        if len(operations) > settings.TASK_BATCH_MAX_OPERATIONS:
+            raise serializers.ValidationError(
+                f'At most {settings.TASK_BATCH_MAX_OPERATIONS} operations per batch.'
+            )
+
+        user = self.context['request'].user
+        tasks = Task.objects.select_related('task_type').filter(user=user).in_bulk(
+            [operation['id'] for operation in operations if 'id' in operation]
+        )
+        context = {
+            **self.context,
+            'task_types': TaskType.objects.filter(user=user, is_archived=False).in_bulk(),
+        }
+        open_ids = set(Task.objects.filter(user=user, end_time__isnull=True).values_list('id', flat=True))
+
+        errors, seen, opening = [], set(), []
+        for index, operation in enumerate(operations):
+            task_id = operation.get('id')
+            if task_id is not None and task_id in seen:
+                errors.append({'id': ['Task appears in more than one operation.']})
+                continue
+            if task_id is not None and task_id not in tasks:
+                errors.append({'id': ['Not found.']})
+                continue
+            seen.add(task_id)
+            task = tasks.get(task_id)
+            open_ids.discard(task_id)
+
+            if operation['op'] == 'delete':
+                operation['task'] = task
+                errors.append({})
+                continue
+
+            serializer = BatchTaskSerializer(
+                task,
+                data=operation['data'],
+                partial=task is not None,
+                context=context,
+            )
+            if not serializer.is_valid():
+                errors.append(serializer.errors)
+                continue
+
+            operation['task'] = task
+            operation['changes'] = serializer.validated_data
+            end_time = serializer.validated_data.get('end_time', task.end_time if task else None)
+            if end_time is None:
+                opening.append(index)
+            errors.append({})
+
+        # At most one open task may remain (see the one open task per user constraint)
+        if len(opening) + len(open_ids) > 1:
+            for index in opening:
+                errors[index] = {'end_time': ['Already tracking a task; an end time is required.']}
+
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return operations
+
+    def create(self, validated_data):
+        """Apply the batch and return its operations with the written tasks"""
+        user = self.context['request'].user
+        operations = validated_data['operations']
+
+        created, updated, deleted, update_fields = [], [], [], set()
+        for operation in operations:
+            if operation['op'] == 'delete':
+                deleted.append(operation['task'])
+            elif operation['op'] == 'create':
+                operation['task'] = Task(user=user, is_manual_entry=True, **operation['changes'])
+                created.append(operation['task'])
+            else:
+                task = operation['task']
+                for field, value in operation['changes'].items():
+                    setattr(task, field, value)
+                task.edited_by_user = True
+                update_fields.update(operation['changes'], ['edited_by_user'])
+                updated.append(task)
+
+        apply_task_batch(user, created=created, updated=updated, deleted=deleted, update_fields=update_fields)
+        return operations
+
+    def to_representation(self, operations):
+        """Per-operation results, in request order"""
+        results = []
+        for operation in operations:
+            result = {'op': operation['op'], 'status': STATUS_CODES[operation['op']]}
+            if operation['op'] == 'delete':
+                result['id'] = operation['id']
+            else:
+                result['id'] = operation['task'].pk
+                result['task'] = TaskSerializer(operation['task'], context=self.context).data
+            results.append(result)
+        return {'results': results}
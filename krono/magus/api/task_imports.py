@@ -0,0 +1,48 @@
+from drf_spectacular.utils import extend_schema, extend_schema_view
+from rest_framework import serializers, viewsets
+from rest_framework.permissions import IsAuthenticated
+
+from magus.models import TaskImport
+
+
+class TaskImportSerializer(serializers.ModelSerializer):
+    """Serializer for background task imports and their progress"""
+
+    format = serializers.CharField(source='import_format', read_only=True)
+
+    class Meta:
+        model = TaskImport
+        fields = [
+            'id',
+            'format',
+            'create_types',
+            'status',
+            'total_rows',
+            'processed_rows',
+            'created_count',
+            'skipped_count',
+            'errors',
+            'error',
+            'created_at',
+            'completed_at',
+        ]
+        read_only_fields = fields
+
+
+@extend_schema_view(
+    list=extend_schema(tags=['tasks'], description='List background task imports'),
+    retrieve=extend_schema(tags=['tasks'], description='Get the progress and outcome of a task import'),
+)
+class TaskImportViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for background task imports.
+
+    Imports are started by uploading a file to /api/tasks/import/; poll the
+    import until status is 'done' or 'failed'.
+    """
+    serializer_class = TaskImportSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        """Filter by current user"""
+        return TaskImport.objects.filter(user=self.request.user)
@@ -4,6 +4,8 @@ from rest_framework_simplejwt.views import TokenRefreshView
 from . import views, analytics, exports
 from .viewsets import TaskTypeViewSet, TaskViewSet
 from .scheduled_exports import ScheduledExportViewSet
+from .export_artifacts import ExportArtifactViewSet, download_export_artifact
+from .task_imports import TaskImportViewSet
 from .api_keys import APIKeyViewSet
 
 app_name = 'api'
@@ -12,7 +14,9 @@ app_name = 'api'
 router = DefaultRouter()
 router.register(r'task-types', TaskTypeViewSet, basename='tasktype')
 router.register(r'tasks', TaskViewSet, basename='task')
+router.register(r'task-imports', TaskImportViewSet, basename='taskimport')
 router.register(r'scheduled-exports', ScheduledExportViewSet, basename='scheduledexport')
+router.register(r'export/artifacts', ExportArtifactViewSet, basename='exportartifact')
 router.register(r'api-keys', APIKeyViewSet, basename='apikey')
 
 urlpatterns = [
@@ -34,12 +38,16 @@ urlpatterns = [
     path('analytics/weekly/', analytics.weekly_breakdown, name='analytics_weekly'),
     path('analytics/monthly/', analytics.monthly_breakdown, name='analytics_monthly'),
     path('analytics/heatmap/', analytics.heatmap_data, name='analytics_heatmap'),
+    path('analytics/timeseries/', analytics.timeseries, name='analytics_timeseries'),
+    path('analytics/dashboard/', analytics.dashboard, name='analytics_dashboard'),
+    path('analytics/sessions/', analytics.session_stats, name='analytics_sessions'),
     
     # Export
     path('export/csv/', exports.export_csv, name='export_csv'),
     path('export/download/', exports.download_csv, name='export_download'),
+    path('export/artifacts/download/<str:token>/', download_export_artifact, name='export_artifact_download'),
     
-    # ViewSet routes (task-types, tasks, scheduled-exports)
+    # ViewSet routes (task-types, tasks, task-imports, scheduled-exports, ...)
     path('', include(router.urls)),
 ]
 
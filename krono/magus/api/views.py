@@ -5,6 +5,7 @@ from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework_simplejwt.tokens import RefreshToken
 from drf_spectacular.utils import extend_schema, OpenApiResponse
 
+from magus.rollups import rebuild_user_rollups
 from .serializers import (
     UserSerializer,
     RegisterSerializer,
@@ -157,10 +158,16 @@ def profile_detail_view(request):
 def profile_update_view(request):
     """Update current user's profile"""
     profile = request.user.profile
+    previous_timezone = profile.timezone
     serializer = ProfileSerializer(profile, data=request.data, partial=True)
     
     if serializer.is_valid():
         serializer.save()
+        
+        # Rollups are bucketed by local day, so re-bucket them in the new zone
+        if profile.timezone != previous_timezone:
+            rebuild_user_rollups(request.user)
+        
         return Response(serializer.data)
     
     return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
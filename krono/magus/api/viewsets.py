@@ -1,13 +1,28 @@
+from datetime import datetime
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils.decorators import method_decorator
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.exceptions import ValidationError
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiResponse, OpenApiParameter
 
-from magus.models import TaskType, Task
+from magus.caching import bump_data_version_on_commit, conditional_on_user_data
+from magus.current_task import cached_current_task, drop_current_task, with_duration
+from magus.dates import start_time_range
+from magus.exporting import EXPORT_FORMATS, get_export_format
+from magus.importing import import_format_for, import_tasks, open_text, save_upload
+from magus.models import TaskType, Task, TaskImport
+from magus.tasks import import_task_file
+from .pagination import TaskCursorPagination
 from .serializers import TaskTypeSerializer, TaskSerializer
+from .task_batches import TaskBatchSerializer
+from .task_imports import TaskImportSerializer
 
 
 @extend_schema_view(
@@ -50,6 +65,8 @@ from .serializers import TaskTypeSerializer, TaskSerializer
         description='Archive a task type (soft delete)',
     ),
 )
+@method_decorator(conditional_on_user_data(), name='list')
+@method_decorator(conditional_on_user_data(), name='retrieve')
 class TaskTypeViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing task types.
@@ -146,6 +163,9 @@ class TaskTypeViewSet(viewsets.ModelViewSet):
         for index, task_type_id in enumerate(task_type_ids):
             TaskType.objects.filter(id=task_type_id).update(sort_order=index)
         
+        # Queryset updates bypass the model signals
+        bump_data_version_on_commit(request.user.id)
+        
         return Response({'message': 'Task types reordered successfully'})
     
     @extend_schema(
@@ -192,7 +212,7 @@ class TaskTypeViewSet(viewsets.ModelViewSet):
 @extend_schema_view(
     list=extend_schema(
         tags=['tasks'],
-        description='List all tasks for the current user',
+        description='List the tasks of the current user in cursor-paginated pages (follow the next link)',
         parameters=[
             OpenApiParameter(
                 name='start_date',
@@ -218,6 +238,19 @@ class TaskTypeViewSet(viewsets.ModelViewSet):
                 description='Filter by interrupted status',
                 required=False
             ),
+            OpenApiParameter(
+                name='include',
+                type=str,
+                enum=['task_types'],
+                description='Side-load task types: tasks carry task_type IDs and the types are listed once under "included"',
+                required=False
+            ),
+            OpenApiParameter(
+                name='fields',
+                type=str,
+                description='Comma-separated task fields to return (sparse fieldset)',
+                required=False
+            ),
         ]
     ),
     create=extend_schema(
@@ -241,6 +274,7 @@ class TaskTypeViewSet(viewsets.ModelViewSet):
         description='Delete a task entry',
     ),
 )
+@method_decorator(conditional_on_user_data(skip_while_tracking=True), name='list')
 class TaskViewSet(viewsets.ModelViewSet):
     """
     ViewSet for managing time tracking tasks.
@@ -253,32 +287,101 @@ class TaskViewSet(viewsets.ModelViewSet):
     filterset_fields = ['task_type', 'interrupted', 'is_manual_entry']
     ordering_fields = ['start_time', 'end_time', 'created_at']
     ordering = ['-start_time']
+    pagination_class = TaskCursorPagination
     
     def get_queryset(self):
         """Filter tasks by current user and optional date range"""
-        queryset = Task.objects.filter(user=self.request.user)
+        queryset = Task.objects.filter(user=self.request.user).select_related('task_type')
         
-        # Date filtering
-        start_date = self.request.query_params.get('start_date')
-        end_date = self.request.query_params.get('end_date')
+        # Date filtering on the user's local days
+        start_date = self._parse_date_param('start_date')
+        end_date = self._parse_date_param('end_date')
         
-        if start_date:
-            queryset = queryset.filter(start_time__date__gte=start_date)
-        if end_date:
-            queryset = queryset.filter(start_time__date__lte=end_date)
+        if start_date or end_date:
+            queryset = queryset.filter(**start_time_range(self.request.user, start_date, end_date))
         
         return queryset
     
+    def list(self, request, *args, **kwargs):
+        """
+        List tasks.
+        
+        ?include=task_types renders task_type as an ID and sends the page's
+        task types once under 'included' instead of nesting one per task;
+        ?fields= limits each task to the given fields.
+        """
+        side_load_types = 'task_types' in self._parse_list_param('include')
+        fields = self._parse_list_param('fields') or None
+        if not (side_load_types or fields):
+            return super().list(request, *args, **kwargs)
+        
+        queryset = self.filter_queryset(self.get_queryset())
+        if side_load_types:
+            queryset = queryset.select_related(None)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True, fields=fields, side_load_types=side_load_types)
+        response = self.get_paginated_response(serializer.data)
+        
+        if side_load_types:
+            task_types = TaskType.objects.filter(
+                user=request.user,
+                id__in={task.task_type_id for task in page}
+            )
+            response.data['included'] = {'task_types': TaskTypeSerializer(task_types, many=True).data}
+        return response
+    
+    def _parse_list_param(self, name):
+        """Parse an optional comma-separated query parameter"""
+        value = self.request.query_params.get(name, '')
+        return [item.strip() for item in value.split(',') if item.strip()]
+    
+    def _parse_date_param(self, name):
+        """Parse an optional YYYY-MM-DD query parameter"""
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+        try:
+            return datetime.strptime(value, '%Y-%m-%d').date()
+        except ValueError:
+            raise ValidationError({name: 'Invalid date format. Use YYYY-MM-DD'})
+    
     def perform_create(self, serializer):
         """Automatically set user and mark as manual entry"""
-        serializer.save(
-            user=self.request.user,
-            is_manual_entry=True
-        )
+        self._save_task(serializer, user=self.request.user, is_manual_entry=True)
     
     def perform_update(self, serializer):
         """Mark task as edited when updated"""
-        serializer.save(edited_by_user=True)
+        self._save_task(serializer, edited_by_user=True)
+    
+    def _save_task(self, serializer, **kwargs):
+        """Save a task, rejecting a second open task for the user"""
+        try:
+            with transaction.atomic():
+                serializer.save(**kwargs)
+        except IntegrityError:
+            drop_current_task(self.request.user.id)
+            raise ValidationError({'end_time': 'Already tracking a task; an end time is required.'})
+    
+    def _already_tracking(self, tracking):
+        """Build the 400 response for starting a task while another one is open"""
+        return Response(
+            {
+                'error': 'Already tracking a task',
+                'current_task_id': tracking['id'] if tracking else None,
+                'current_task_type': tracking['task_type_detail']['name'] if tracking else None,
+            },
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    def _lost_start_race(self):
+        """
+        Handle a start rejected by the one open task per user constraint.
+        
+        A concurrent request started a task first (and may have left this
+        request's pointer read stale), so rebuild the pointer from the database.
+        """
+        drop_current_task(self.request.user.id)
+        return self._already_tracking(cached_current_task(self.request.user))
     
     @extend_schema(
         tags=['tasks'],
@@ -311,21 +414,11 @@ class TaskViewSet(viewsets.ModelViewSet):
         """
         from django.utils import timezone
         
-        # Check if already tracking
-        current_task = Task.objects.filter(
-            user=request.user,
-            end_time__isnull=True
-        ).first()
+        # Check if already tracking (from the current task pointer)
+        tracking = cached_current_task(request.user)
         
-        if current_task:
-            return Response(
-                {
-                    'error': 'Already tracking a task',
-                    'current_task_id': current_task.id,
-                    'current_task_type': current_task.task_type.name,
-                },
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        if tracking:
+            return self._already_tracking(tracking)
         
         task_type_id = request.data.get('task_type_id')
         notes = request.data.get('notes', '')
@@ -349,13 +442,17 @@ class TaskViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Create new task
-        task = Task.objects.create(
-            user=request.user,
-            task_type=task_type,
-            start_time=timezone.now(),
-            notes=notes
-        )
+        # Create new task (a concurrent start is caught by the one open task constraint)
+        try:
+            with transaction.atomic():
+                task = Task.objects.create(
+                    user=request.user,
+                    task_type=task_type,
+                    start_time=timezone.now(),
+                    notes=notes
+                )
+        except IntegrityError:
+            return self._lost_start_race()
         
         serializer = self.get_serializer(task)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
@@ -432,7 +529,6 @@ class TaskViewSet(viewsets.ModelViewSet):
         This is the preferred way to switch tasks without manually stopping first.
         """
         from django.utils import timezone
-        from django.db import transaction
         
         task_type_id = request.data.get('task_type_id')
         notes = request.data.get('notes', '')
@@ -456,29 +552,32 @@ class TaskViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        with transaction.atomic():
-            # Stop current task if exists
-            current_task = Task.objects.filter(
-                user=request.user,
-                end_time__isnull=True
-            ).first()
-            
-            interrupted_task_data = None
-            if current_task:
-                current_task.end_time = timezone.now()
-                current_task.interrupted = True
-                current_task.save()
-                interrupted_task_data = self.get_serializer(current_task).data
-            
-            # Start new task
-            new_task = Task.objects.create(
-                user=request.user,
-                task_type=task_type,
-                start_time=timezone.now(),
-                notes=notes
-            )
-            
-            new_task_data = self.get_serializer(new_task).data
+        try:
+            with transaction.atomic():
+                # Stop current task if exists
+                current_task = Task.objects.filter(
+                    user=request.user,
+                    end_time__isnull=True
+                ).first()
+                
+                interrupted_task_data = None
+                if current_task:
+                    current_task.end_time = timezone.now()
+                    current_task.interrupted = True
+                    current_task.save()
+                    interrupted_task_data = self.get_serializer(current_task).data
+                
+                # Start new task
+                new_task = Task.objects.create(
+                    user=request.user,
+                    task_type=task_type,
+                    start_time=timezone.now(),
+                    notes=notes
+                )
+                
+                new_task_data = self.get_serializer(new_task).data
+        except IntegrityError:
+            return self._lost_start_race()
         
         return Response({
             'interrupted_task': interrupted_task_data,
@@ -486,6 +585,100 @@ class TaskViewSet(viewsets.ModelViewSet):
             'message': 'Task switched successfully'
         })
     
+    @extend_schema(
+        tags=['tasks'],
+        request=TaskBatchSerializer,
+        responses={
+            200: OpenApiResponse(description='Batch applied: per-operation results in request order'),
+            400: OpenApiResponse(description='Nothing applied: per-operation errors in request order'),
+        },
+        description='Create, update and delete tasks in one transaction',
+    )
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Apply a list of task operations atomically.
+        
+        Expects: {"operations": [{"op": "create", "data": {...}},
+                                 {"op": "update", "id": 5, "data": {...}},
+                                 {"op": "delete", "id": 7}]}
+        Updates are partial. As through the single task endpoints, created
+        tasks are marked as manual entries and updated tasks as edited.
+        """
+        serializer = TaskBatchSerializer(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        try:
+            serializer.save()
+        except IntegrityError:
+            return self._lost_start_race()
+        return Response(serializer.data)
+    
+    @extend_schema(
+        tags=['tasks'],
+        request={
+            'multipart/form-data': {
+                'type': 'object',
+                'properties': {
+                    'file': {'type': 'string', 'format': 'binary'},
+                    'format': {'type': 'string', 'enum': [*EXPORT_FORMATS],
+                               'description': 'File format (default: from the file name, else csv)'},
+                    'create_types': {'type': 'boolean',
+                                     'description': 'Create unknown task types instead of skipping their rows'},
+                },
+                'required': ['file']
+            }
+        },
+        responses={
+            201: OpenApiResponse(description='Small file imported: created and skipped counts, row errors'),
+            202: OpenApiResponse(description='Large file queued', response=TaskImportSerializer),
+            400: OpenApiResponse(description='Missing or unreadable file'),
+        },
+        description='Import completed tasks from a file in the export layout (CSV or NDJSON, optionally gzipped)',
+    )
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_file(self, request):
+        """
+        Bulk import historical tasks.
+        
+        Files up to TASK_IMPORT_SYNC_MAX_BYTES are imported right away; larger
+        ones are imported by a background job whose progress can be polled
+        at /api/task-imports/<id>/.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(
+                {'error': 'file is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            export_format = get_export_format(request.data.get('format') or import_format_for(upload.name))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        create_types = str(request.data.get('create_types', '')).lower() in ('true', '1', 'yes')
+        
+        if upload.size > settings.TASK_IMPORT_SYNC_MAX_BYTES:
+            task_import = TaskImport.objects.create(
+                user=request.user,
+                import_format=export_format.name,
+                create_types=create_types,
+                file_name=save_upload(request.user, upload, export_format),
+            )
+            transaction.on_commit(lambda: import_task_file.delay(task_import.id))
+            return Response(TaskImportSerializer(task_import).data, status=status.HTTP_202_ACCEPTED)
+        
+        try:
+            result = import_tasks(
+                request.user,
+                open_text(upload.file, export_format.compressed),
+                export_format,
+                create_types=create_types,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response(result._asdict(), status=status.HTTP_201_CREATED)
+    
     @extend_schema(
         tags=['tasks'],
         responses={
@@ -497,20 +690,16 @@ class TaskViewSet(viewsets.ModelViewSet):
         description='Get the currently tracking task, or null if not tracking',
     )
     @action(detail=False, methods=['get'])
+    @method_decorator(conditional_on_user_data(skip_while_tracking=True))
     def current(self, request):
         """
         Get the currently tracking task.
         
-        Returns null if user is not currently tracking anything.
+        Returns null if user is not currently tracking anything. Answered
+        from the cached current task pointer, without a query.
         """
-        current_task = Task.objects.filter(
-            user=request.user,
-            end_time__isnull=True
-        ).first()
-        
-        if current_task:
-            serializer = self.get_serializer(current_task)
-            return Response(serializer.data)
-        
-        return Response(None)
+        record = cached_current_task(request.user)
+        if record is None:
+            return Response(None)
+        return Response(with_duration(record))
 
@@ -0,0 +1,258 @@
+"""
+Disk-spooled export artifacts
+
+Large exports are written by a Celery worker to EXPORT_ARTIFACT_ROOT instead
+of being built in a web worker. Clients fetch them through a short-lived
+signed link; the download view only checks the signature and hands the file
+to nginx with X-Accel-Redirect, so no gunicorn worker holds or sends the body.
+
+Artifacts double as a content-addressed export cache: each one records a
+key derived from (user, range, format, timezone, data version), so a repeat
+request for unchanged data is answered from the stored file. Any task change
+bumps the data version and therefore the key. Least recently used artifacts
+are evicted once the total size exceeds EXPORT_CACHE_MAX_BYTES.
+"""
+import hashlib
+import logging
+import os
+import tempfile
+from datetime import timedelta
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q, Sum
+from django.http import FileResponse, HttpResponse
+from django.utils import timezone
+
+from .caching import CACHE_ERRORS, data_version
+from .dates import user_timezone
+from .exporting import (
+    export_blocks,
+    export_filename,
+    get_export_format,
+    user_export_records,
+)
+from .models import ExportArtifact
+
+logger = logging.getLogger('magus')
+
+DOWNLOAD_SALT = 'magus.artifacts.download'
+
+
+def artifact_path(file_name):
+    """Return the absolute path of an artifact file name"""
+    return os.path.join(settings.EXPORT_ARTIFACT_ROOT, file_name)
+
+
+def export_cache_key(user, start_date, end_date, export_format):
+    """
+    Return the content address of an export, or None when the data version
+    is unavailable (the export is then built without caching).
+    """
+    try:
+        version = data_version(user.id)
+    except CACHE_ERRORS as e:
+        logger.warning(f"Export cache disabled, no data version for user {user.id}: {e}")
+        return None
+    parts = [user.id, start_date.isoformat(), end_date.isoformat(), export_format.name,
+             user_timezone(user), version]
+    return hashlib.sha256('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def cached_artifact(user, cache_key):
+    """
+    Return the ready artifact stored under a cache key, marking it used.
+
+    Rows whose file has gone missing are dropped and treated as a miss.
+    """
+    artifact = (
+        ExportArtifact.objects.filter(user=user, cache_key=cache_key, status='ready')
+        .order_by('-completed_at')
+        .first()
+    )
+    if artifact is None:
+        return None
+    if not os.path.exists(artifact_path(artifact.file_name)):
+        artifact.delete()
+        return None
+
+    artifact.last_accessed = timezone.now()
+    ExportArtifact.objects.filter(pk=artifact.pk).update(last_accessed=artifact.last_accessed)
+    return artifact
+
+
+def spool_blocks(artifact, blocks):
+    """
+    Yield export blocks while writing them to the artifact's file.
+
+    The file is written next to its final location and renamed into place
+    once the blocks are exhausted, then the artifact is marked ready; a
+    partial file is never served. If iteration stops early the partial file
+    is removed.
+    """
+    export_format = get_export_format(artifact.export_format)
+    file_name = os.path.join(str(artifact.user_id), f'{artifact.pk}.{export_format.extension}')
+    final_path = artifact_path(file_name)
+    os.makedirs(os.path.dirname(final_path), exist_ok=True)
+
+    tmp = None
+    try:
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(final_path), suffix='.part', delete=False) as tmp:
+            for block in blocks:
+                tmp.write(block)
+                yield block
+        os.replace(tmp.name, final_path)
+    finally:
+        if tmp is not None and os.path.exists(tmp.name):
+            os.remove(tmp.name)
+
+    artifact.status = 'ready'
+    artifact.file_name = file_name
+    artifact.size = os.path.getsize(final_path)
+    artifact.completed_at = artifact.last_accessed = timezone.now()
+    artifact.save(update_fields=['status', 'file_name', 'size', 'completed_at', 'last_accessed'])
+    if artifact.cache_key:
+        evict_export_cache()
+
+
+def build_artifact(artifact):
+    """
+    Write an export artifact to disk and mark it ready.
+
+    Failures are recorded on the artifact and re-raised.
+    """
+    export_format = get_export_format(artifact.export_format)
+    records = user_export_records(artifact.user, artifact.start_date, artifact.end_date)
+    try:
+        for _ in spool_blocks(artifact, export_blocks(export_format, records)):
+            pass
+    except Exception as e:
+        artifact.status = 'failed'
+        artifact.error = str(e)
+        artifact.completed_at = timezone.now()
+        artifact.save(update_fields=['status', 'error', 'completed_at'])
+        raise
+    return artifact
+
+
+def cache_while_streaming(user, start_date, end_date, export_format, cache_key, blocks):
+    """
+    Yield export blocks to a client while storing them as a cached artifact.
+
+    The artifact only becomes visible to cache lookups once the whole export
+    was produced; an interrupted stream (client gone, error) leaves nothing.
+    """
+    artifact = ExportArtifact.objects.create(
+        user=user,
+        export_format=export_format.name,
+        start_date=start_date,
+        end_date=end_date,
+        cache_key=cache_key,
+    )
+    completed = False
+    try:
+        yield from spool_blocks(artifact, blocks)
+        completed = True
+    finally:
+        if not completed:
+            artifact.delete()
+
+
+def evict_export_cache(max_bytes=None):
+    """
+    Delete least recently used cached artifacts until the cache fits in max_bytes.
+
+    Args:
+        max_bytes: Size budget (default: EXPORT_CACHE_MAX_BYTES)
+
+    Returns the number of artifacts evicted.
+    """
+    if max_bytes is None:
+        max_bytes = settings.EXPORT_CACHE_MAX_BYTES
+    cached = ExportArtifact.objects.filter(status='ready').exclude(cache_key='')
+    total = cached.aggregate(total=Sum('size'))['total'] or 0
+
+    evicted = 0
+    for artifact in cached.order_by('last_accessed', 'id').iterator():
+        if total <= max_bytes:
+            break
+        total -= artifact.size or 0
+        delete_artifact(artifact)
+        evicted += 1
+    return evicted
+
+
+def download_token(artifact):
+    """Return a signed, timestamped token granting download of an artifact"""
+    return signing.dumps(artifact.pk, salt=DOWNLOAD_SALT)
+
+
+def artifact_from_token(token):
+    """
+    Resolve a download token to a ready artifact.
+
+    Returns:
+        ExportArtifact, or None when it no longer exists or is not ready
+
+    Raises:
+        signing.SignatureExpired: The link is older than EXPORT_DOWNLOAD_LINK_MAX_AGE
+        signing.BadSignature: The token was not issued by this server
+    """
+    pk = signing.loads(token, salt=DOWNLOAD_SALT, max_age=settings.EXPORT_DOWNLOAD_LINK_MAX_AGE)
+    return ExportArtifact.objects.filter(pk=pk, status='ready').first()
+
+
+def artifact_response(artifact):
+    """
+    Build the download response for a ready artifact.
+
+    With EXPORT_ACCEL_REDIRECT_PREFIX set, the body is left to nginx through
+    X-Accel-Redirect; otherwise the file is streamed by Django, and
+    FileNotFoundError is raised if it has been evicted.
+    """
+    export_format = get_export_format(artifact.export_format)
+    filename = export_filename(export_format, artifact.start_date, artifact.end_date)
+
+    prefix = settings.EXPORT_ACCEL_REDIRECT_PREFIX
+    if prefix:
+        response = HttpResponse(content_type=export_format.content_type)
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(artifact.file_name)
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    else:
+        # FileResponse closes the file once the body has been sent
+        response = FileResponse(
+            open(artifact_path(artifact.file_name), 'rb'),  # noqa: SIM115
+            as_attachment=True,
+            filename=filename,
+            content_type=export_format.content_type,
+        )
+    response['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def delete_artifact(artifact):
+    """Delete an artifact and its file"""
+    if artifact.file_name:
+        try:
+            os.remove(artifact_path(artifact.file_name))
+        except FileNotFoundError:
+            pass
+    artifact.delete()
+
+
+def purge_expired_artifacts():
+    """
+    Delete artifacts unused for EXPORT_ARTIFACT_TTL, with their files.
+
+    Returns the number of artifacts deleted.
+    """
+    cutoff = timezone.now() - timedelta(seconds=settings.EXPORT_ARTIFACT_TTL)
+    expired = ExportArtifact.objects.filter(
+        Q(last_accessed__lt=cutoff) | Q(last_accessed__isnull=True, created_at__lt=cutoff)
+    )
+    count = 0
+    for artifact in expired.iterator():
+        delete_artifact(artifact)
+        count += 1
+    return count
@@ -0,0 +1,57 @@
+"""
+Batch task mutations
+
+/api/tasks/batch/ validates a list of create/update/delete operations
+together, then apply_task_batch() writes them in one transaction with one
+DELETE, one bulk_update() and one bulk_create(). Bulk writes bypass
+Task.save() and Task.delete(), so this is where their side effects are
+reproduced: tombstones for deleted tasks, a single pass over the daily
+rollups, and a data version bump (which also invalidates the current task
+pointer).
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import bump_data_version_on_commit
+from .models import Task, TaskDeletion
+from .rollups import apply_task_changes, stored_state, task_state
+
+
+def apply_task_batch(user, created=(), updated=(), deleted=(), update_fields=()):
+    """
+    Write a batch of task changes in one transaction.
+
+    Deletions run first and creations last, so a batch may close or remove
+    the open task and start another one.
+
+    Args:
+        user: Owner of the tasks
+        created: Unsaved Tasks
+        updated: Tasks loaded from the database and changed in memory
+        deleted: Tasks loaded from the database
+        update_fields: Fields changed on the updated tasks
+    """
+    changes = []
+    with transaction.atomic():
+        if deleted:
+            Task.objects.filter(user=user, pk__in=[task.pk for task in deleted]).delete()
+            TaskDeletion.objects.bulk_create(TaskDeletion(user=user, task_id=task.pk) for task in deleted)
+            changes += [(stored_state(task), None) for task in deleted]
+
+        if updated:
+            # bulk_update() does not apply auto_now
+            now = timezone.now()
+            for task in updated:
+                task.updated_at = now
+            Task.objects.bulk_update(updated, sorted({*update_fields, 'updated_at'}))
+            changes += [(stored_state(task), task_state(task)) for task in updated]
+
+        if created:
+            Task.objects.bulk_create(created)
+            changes += [(None, task_state(task)) for task in created]
+
+        apply_task_changes(user, changes)
+        bump_data_version_on_commit(user.id)
+
+    for task in [*updated, *created]:
+        task._rollup_state = task_state(task)
@@ -0,0 +1,199 @@
+"""
+Versioned per-user response caching for the API
+
+Every user has a data version: a nanosecond timestamp of their last task or
+task type change. It drives two layers:
+
+- Server-side: analytics responses are cached under keys that include the
+  version, so stale entries are never read again and simply expire; no key
+  scans or deletes are needed.
+- Client-side: ETags derived from the version let clients revalidate with
+  a 304 before any query or serialization runs.
+"""
+import hashlib
+import logging
+import time
+from functools import wraps
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
+from redis.exceptions import RedisError
+from rest_framework import status
+from rest_framework.response import Response
+
+from .dates import local_today
+
+logger = logging.getLogger('magus')
+
+VERSION_KEY = 'analytics:version:{user_id}'
+STATS_KEYS = {
+    'hit': 'analytics:stats:hits',
+    'miss': 'analytics:stats:misses',
+}
+
+# Raised by the Redis cache backend when the server is unreachable or fails;
+# callers log these and fall back to computing the response
+CACHE_ERRORS = (RedisError,)
+
+
+def data_version(user_id):
+    """Return the current data version (a nanosecond timestamp) for a user"""
+    key = VERSION_KEY.format(user_id=user_id)
+    version = cache.get(key)
+    if version is None:
+        # Seed from the clock so a lost key never revives older entries
+        cache.add(key, time.time_ns(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_data_version(user_id):
+    """Invalidate every cached analytics response and the current task pointer of a user"""
+    key = VERSION_KEY.format(user_id=user_id)
+    try:
+        # Never move backwards, even if this server's clock lags another's
+        version = max(time.time_ns(), (cache.get(key) or 0) + 1)
+        cache.set(key, version, timeout=None)
+    except CACHE_ERRORS as e:
+        logger.warning(f"Could not bump analytics cache version for user {user_id}: {e}")
+
+
+def bump_data_version_on_commit(user_id):
+    """Bump the data version once the current transaction commits"""
+    transaction.on_commit(lambda: bump_data_version(user_id))
+
+
+def cache_stats():
+    """Return analytics cache hit/miss counters"""
+    hits = cache.get(STATS_KEYS['hit'], 0)
+    misses = cache.get(STATS_KEYS['miss'], 0)
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': (hits / total) if total else 0,
+    }
+
+
+def _count(outcome):
+    """Increment a hit/miss counter"""
+    key = STATS_KEYS[outcome]
+    try:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+    except CACHE_ERRORS as e:
+        logger.warning(f"Could not update analytics cache stats: {e}")
+
+
+def _response_key(request, endpoint):
+    """Build the cache key for an analytics request"""
+    params = sorted(
+        (name, value)
+        for name, values in request.query_params.lists()
+        for value in values
+    )
+    # Default date ranges depend on the user's current local day
+    params.append(('_today', local_today(request.user).isoformat()))
+    digest = hashlib.sha256(urlencode(params).encode()).hexdigest()[:32]
+    version = data_version(request.user.id)
+    return f'analytics:{request.user.id}:v{version}:{endpoint}:{digest}'
+
+
+def cached_analytics(endpoint):
+    """
+    Cache successful responses of an analytics function view.
+
+    Apply below @api_view/@permission_classes so the wrapped function
+    receives an authenticated DRF request. Adds an X-Cache header (HIT/MISS).
+    Cache backend errors are logged and the view is computed normally.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            try:
+                key = _response_key(request, endpoint)
+                data = cache.get(key)
+            except CACHE_ERRORS as e:
+                logger.warning(f"Analytics cache unavailable: {e}")
+                return view_func(request, *args, **kwargs)
+
+            if data is not None:
+                _count('hit')
+                response = Response(data)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            _count('miss')
+            response = view_func(request, *args, **kwargs)
+            if response.status_code == status.HTTP_200_OK:
+                try:
+                    cache.set(key, response.data, timeout=settings.ANALYTICS_CACHE_TIMEOUT)
+                except CACHE_ERRORS as e:
+                    logger.warning(f"Could not store analytics response: {e}")
+                response['X-Cache'] = 'MISS'
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_on_user_data(depends_on_day=False, skip_while_tracking=False):
+    """
+    Answer conditional GETs from the user's data version.
+
+    Sets an ETag on responses and returns 304 Not Modified when
+    If-None-Match still matches, before the view runs. There is no
+    Last-Modified: its one-second resolution cannot tell apart two versions
+    written within the same second. Works on DRF function views (apply below
+    @api_view/@permission_classes) and, through method_decorator, on ViewSet
+    actions.
+
+    Args:
+        depends_on_day: Also vary the ETag with the user's local date, for
+            views whose default ranges are relative to today
+        skip_while_tracking: Send no ETag while the user has an open task,
+            for views whose body includes its running duration (which
+            changes without a data version change)
+    """
+    def etag(request, *args, **kwargs):
+        version = _current_version(request.user.id)
+        if version is None:
+            return None
+        if skip_while_tracking and _is_tracking(request.user):
+            return None
+        parts = [str(request.user.id), str(version), request.get_full_path()]
+        if depends_on_day:
+            parts.append(local_today(request.user).isoformat())
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:32]
+
+    def decorator(view_func):
+        conditional_view = condition(etag_func=etag)(view_func)
+
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            response = conditional_view(request, *args, **kwargs)
+            if request.method in ('GET', 'HEAD'):
+                # Per-user data: keep it out of shared caches and always revalidate
+                patch_cache_control(response, private=True, no_cache=True)
+            return response
+        return wrapper
+    return decorator
+
+
+def _current_version(user_id):
+    """Return the user's data version, or None when the cache is unavailable"""
+    try:
+        return data_version(user_id)
+    except CACHE_ERRORS as e:
+        logger.warning(f"Could not read analytics cache version for user {user_id}: {e}")
+        return None
+
+
+def _is_tracking(user):
+    """Return whether the user has an open task (answered from the current task pointer)"""
+    from .current_task import cached_current_task
+
+    return cached_current_task(user) is not None
@@ -0,0 +1,96 @@
+"""
+Per-user pointer to the open (currently tracked) task
+
+Clients poll /api/tasks/current/ every few seconds, so the open task of each
+user is kept in the cache (Redis) as its serialized representation, or None
+when nothing is being tracked.
+
+The pointer is keyed by the user's data version (see magus.caching), which
+every task and task type write bumps once it commits. Writes therefore never
+store the pointer: the first read after a change misses and rebuilds it from
+the database. A read racing a write can only store under the version it
+started with, which the write's bump has already replaced or is about to,
+so a stale pointer is never served.
+"""
+import logging
+from datetime import datetime
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .caching import CACHE_ERRORS, data_version
+
+logger = logging.getLogger('magus')
+
+CURRENT_TASK_KEY = 'tasks:current:{user_id}:{version}'
+
+
+def current_task_key(user_id):
+    """Return the cache key of a user's open task pointer at their current data version"""
+    return CURRENT_TASK_KEY.format(user_id=user_id, version=data_version(user_id))
+
+
+def task_record(task):
+    """Return the stored representation of an open task (without the running duration)"""
+    from .api.serializers import TaskSerializer
+
+    record = dict(TaskSerializer(task).data)
+    record.pop('duration', None)
+    return record
+
+
+def cached_current_task(user):
+    """
+    Return the stored representation of a user's open task, or None.
+
+    Answered from the cache; a miss (or an unavailable cache) is served from
+    the database and stored again.
+    """
+    try:
+        key = current_task_key(user.id)
+        pointer = cache.get(key)
+    except CACHE_ERRORS as e:
+        logger.warning(f"Current task cache unavailable: {e}")
+        return _load(user)
+
+    if pointer is None:
+        record = _load(user)
+        _store(key, record)
+        return record
+    return pointer['task']
+
+
+def with_duration(record):
+    """Add the running duration (seconds) to an open task representation"""
+    started = datetime.fromisoformat(record['start_time'])
+    return {**record, 'duration': (timezone.now() - started).total_seconds()}
+
+
+def drop_current_task(user_id):
+    """Forget a user's pointer so the next read rebuilds it"""
+    try:
+        cache.delete(current_task_key(user_id))
+    except CACHE_ERRORS as e:
+        logger.warning(f"Could not drop current task pointer for user {user_id}: {e}")
+
+
+def _load(user):
+    """Read a user's open task from the database"""
+    from .models import Task
+
+    task = (
+        Task.objects.select_related('task_type')
+        .filter(user=user, end_time__isnull=True)
+        .order_by('-start_time')
+        .first()
+    )
+    return task_record(task) if task else None
+
+
+def _store(key, record):
+    """Store a pointer, wrapped so 'no open task' is distinguishable from a miss"""
+    try:
+        cache.set(key, {'task': record}, timeout=settings.CURRENT_TASK_CACHE_TIMEOUT)
+    except CACHE_ERRORS as e:
+        logger.warning(f"Could not store current task pointer: {e}")
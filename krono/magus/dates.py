@@ -0,0 +1,176 @@
+"""
+Date and timezone helpers for per-user day boundaries
+"""
+from bisect import bisect_right
+from collections import namedtuple
+from datetime import UTC, date, datetime, time, timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.utils import timezone
+
+
+def user_timezone(user):
+    """
+    Return the user's timezone from their profile.
+
+    Falls back to the server default when the profile is missing or holds an
+    unknown zone name.
+    """
+    try:
+        name = user.profile.timezone
+    except AttributeError:
+        name = None
+
+    if name:
+        try:
+            return ZoneInfo(name)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    return timezone.get_default_timezone()
+
+
+def local_today(user):
+    """Return today's date in the user's timezone"""
+    return timezone.localtime(timezone=user_timezone(user)).date()
+
+
+def local_day_range(tz, start_date=None, end_date=None):
+    """
+    Convert an inclusive range of local dates into a half-open UTC range.
+
+    Args:
+        tz: Timezone the dates are expressed in
+        start_date: First local day (inclusive), or None for no lower bound
+        end_date: Last local day (inclusive), or None for no upper bound
+
+    Returns:
+        (start, end) aware UTC datetimes with start <= t < end; a bound is
+        None when the matching date is None
+    """
+    start = end = None
+    if start_date is not None:
+        start = datetime.combine(start_date, time.min, tzinfo=tz).astimezone(UTC)
+    if end_date is not None:
+        end = datetime.combine(end_date + timedelta(days=1), time.min, tzinfo=tz).astimezone(UTC)
+    return start, end
+
+
+def start_time_range(user, start_date=None, end_date=None, field='start_time'):
+    """
+    Build filter lookups selecting tasks that start within the user's local days.
+
+    Filtering on a plain datetime range (instead of __date lookups, which cast
+    the column) lets the (user, -start_time) index serve a range scan, and
+    uses the user's day boundaries rather than the server's.
+
+    Returns:
+        dict of lookups for QuerySet.filter()
+    """
+    start, end = local_day_range(user_timezone(user), start_date, end_date)
+    lookups = {}
+    if start is not None:
+        lookups[f'{field}__gte'] = start
+    if end is not None:
+        lookups[f'{field}__lt'] = end
+    return lookups
+
+
+LocalTime = namedtuple('LocalTime', ['date', 'time', 'offset'])
+
+_EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+@lru_cache(maxsize=256)
+def offset_transitions(tz, start_ts, end_ts):
+    """
+    List the UTC offsets of a timezone over [start_ts, end_ts).
+
+    Offsets are probed once per day and transition instants are located
+    to the second by bisection.
+
+    Args:
+        tz: Timezone (hashable, e.g. a ZoneInfo)
+        start_ts: Start of the span, as a UTC timestamp
+        end_ts: End of the span, as a UTC timestamp
+
+    Returns:
+        (starts, offsets): ascending timestamps from which each offset (in
+        seconds) applies; starts[0] == start_ts
+    """
+    def offset_at(ts):
+        return int(datetime.fromtimestamp(ts, tz).utcoffset().total_seconds())
+
+    starts, offsets = [start_ts], [offset_at(start_ts)]
+    current = start_ts
+    while current < end_ts:
+        probe = min(current + 86400, end_ts)
+        if offset_at(probe) != offsets[-1]:
+            low, high = current, probe
+            while high - low > 1:
+                middle = (low + high) // 2
+                if offset_at(middle) == offsets[-1]:
+                    low = middle
+                else:
+                    high = middle
+            starts.append(high)
+            offsets.append(offset_at(high))
+            current = high
+        else:
+            current = probe
+    return tuple(starts), tuple(offsets)
+
+
+class LocalTimeConverter:
+    """
+    Render UTC datetimes as local date, time and offset strings.
+
+    The timezone's offsets are precomputed for a span, so converting a value
+    inside it is a lookup plus an integer add; values outside the span fall
+    back to the timezone itself. Date strings are memoized per local day.
+    """
+
+    def __init__(self, tz, start=None, end=None):
+        """
+        Args:
+            tz: Timezone to render in
+            start: Aware datetime from which most values are expected
+            end: Aware datetime until which most values are expected
+        """
+        self.tz = tz
+        self._starts, self._offsets = (), ()
+        if start is not None and end is not None:
+            # Whole days, so similar spans share the cached table
+            start_ts = int(start.timestamp()) // 86400 * 86400
+            end_ts = (int(end.timestamp()) // 86400 + 1) * 86400
+            self._starts, self._offsets = offset_transitions(tz, start_ts, end_ts)
+            self._span_end = end_ts
+        self._offset_labels = {}
+        self._dates = {}
+
+    def __call__(self, value):
+        """Return the LocalTime of an aware datetime"""
+        ts = int(value.timestamp())
+        if self._starts and self._starts[0] <= ts < self._span_end:
+            offset = self._offsets[bisect_right(self._starts, ts) - 1]
+        else:
+            offset = int(self.tz.utcoffset(value.astimezone(self.tz)).total_seconds())
+
+        days, seconds = divmod(ts + offset, 86400)
+        day = self._dates.get(days)
+        if day is None:
+            day = self._dates[days] = date.fromordinal(days + _EPOCH_ORDINAL).isoformat()
+        label = self._offset_labels.get(offset)
+        if label is None:
+            label = self._offset_labels[offset] = _offset_label(offset)
+
+        hours, seconds = divmod(seconds, 3600)
+        minutes, seconds = divmod(seconds, 60)
+        return LocalTime(day, f'{hours:02d}:{minutes:02d}:{seconds:02d}', label)
+
+
+def _offset_label(offset):
+    """Format an offset in seconds as +HH:MM"""
+    sign = '-' if offset < 0 else '+'
+    hours, minutes = divmod(abs(offset) // 60, 60)
+    return f'{sign}{hours:02d}:{minutes:02d}'
@@ -0,0 +1,290 @@
+"""
+Task export engine
+
+Exports are produced in two stages:
+
+- export_records() reads the tasks as a flat values_list() projection from
+  a server-side cursor and yields one ExportRecord per task, with times
+  rendered in the user's timezone by a LocalTimeConverter.
+- An ExportFormat turns the records into encoded output blocks: CSV or
+  NDJSON text, optionally gzip-compressed on the fly.
+
+Both stages are lazy, so a download can stream while an email attachment
+joins the same blocks in memory.
+"""
+import csv
+import json
+import zlib
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from .dates import LocalTimeConverter, local_day_range, start_time_range, user_timezone
+from .models import ScheduledExport, Task, TaskDeletion
+
+EXPORT_HEADER = [
+    'Date',
+    'Task Type',
+    'Start Time',
+    'End Time',
+    'Duration (HH:MM:SS)',
+    'Interrupted',
+    'Notes',
+    'Edited',
+]
+
+# Columns fetched per task: a flat projection, no model instances
+EXPORT_FIELDS = ('start_time', 'end_time', 'task_type__name', 'interrupted', 'notes', 'edited_by_user')
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_CHUNK_SIZE = 2000
+
+# Bytes of text collected before encoding a block for the response
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Leading columns of incremental (delta) exports
+DELTA_HEADER = ['Task ID', 'Change']
+
+# start_local and end_local are LocalTime (date, time, offset) strings;
+# task_id and change are only set in incremental exports, and deleted tasks
+# carry nothing else
+ExportRecord = namedtuple('ExportRecord', [
+    'start_local', 'end_local', 'task_type', 'duration', 'interrupted', 'notes', 'edited',
+    'task_id', 'change',
+], defaults=(None, None))
+
+ExportFormat = namedtuple('ExportFormat', ['name', 'extension', 'content_type', 'lines', 'compressed'])
+
+
+def export_queryset(user, start_date, end_date):
+    """Return the completed tasks of a user that start within the local date range"""
+    return Task.objects.filter(
+        user=user,
+        end_time__isnull=False,
+        **start_time_range(user, start_date, end_date)
+    ).order_by('start_time', 'id').values_list(*EXPORT_FIELDS)
+
+
+def changed_queryset(user, since, until):
+    """
+    Return the completed tasks of a user created or changed in (since, until].
+
+    Served by the (user, updated_at) index, so the cost follows the number of
+    changes rather than the size of the history.
+    """
+    return Task.objects.filter(
+        user=user,
+        end_time__isnull=False,
+        updated_at__gt=since,
+        updated_at__lte=until,
+    ).order_by('updated_at', 'id').values_list('id', *EXPORT_FIELDS)
+
+
+def deleted_queryset(user, since, until):
+    """Return the IDs of tasks a user deleted in (since, until]"""
+    return TaskDeletion.objects.filter(
+        user=user,
+        deleted_at__gt=since,
+        deleted_at__lte=until,
+    ).order_by('deleted_at', 'id').values_list('task_id', flat=True)
+
+
+def purge_task_deletions():
+    """
+    Delete the tombstones no incremental export still has to send.
+
+    A tombstone is kept while one of the user's incremental exports with
+    deletions last ran before it (the next run lists it), and never longer
+    than TASK_DELETION_RETENTION, so a paused export cannot hold them
+    forever.
+
+    Returns the number of tombstones deleted.
+    """
+    pending = ScheduledExport.objects.filter(
+        user=OuterRef('user'),
+        incremental=True,
+        include_deletions=True,
+        last_sent__lt=OuterRef('deleted_at'),
+    )
+    cutoff = timezone.now() - settings.TASK_DELETION_RETENTION
+    count, _ = TaskDeletion.objects.filter(Q(deleted_at__lt=cutoff) | ~Exists(pending)).delete()
+    return count
+
+
+def format_hms(seconds):
+    """Format a number of seconds as 'HH:MM:SS'"""
+    hours = int(seconds // 3600)
+    minutes = int((seconds % 3600) // 60)
+    seconds = int(seconds % 60)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+
+def user_export_records(user, start_date, end_date):
+    """Yield the ExportRecords of a user's export, in the user's timezone"""
+    tz = user_timezone(user)
+    start, end = local_day_range(tz, start_date, end_date)
+    return export_records(export_queryset(user, start_date, end_date), tz, start=start, end=end)
+
+
+def export_records(queryset, tzinfo=None, chunk_size=EXPORT_CHUNK_SIZE, start=None, end=None):
+    """
+    Yield one ExportRecord per task.
+
+    Args:
+        queryset: values_list() queryset as returned by export_queryset()
+        tzinfo: Timezone for the local times (default: the current timezone)
+        chunk_size: Rows fetched per database round trip
+        start, end: UTC span the start times fall in, if known; the
+            timezone's offsets are precomputed for it
+    """
+    to_local = LocalTimeConverter(tzinfo or timezone.get_current_timezone(), start, end)
+    for row in queryset.iterator(chunk_size=chunk_size):
+        yield _record(row, to_local)
+
+
+def delta_records(changed, deleted=None, tzinfo=None, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yield the ExportRecords of an incremental export.
+
+    Args:
+        changed: Queryset as returned by changed_queryset()
+        deleted: Optional queryset as returned by deleted_queryset()
+        tzinfo: Timezone for the local times (default: the current timezone)
+        chunk_size: Rows fetched per database round trip
+    """
+    to_local = LocalTimeConverter(tzinfo or timezone.get_current_timezone())
+    for task_id, *row in changed.iterator(chunk_size=chunk_size):
+        yield _record(row, to_local, task_id=task_id, change='upsert')
+    if deleted is not None:
+        for task_id in deleted.iterator(chunk_size=chunk_size):
+            yield ExportRecord(*([None] * 7), task_id=task_id, change='deleted')
+
+
+def _record(row, to_local, task_id=None, change=None):
+    """Build an ExportRecord from an EXPORT_FIELDS row"""
+    start_time, end_time, type_name, interrupted, notes, edited = row
+    return ExportRecord(
+        start_local=to_local(start_time),
+        end_local=to_local(end_time),
+        task_type=type_name,
+        duration=(end_time - start_time).total_seconds(),
+        interrupted=interrupted,
+        notes=notes,
+        edited=edited,
+        task_id=task_id,
+        change=change,
+    )
+
+
+def csv_lines(records, delta=False):
+    """Yield CSV text lines (header first) for export records"""
+    writer = csv.writer(_Echo())
+    yield writer.writerow(DELTA_HEADER + EXPORT_HEADER if delta else EXPORT_HEADER)
+    for record in records:
+        prefix = [record.task_id, record.change] if delta else []
+        if record.change == 'deleted':
+            yield writer.writerow(prefix + [''] * len(EXPORT_HEADER))
+            continue
+        start, end = record.start_local, record.end_local
+        yield writer.writerow(prefix + [
+            start.date,
+            record.task_type,
+            f'{start.date} {start.time}',
+            f'{end.date} {end.time}',
+            format_hms(record.duration),
+            'Yes' if record.interrupted else 'No',
+            record.notes,
+            'Yes' if record.edited else 'No',
+        ])
+
+
+def ndjson_lines(records, delta=False):
+    """Yield one JSON object per line for export records"""
+    for record in records:
+        prefix = {'id': record.task_id, 'change': record.change} if delta else {}
+        if record.change == 'deleted':
+            yield json.dumps(prefix, separators=(',', ':')) + '\n'
+            continue
+        start, end = record.start_local, record.end_local
+        yield json.dumps({
+            **prefix,
+            'date': start.date,
+            'task_type': record.task_type,
+            'start_time': f'{start.date}T{start.time}{start.offset}',
+            'end_time': f'{end.date}T{end.time}{end.offset}',
+            'duration_seconds': record.duration,
+            'interrupted': record.interrupted,
+            'notes': record.notes,
+            'edited': record.edited,
+        }, ensure_ascii=False, separators=(',', ':')) + '\n'
+
+
+EXPORT_FORMATS = {
+    'csv': ExportFormat('csv', 'csv', 'text/csv', csv_lines, False),
+    'ndjson': ExportFormat('ndjson', 'ndjson', 'application/x-ndjson', ndjson_lines, False),
+    'csv.gz': ExportFormat('csv.gz', 'csv.gz', 'application/gzip', csv_lines, True),
+    'ndjson.gz': ExportFormat('ndjson.gz', 'ndjson.gz', 'application/gzip', ndjson_lines, True),
+}
+DEFAULT_EXPORT_FORMAT = 'csv'
+
+
+def get_export_format(name):
+    """
+    Look up an export format by name (None selects the default).
+
+    Raises:
+        ValueError: For unknown format names
+    """
+    try:
+        return EXPORT_FORMATS[name or DEFAULT_EXPORT_FORMAT]
+    except KeyError:
+        raise ValueError(f"Unknown export format '{name}'. Use one of: {', '.join(EXPORT_FORMATS)}") from None
+
+
+def export_filename(export_format, start_date, end_date):
+    """Return the attachment filename of an export"""
+    return f'magus_export_{start_date}_{end_date}.{export_format.extension}'
+
+
+def export_blocks(export_format, records, block_size=STREAM_BLOCK_SIZE, delta=False):
+    """
+    Yield an export document as encoded blocks of about block_size bytes.
+
+    Lines are formatted (and compressed) as records are consumed, so memory
+    stays bounded by one block plus one database chunk whatever the export
+    size. With delta=True, rows lead with the task ID and change type.
+    """
+    compressor = zlib.compressobj(wbits=31) if export_format.compressed else None  # gzip container
+
+    block, size = [], 0
+    for line in export_format.lines(records, delta=delta):
+        block.append(line)
+        size += len(line)
+        if size >= block_size:
+            data = ''.join(block).encode()
+            block, size = [], 0
+            if compressor:
+                data = compressor.compress(data)
+            if data:
+                yield data
+
+    data = ''.join(block).encode()
+    if compressor:
+        data = compressor.compress(data) + compressor.flush()
+    if data:
+        yield data
+
+
+def export_bytes(export_format, records, delta=False):
+    """Return a whole export document (for attachments)"""
+    return b''.join(export_blocks(export_format, records, delta=delta))
+
+
+class _Echo:
+    """File-like object whose write() returns the value instead of storing it"""
+
+    def write(self, value):
+        """Return the written value"""
+        return value
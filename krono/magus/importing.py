@@ -0,0 +1,370 @@
+"""
+Task import engine
+
+Imports read the layouts the exporters write (CSV or NDJSON, optionally
+gzip-compressed) in three stages:
+
+- read_rows() streams the file and yields one ImportRow per line, with
+  local times resolved in the user's timezone.
+- find_overlaps() sorts the rows together with the user's existing tasks in
+  the same period and sweeps them once, so overlap checks cost one query in
+  total instead of one per row.
+- import_tasks() inserts the accepted rows with bulk_create() in batches,
+  then rebuilds the user's daily rollups once. Bulk inserts bypass
+  Task.save() and the model signals, so this is where they are brought up
+  to date.
+
+Small uploads are imported within the request; larger ones are saved to
+TASK_IMPORT_ROOT and imported by a Celery job that records its progress on
+a TaskImport.
+"""
+import csv
+import gzip
+import io
+import json
+import os
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from operator import itemgetter
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .dates import user_timezone
+from .exporting import EXPORT_FORMATS, get_export_format
+from .models import Task, TaskImport, TaskType
+from .rollups import rebuild_user_rollups
+
+# Tasks inserted per INSERT statement
+IMPORT_BATCH_SIZE = 1000
+
+# Row errors listed in an import result (all skipped rows are counted)
+IMPORT_ERROR_LIMIT = 100
+
+# CSV header -> field, for the columns read from an export
+CSV_COLUMNS = {
+    'Task Type': 'task_type',
+    'Start Time': 'start_time',
+    'End Time': 'end_time',
+    'Interrupted': 'interrupted',
+    'Notes': 'notes',
+    'Edited': 'edited',
+}
+REQUIRED_CSV_COLUMNS = ['Task Type', 'Start Time', 'End Time']
+
+ImportRow = namedtuple('ImportRow', [
+    'line', 'task_type', 'start_time', 'end_time', 'interrupted', 'notes', 'edited',
+])
+
+ImportResult = namedtuple('ImportResult', ['created', 'skipped', 'errors'])
+
+
+def import_format_for(filename, default='csv'):
+    """
+    Return the name of the export format a file name's extension matches.
+
+    Falls back to default when the extension is not recognised.
+    """
+    name = (filename or '').lower()
+    matches = [fmt.name for fmt in EXPORT_FORMATS.values() if name.endswith(f'.{fmt.extension}')]
+    return max(matches, key=len) if matches else default
+
+
+def open_text(fileobj, compressed=False):
+    """Wrap a binary file as streamed UTF-8 text, decompressing gzip on the fly"""
+    if compressed:
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+    return io.TextIOWrapper(fileobj, encoding='utf-8-sig', newline='')
+
+
+def csv_fields(stream):
+    """
+    Yield (line, fields) for each row of an exported CSV.
+
+    Raises:
+        ValueError: When the header lacks a required column
+    """
+    reader = csv.DictReader(stream)
+    missing = [column for column in REQUIRED_CSV_COLUMNS if column not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"Missing CSV columns: {', '.join(missing)}")
+
+    for values in reader:
+        yield reader.line_num, {
+            field: values.get(column) for column, field in CSV_COLUMNS.items()
+        }
+
+
+def ndjson_fields(stream):
+    """Yield (line, fields) for each line of an exported NDJSON file; fields is None when malformed"""
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            fields = json.loads(text)
+        except ValueError:
+            fields = None
+        yield line, fields if isinstance(fields, dict) else None
+
+
+FIELD_READERS = {
+    'csv': csv_fields,
+    'ndjson': ndjson_fields,
+}
+
+
+def read_rows(stream, export_format, tz):
+    """
+    Yield (line, row, error) for each record of an import file.
+
+    Exactly one of row (an ImportRow) and error (a message) is set.
+
+    Args:
+        stream: Text stream (see open_text())
+        export_format: ExportFormat the file was written in
+        tz: Timezone of times written without a UTC offset (CSV)
+    """
+    reader = FIELD_READERS[export_format.name.removesuffix('.gz')]
+    for line, fields in reader(stream):
+        if fields is None:
+            yield line, None, 'Invalid JSON object'
+            continue
+        try:
+            yield line, _row(line, fields, tz), None
+        except ValueError as e:
+            yield line, None, str(e)
+
+
+def _row(line, fields, tz):
+    """Build an ImportRow from parsed fields, raising ValueError when invalid"""
+    task_type = str(fields.get('task_type') or '').strip()
+    if not task_type:
+        raise ValueError('Missing task type')
+
+    start_time = _parse_time(fields.get('start_time'), tz, 'start time')
+    end_time = _parse_time(fields.get('end_time'), tz, 'end time')
+    if end_time <= start_time:
+        raise ValueError('End time must be after start time')
+
+    return ImportRow(
+        line=line,
+        task_type=task_type,
+        start_time=start_time,
+        end_time=end_time,
+        interrupted=_parse_flag(fields.get('interrupted')),
+        notes=str(fields.get('notes') or ''),
+        edited=_parse_flag(fields.get('edited')),
+    )
+
+
+def _parse_time(value, tz, label):
+    """Parse an ISO datetime, reading naive values as local times in tz"""
+    if not value:
+        raise ValueError(f'Missing {label}')
+    try:
+        parsed = datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"Invalid {label} '{value}'") from None
+    if timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=tz)
+    return parsed
+
+
+def _parse_flag(value):
+    """Read a Yes/No (CSV) or boolean (NDJSON) column"""
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('yes', 'true', '1')
+
+
+def find_overlaps(user, rows):
+    """
+    Find the rows that overlap another row or one of the user's tasks.
+
+    Rows and the existing tasks of the period they span are sorted by start
+    time and swept once, tracking the interval that reaches furthest. Both
+    rows of an overlapping pair are reported.
+
+    Returns:
+        {row index: index of the row it overlaps, or None for an existing task}
+    """
+    if not rows:
+        return {}
+
+    first = min(row.start_time for row in rows)
+    last = max(row.end_time for row in rows)
+    existing = Task.objects.filter(user=user, start_time__lt=last).filter(
+        Q(end_time__gt=first) | Q(end_time__isnull=True)
+    ).values_list('start_time', 'end_time')
+
+    now = timezone.now()
+    intervals = [(start, end or max(start, now), None) for start, end in existing]
+    intervals += [(row.start_time, row.end_time, index) for index, row in enumerate(rows)]
+    intervals.sort(key=itemgetter(0, 1))
+
+    overlaps = {}
+    reach = owner = None
+    for start, end, index in intervals:
+        if reach is not None and start < reach:
+            if index is not None:
+                overlaps.setdefault(index, owner)
+            if owner is not None:
+                overlaps.setdefault(owner, index)
+        if reach is None or end > reach:
+            reach, owner = end, index
+    return overlaps
+
+
+def import_tasks(user, stream, export_format, create_types=False, batch_size=IMPORT_BATCH_SIZE,
+                 progress=None):
+    """
+    Import completed tasks from an exported file.
+
+    Invalid rows, rows naming an unknown task type and overlapping rows are
+    skipped and reported. Each batch commits on its own, so an interrupted
+    import can be resumed by importing the same file again: the rows already
+    inserted are then skipped as overlaps.
+
+    Args:
+        user: Owner of the imported tasks
+        stream: Text stream (see open_text())
+        export_format: ExportFormat the file was written in
+        create_types: Create task types that do not exist yet instead of
+            skipping their rows
+        batch_size: Tasks per INSERT
+        progress: Optional callable(done, total) invoked after each batch
+
+    Returns:
+        ImportResult
+
+    Raises:
+        ValueError: When the file cannot be read as the given format
+    """
+    tz = user_timezone(user)
+    type_ids = dict(TaskType.objects.filter(user=user).values_list('name', 'id'))
+
+    rows, errors = [], []
+    try:
+        for line, row, error in read_rows(stream, export_format, tz):
+            if error:
+                errors.append((line, error))
+            else:
+                rows.append(row)
+    except (csv.Error, UnicodeDecodeError, gzip.BadGzipFile, EOFError) as e:
+        raise ValueError(f'Could not read the file as {export_format.name}: {e}') from e
+
+    new_types = {row.task_type for row in rows} - set(type_ids)
+    if new_types and not create_types:
+        errors += [(row.line, f"Unknown task type '{row.task_type}'") for row in rows if row.task_type in new_types]
+        rows = [row for row in rows if row.task_type not in new_types]
+        new_types = set()
+
+    overlaps = find_overlaps(user, rows)
+    for index, other in overlaps.items():
+        where = 'an existing task' if other is None else f'the task on line {rows[other].line}'
+        errors.append((rows[index].line, f'Overlaps {where}'))
+    rows = [row for index, row in enumerate(rows) if index not in overlaps]
+
+    for task_type in TaskType.objects.bulk_create(TaskType(user=user, name=name) for name in sorted(new_types)):
+        type_ids[task_type.name] = task_type.id
+
+    created = 0
+    try:
+        for offset in range(0, len(rows), batch_size):
+            batch = rows[offset:offset + batch_size]
+            Task.objects.bulk_create(
+                Task(
+                    user=user,
+                    task_type_id=type_ids[row.task_type],
+                    start_time=row.start_time,
+                    end_time=row.end_time,
+                    interrupted=row.interrupted,
+                    notes=row.notes,
+                    edited_by_user=row.edited,
+                    is_manual_entry=True,
+                )
+                for row in batch
+            )
+            created += len(batch)
+            if progress:
+                progress(created, len(rows))
+    finally:
+        # bulk_create() skips Task.save() and the signals; the rebuild also
+        # bumps the data version
+        if created or new_types:
+            rebuild_user_rollups(user)
+
+    errors.sort()
+    return ImportResult(
+        created=created,
+        skipped=len(errors),
+        errors=[{'line': line, 'error': error} for line, error in errors[:IMPORT_ERROR_LIMIT]],
+    )
+
+
+def import_path(file_name):
+    """Return the absolute path of an uploaded import file name"""
+    return os.path.join(settings.TASK_IMPORT_ROOT, file_name)
+
+
+def save_upload(user, upload, export_format):
+    """
+    Save an uploaded import file for a background import.
+
+    Returns:
+        File name relative to TASK_IMPORT_ROOT
+    """
+    file_name = os.path.join(str(user.id), f'{uuid.uuid4().hex}.{export_format.extension}')
+    path = import_path(file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.writelines(upload.chunks())
+    return file_name
+
+
+def run_task_import(task_import):
+    """
+    Run a queued import from its uploaded file.
+
+    Progress is written to the TaskImport after every batch, and the outcome
+    once done. Failures are recorded on the TaskImport and re-raised. The
+    uploaded file is removed either way.
+    """
+    export_format = get_export_format(task_import.import_format)
+    TaskImport.objects.filter(pk=task_import.pk).update(status='running')
+
+    def report(done, total):
+        """Record the number of rows inserted so far"""
+        TaskImport.objects.filter(pk=task_import.pk).update(processed_rows=done, total_rows=total)
+
+    path = import_path(task_import.file_name)
+    try:
+        with open(path, 'rb') as f:
+            result = import_tasks(
+                task_import.user,
+                open_text(f, export_format.compressed),
+                export_format,
+                create_types=task_import.create_types,
+                progress=report,
+            )
+    except Exception as e:
+        task_import.status = 'failed'
+        task_import.error = str(e)
+        task_import.completed_at = timezone.now()
+        task_import.save(update_fields=['status', 'error', 'completed_at'])
+        raise
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+    task_import.status = 'done'
+    task_import.total_rows = task_import.processed_rows = result.created
+    task_import.created_count = result.created
+    task_import.skipped_count = result.skipped
+    task_import.errors = result.errors
+    task_import.completed_at = timezone.now()
+    task_import.save(update_fields=['status', 'total_rows', 'processed_rows', 'created_count',
+                                    'skipped_count', 'errors', 'completed_at'])
+    return task_import
@@ -0,0 +1,76 @@
+"""
+Pooled email delivery
+
+Export emails are sent in batches over one backend connection (one SMTP
+handshake per batch rather than per message). Each message is retried on
+its own with exponential backoff when the failure looks transient, so one
+bad message or a dropped connection does not lose the rest of the batch.
+"""
+import logging
+import smtplib
+import time
+
+from django.conf import settings
+from django.core.mail import get_connection
+
+logger = logging.getLogger('magus')
+
+
+def is_transient(error):
+    """Return whether a delivery error is worth retrying (4xx replies, dropped connections)"""
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return False
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return isinstance(error, (smtplib.SMTPException, OSError))
+
+
+def send_pooled(messages, retries=None, backoff=None, connection=None):
+    """
+    Send messages over one connection, retrying each on transient errors.
+
+    After a failed attempt the connection is closed, and it is reopened for
+    the retry after backoff * 2 ** attempt seconds.
+
+    Args:
+        messages: EmailMessages to send
+        retries: Retries per message (default: EMAIL_SEND_RETRIES)
+        backoff: Initial delay in seconds (default: EMAIL_RETRY_BACKOFF)
+        connection: Email backend to use (default: get_connection())
+
+    Returns:
+        {index of message: exception} for the messages that were not sent
+    """
+    retries = settings.EMAIL_SEND_RETRIES if retries is None else retries
+    backoff = settings.EMAIL_RETRY_BACKOFF if backoff is None else backoff
+    connection = connection or get_connection(fail_silently=False)
+
+    failures = {}
+    try:
+        for index, message in enumerate(messages):
+            attempt = 0
+            while True:
+                try:
+                    connection.open()
+                    connection.send_messages([message])
+                    break
+                except Exception as e:  # noqa: BLE001 - any backend error fails this message only
+                    if attempt >= retries or not is_transient(e):
+                        logger.error(f"Could not send email to {', '.join(message.to)}: {e}")
+                        failures[index] = e
+                        break
+                    logger.warning(f"Retrying email to {', '.join(message.to)} after error: {e}")
+                    _close(connection)
+                    time.sleep(backoff * 2 ** attempt)
+                    attempt += 1
+    finally:
+        _close(connection)
+    return failures
+
+
+def _close(connection):
+    """Close a backend connection, ignoring errors from a connection already gone"""
+    try:
+        connection.close()
+    except (smtplib.SMTPException, OSError) as e:
+        logger.debug(f"Error closing email connection: {e}")
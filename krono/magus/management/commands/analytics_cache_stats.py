@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from magus.caching import STATS_KEYS, cache_stats
+
+
+class Command(BaseCommand):
+    """Report analytics response cache hit/miss counters"""
+
+    help = 'Show analytics cache hit/miss counters (use --reset to clear them)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after reporting')
+
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        self.stdout.write(
+            f"hits: {stats['hits']}  misses: {stats['misses']}  "
+            f"hit rate: {stats['hit_rate']:.1%}"
+        )
+
+        if options['reset']:
+            from django.core.cache import cache
+
+            cache.delete_many(STATS_KEYS.values())
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
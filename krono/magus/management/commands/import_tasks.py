@@ -0,0 +1,56 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from magus.exporting import EXPORT_FORMATS, get_export_format
+from magus.importing import (
+    IMPORT_BATCH_SIZE,
+    import_format_for,
+    import_tasks,
+    open_text,
+)
+
+
+class Command(BaseCommand):
+    """Import historical tasks from an exported CSV or NDJSON file"""
+
+    help = 'Bulk import completed tasks for a user from a file in the export layout'
+
+    def add_arguments(self, parser):
+        parser.add_argument('username', help='Owner of the imported tasks')
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS),
+                            help='File format (default: from the file name, else csv)')
+        parser.add_argument('--create-types', action='store_true',
+                            help='Create unknown task types instead of skipping their rows')
+        parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE, help='Tasks per INSERT')
+
+    def handle(self, *args, **options):
+        try:
+            user = User.objects.select_related('profile').get(username=options['username'])
+        except User.DoesNotExist:
+            raise CommandError(f"Unknown user: {options['username']}")
+        export_format = get_export_format(options['format'] or import_format_for(options['path']))
+
+        def report(done, total):
+            """Print insert progress"""
+            self.stdout.write(f"Inserted {done}/{total} tasks")
+
+        try:
+            with open(options['path'], 'rb') as f:
+                result = import_tasks(
+                    user,
+                    open_text(f, export_format.compressed),
+                    export_format,
+                    create_types=options['create_types'],
+                    batch_size=options['batch_size'],
+                    progress=report,
+                )
+        except (OSError, ValueError) as e:
+            raise CommandError(str(e))
+
+        for error in result.errors:
+            self.stdout.write(self.style.WARNING(f"Line {error['line']}: {error['error']}"))
+        if result.skipped > len(result.errors):
+            self.stdout.write(self.style.WARNING(f"... {result.skipped - len(result.errors)} more skipped rows"))
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {result.created} tasks, skipped {result.skipped} rows"))
@@ -0,0 +1,29 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from magus.rollups import rebuild_user_rollups
+
+
+class Command(BaseCommand):
+    """Rebuild the daily analytics rollups from raw tasks"""
+
+    help = 'Rebuild DailyRollup rows from tasks (all users, or the given usernames)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help='Only rebuild these users')
+
+    def handle(self, *args, **options):
+        users = User.objects.select_related('profile').order_by('id')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+            missing = set(options['usernames']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown users: {', '.join(sorted(missing))}")
+
+        total = 0
+        for user in users.iterator():
+            rows = rebuild_user_rollups(user)
+            total += rows
+            self.stdout.write(f"{user.username}: {rows} rollup rows")
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} rollup rows"))
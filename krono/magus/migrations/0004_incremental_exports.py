@@ -0,0 +1,50 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magus', '0003_exportartifact'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TaskDeletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.BigIntegerField(help_text='ID of the deleted task')),
+                ('deleted_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-deleted_at'],
+            },
+        ),
+        migrations.AddField(
+            model_name='scheduledexport',
+            name='include_deletions',
+            field=models.BooleanField(default=False, help_text='In incremental mode, also list tasks deleted since the last run'),
+        ),
+        migrations.AddField(
+            model_name='scheduledexport',
+            name='incremental',
+            field=models.BooleanField(default=False, help_text='Send only tasks created or changed since the last run'),
+        ),
+        migrations.AddIndex(
+            model_name='task',
+            index=models.Index(fields=['user', 'updated_at'], name='magus_task_user_id_59b2fc_idx'),
+        ),
+        migrations.AddField(
+            model_name='taskdeletion',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='task_deletions', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='taskdeletion',
+            index=models.Index(fields=['user', 'deleted_at'], name='magus_taskd_user_id_0d88f4_idx'),
+        ),
+    ]
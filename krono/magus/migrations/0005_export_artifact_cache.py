@@ -0,0 +1,23 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magus', '0004_incremental_exports'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exportartifact',
+            name='cache_key',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='exportartifact',
+            name='last_accessed',
+            field=models.DateTimeField(blank=True, help_text='For LRU eviction', null=True),
+        ),
+    ]
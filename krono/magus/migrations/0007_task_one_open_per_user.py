@@ -0,0 +1,104 @@
+# Generated by Django 5.0.7 on 2026-10-17 06:35
+
+import logging
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import migrations, models
+from redis.exceptions import RedisError
+
+logger = logging.getLogger('magus')
+
+# Completed tasks of one user clipped to each local day they overlap; the
+# count and interrupted count go to the day the task started on
+ROLLUP_SQL = """
+    INSERT INTO {rollup_table} (user_id, day, task_type_id, total_seconds, task_count,
+                                interrupted_count, updated_at)
+    SELECT t.user_id,
+           d.day,
+           t.task_type_id,
+           SUM(COALESCE(EXTRACT(EPOCH FROM upper(d.overlap) - lower(d.overlap)), 0))::float8,
+           COUNT(*) FILTER (WHERE d.starts_here),
+           COUNT(*) FILTER (WHERE d.starts_here AND t.interrupted),
+           now()
+    FROM {task_table} t
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('day', t.start_time AT TIME ZONE %(tz)s),
+        t.end_time AT TIME ZONE %(tz)s,
+        interval '1 day'
+    ) AS s
+    CROSS JOIN LATERAL (
+        SELECT s::date AS day,
+               tstzrange(t.start_time, t.end_time)
+                   * tstzrange(s AT TIME ZONE %(tz)s, (s + interval '1 day') AT TIME ZONE %(tz)s) AS overlap,
+               s::date = (t.start_time AT TIME ZONE %(tz)s)::date AS starts_here
+    ) AS d
+    WHERE t.user_id = %(user_id)s
+      AND t.end_time IS NOT NULL
+      AND (d.starts_here OR NOT isempty(d.overlap))
+    GROUP BY t.user_id, d.day, t.task_type_id
+"""
+
+VERSION_KEY = 'analytics:version:{user_id}'
+
+
+def close_duplicate_open_tasks(apps, schema_editor):
+    """Interrupt all but the latest open task of each user, as starting the next one would have"""
+    Task = apps.get_model('magus', 'Task')
+    open_tasks = Task.objects.filter(end_time__isnull=True).order_by('user_id', '-start_time', '-id')
+
+    user_id, next_start, affected = None, None, set()
+    for task in open_tasks.only('id', 'user_id', 'start_time'):
+        if task.user_id == user_id:
+            Task.objects.filter(pk=task.pk).update(end_time=next_start, interrupted=True)
+            affected.add(user_id)
+        user_id, next_start = task.user_id, task.start_time
+
+    # The updates bypass Task.save(): bring the closed tasks into the rollups
+    if affected:
+        rebuild_rollups(apps, schema_editor, sorted(affected))
+
+
+def rebuild_rollups(apps, schema_editor, user_ids):
+    """Recompute the rollups of some users and drop their data versions (see magus.caching)"""
+    Task = apps.get_model('magus', 'Task')
+    Profile = apps.get_model('magus', 'Profile')
+    DailyRollup = apps.get_model('magus', 'DailyRollup')
+
+    zones = dict(Profile.objects.filter(user_id__in=user_ids).values_list('user_id', 'timezone'))
+    sql = ROLLUP_SQL.format(rollup_table=DailyRollup._meta.db_table, task_table=Task._meta.db_table)
+
+    DailyRollup.objects.filter(user_id__in=user_ids).delete()
+    with schema_editor.connection.cursor() as cursor:
+        for user_id in user_ids:
+            cursor.execute(sql, {'user_id': user_id, 'tz': _zone_name(zones.get(user_id))})
+
+    try:
+        cache.delete_many([VERSION_KEY.format(user_id=user_id) for user_id in user_ids])
+    except RedisError as e:
+        logger.warning(f"Could not reset analytics cache versions after the rollup rebuild: {e}")
+
+
+def _zone_name(name):
+    """Return a profile's timezone name, or the server default for a missing or unknown one"""
+    try:
+        return ZoneInfo(name).key
+    except (ZoneInfoNotFoundError, TypeError, ValueError):
+        return settings.TIME_ZONE
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magus', '0006_taskimport'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(close_duplicate_open_tasks, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='task',
+            constraint=models.UniqueConstraint(condition=models.Q(('end_time__isnull', True)), fields=('user',), name='magus_task_one_open_per_user'),
+        ),
+    ]
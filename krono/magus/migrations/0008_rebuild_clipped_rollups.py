@@ -0,0 +1,86 @@
+import logging
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import migrations
+from redis.exceptions import RedisError
+
+logger = logging.getLogger('magus')
+
+# Completed tasks of one user clipped to each local day they overlap; the
+# count and interrupted count go to the day the task started on
+ROLLUP_SQL = """
+    INSERT INTO {rollup_table} (user_id, day, task_type_id, total_seconds, task_count,
+                                interrupted_count, updated_at)
+    SELECT t.user_id,
+           d.day,
+           t.task_type_id,
+           SUM(COALESCE(EXTRACT(EPOCH FROM upper(d.overlap) - lower(d.overlap)), 0))::float8,
+           COUNT(*) FILTER (WHERE d.starts_here),
+           COUNT(*) FILTER (WHERE d.starts_here AND t.interrupted),
+           now()
+    FROM {task_table} t
+    CROSS JOIN LATERAL generate_series(
+        date_trunc('day', t.start_time AT TIME ZONE %(tz)s),
+        t.end_time AT TIME ZONE %(tz)s,
+        interval '1 day'
+    ) AS s
+    CROSS JOIN LATERAL (
+        SELECT s::date AS day,
+               tstzrange(t.start_time, t.end_time)
+                   * tstzrange(s AT TIME ZONE %(tz)s, (s + interval '1 day') AT TIME ZONE %(tz)s) AS overlap,
+               s::date = (t.start_time AT TIME ZONE %(tz)s)::date AS starts_here
+    ) AS d
+    WHERE t.user_id = %(user_id)s
+      AND t.end_time IS NOT NULL
+      AND (d.starts_here OR NOT isempty(d.overlap))
+    GROUP BY t.user_id, d.day, t.task_type_id
+"""
+
+VERSION_KEY = 'analytics:version:{user_id}'
+
+
+def fill_rollups(apps, schema_editor):
+    """Compute the rollups of every user with completed tasks, clipped to local days"""
+    Task = apps.get_model('magus', 'Task')
+    Profile = apps.get_model('magus', 'Profile')
+    DailyRollup = apps.get_model('magus', 'DailyRollup')
+
+    zones = dict(Profile.objects.values_list('user_id', 'timezone'))
+    user_ids = list(
+        Task.objects.filter(end_time__isnull=False).order_by('user_id').values_list('user_id', flat=True).distinct()
+    )
+    sql = ROLLUP_SQL.format(rollup_table=DailyRollup._meta.db_table, task_table=Task._meta.db_table)
+
+    DailyRollup.objects.all().delete()
+    with schema_editor.connection.cursor() as cursor:
+        for user_id in user_ids:
+            cursor.execute(sql, {'user_id': user_id, 'tz': _zone_name(zones.get(user_id))})
+
+    # Cached analytics were computed from the old rows: drop the data versions
+    # so they are reseeded from the clock (see magus.caching)
+    if user_ids:
+        try:
+            cache.delete_many([VERSION_KEY.format(user_id=user_id) for user_id in user_ids])
+        except RedisError as e:
+            logger.warning(f"Could not reset analytics cache versions after the rollup rebuild: {e}")
+
+
+def _zone_name(name):
+    """Return a profile's timezone name, or the server default for a missing or unknown one"""
+    try:
+        return ZoneInfo(name).key
+    except (ZoneInfoNotFoundError, TypeError, ValueError):
+        return settings.TIME_ZONE
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('magus', '0007_task_one_open_per_user'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
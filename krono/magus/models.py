@@ -1,11 +1,14 @@
 import hashlib
 import secrets
 from datetime import timedelta
-from django.db import models
+from dateutil.relativedelta import relativedelta
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.utils import timezone
 from django.core.validators import EmailValidator
 
+from .dates import user_timezone
+
 
 class Profile(models.Model):
     """Extended user profile with app settings and preferences"""
@@ -138,12 +141,55 @@ class Task(models.Model):
             models.Index(fields=['user', '-start_time']),
             models.Index(fields=['user', 'end_time']),
             models.Index(fields=['user', 'task_type', '-start_time']),
+            models.Index(fields=['user', 'updated_at']),
+        ]
+        constraints = [
+            # At most one open (tracked) task per user; also the index behind open task lookups
+            models.UniqueConstraint(
+                fields=['user'],
+                condition=models.Q(end_time__isnull=True),
+                name='magus_task_one_open_per_user',
+            ),
         ]
 
     def __str__(self):
         status = "ongoing" if not self.end_time else "completed"
         return f"{self.user.username} - {self.task_type.name} ({status})"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the persisted state so rollups can be adjusted on save"""
+        from .rollups import TaskState, task_state
+
+        instance = super().from_db(db, field_names, values)
+        if set(TaskState._fields) <= set(field_names):
+            instance._rollup_state = task_state(instance)
+        return instance
+
+    def save(self, *args, **kwargs):
+        """Save the task and update the daily rollups in the same transaction"""
+        from .rollups import apply_task_change, stored_state, task_state
+
+        with transaction.atomic():
+            old_state = stored_state(self)
+            super().save(*args, **kwargs)
+            new_state = task_state(self)
+            apply_task_change(self.user, old_state, new_state)
+        self._rollup_state = new_state
+
+    def delete(self, *args, **kwargs):
+        """Delete the task, remove it from the daily rollups and record a tombstone"""
+        from .rollups import apply_task_change, stored_state
+
+        with transaction.atomic():
+            old_state = stored_state(self)
+            task_id = self.pk
+            result = super().delete(*args, **kwargs)
+            apply_task_change(self.user, old_state, None)
+            TaskDeletion.objects.create(user_id=self.user_id, task_id=task_id)
+        self._rollup_state = None
+        return result
+
     @property
     def duration(self):
         """Calculate duration in seconds"""
@@ -160,6 +206,47 @@ class Task(models.Model):
         return self.end_time - self.start_time
 
 
+class DailyRollup(models.Model):
+    """Per-day analytics totals for a task type, maintained on every Task write"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField(help_text="Local day in the user's timezone")
+    task_type = models.ForeignKey(TaskType, on_delete=models.CASCADE, related_name='daily_rollups')
+    
+    # Time of completed tasks clipped to this day; count and interrupted count of
+    # the tasks that started on it
+    total_seconds = models.FloatField(default=0)
+    task_count = models.IntegerField(default=0)
+    interrupted_count = models.IntegerField(default=0)
+    
+    # Timestamps
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-day']
+        unique_together = ['user', 'day', 'task_type']
+
+    def __str__(self):
+        return f"{self.user.username} - {self.day} - {self.task_type.name}"
+
+
+class TaskDeletion(models.Model):
+    """Tombstone of a deleted task, for incremental exports"""
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_deletions')
+    task_id = models.BigIntegerField(help_text="ID of the deleted task")
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-deleted_at']
+        indexes = [
+            models.Index(fields=['user', 'deleted_at']),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - task {self.task_id} deleted {self.deleted_at}"
+
+
 class APIKey(models.Model):
     """User-generated API keys for automation"""
     
@@ -222,6 +309,16 @@ class ScheduledExport(models.Model):
     email_to = models.EmailField(validators=[EmailValidator()])
     is_active = models.BooleanField(default=True)
     
+    # Incremental mode: send only tasks changed since the last run
+    incremental = models.BooleanField(
+        default=False,
+        help_text="Send only tasks created or changed since the last run"
+    )
+    include_deletions = models.BooleanField(
+        default=False,
+        help_text="In incremental mode, also list tasks deleted since the last run"
+    )
+    
     # Schedule tracking
     last_sent = models.DateTimeField(null=True, blank=True)
     next_scheduled = models.DateTimeField()
@@ -236,20 +333,129 @@ class ScheduledExport(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.get_frequency_display()} export to {self.email_to}"
 
-    def calculate_next_scheduled(self):
-        """Calculate next scheduled export time based on frequency"""
-        now = timezone.now()
-        if self.frequency == 'daily':
-            return now + timedelta(days=1)
-        elif self.frequency == 'weekly':
-            return now + timedelta(weeks=1)
-        elif self.frequency == 'monthly':
-            # Approximate 30 days
-            return now + timedelta(days=30)
-        return now
+    def calculate_next_scheduled(self, after=None):
+        """
+        Calculate the next scheduled export time after a moment (default: now).
+        
+        Steps whole calendar periods from the current schedule in the user's
+        timezone, so runs keep their local wall-clock time across DST and
+        monthly runs stay on the same day of the month (clamped to short
+        months) instead of drifting by 30-day steps. Missed runs are skipped,
+        not replayed.
+        """
+        after = after or timezone.now()
+        tz = user_timezone(self.user)
+        current = (self.next_scheduled or after).astimezone(tz)
+        anchor_day = (self.created_at or current).astimezone(tz).day
+        
+        step = 1
+        while True:
+            candidate = current + self._period(step, anchor_day)
+            if candidate > after:
+                return candidate
+            step += 1
+    
+    def export_range(self, run_at):
+        """
+        Return the (start_date, end_date) local dates covered by a run.
+        
+        A run sends the complete local days of the period that ended at the
+        start of the run's day: yesterday, the last 7 days or the last month.
+        """
+        run_date = run_at.astimezone(user_timezone(self.user)).date()
+        end_date = run_date - timedelta(days=1)
+        if self.frequency == 'weekly':
+            return run_date - timedelta(weeks=1), end_date
+        if self.frequency == 'monthly':
+            return run_date - relativedelta(months=1), end_date
+        return end_date, end_date
+    
+    def _period(self, count, anchor_day):
+        """Return the offset of `count` periods of this schedule's frequency"""
+        if self.frequency == 'weekly':
+            return timedelta(weeks=count)
+        if self.frequency == 'monthly':
+            # Absolute day is clamped to the month's length by relativedelta
+            return relativedelta(months=count, day=anchor_day)
+        return timedelta(days=count)
 
     def save(self, *args, **kwargs):
         """Auto-calculate next_scheduled if not set"""
         if not self.next_scheduled:
             self.next_scheduled = self.calculate_next_scheduled()
         super().save(*args, **kwargs)
+
+
+class ExportArtifact(models.Model):
+    """Export file written to disk by a background job, downloaded via a signed link"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='export_artifacts')
+    export_format = models.CharField(max_length=20, default='csv')
+    start_date = models.DateField()
+    end_date = models.DateField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    
+    # Path relative to EXPORT_ARTIFACT_ROOT, set once the file is complete
+    file_name = models.CharField(max_length=255, blank=True)
+    size = models.BigIntegerField(null=True, blank=True, help_text="File size in bytes")
+    error = models.TextField(blank=True)
+    
+    # Content address: hash of (user, range, format, timezone, data version)
+    cache_key = models.CharField(max_length=64, blank=True, db_index=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+    last_accessed = models.DateTimeField(null=True, blank=True, help_text="For LRU eviction")
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user.username} - {self.export_format} export {self.start_date} to {self.end_date} ({self.status})"
+
+
+class TaskImport(models.Model):
+    """Bulk import of an uploaded task file, run by a background job"""
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    ]
+    
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='task_imports')
+    import_format = models.CharField(max_length=20, default='csv')
+    create_types = models.BooleanField(
+        default=False,
+        help_text="Create task types that do not exist yet instead of skipping their rows"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    
+    # Upload path relative to TASK_IMPORT_ROOT, removed once the import ran
+    file_name = models.CharField(max_length=255, blank=True)
+    
+    # Progress and outcome
+    total_rows = models.IntegerField(null=True, blank=True, help_text="Rows to insert, once parsed")
+    processed_rows = models.IntegerField(default=0)
+    created_count = models.IntegerField(default=0)
+    skipped_count = models.IntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True, help_text="First row errors (line, error)")
+    error = models.TextField(blank=True)
+    
+    # Timestamps
+    created_at = models.DateTimeField(auto_now_add=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['-created_at']
+
+    def __str__(self):
+        return f"{self.user.username} - {self.import_format} import ({self.status})"
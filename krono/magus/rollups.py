@@ -0,0 +1,166 @@
+"""
+Maintenance of the per-day analytics rollups (DailyRollup)
+
+Every completed task contributes the part of its duration that falls on
+each local day to the rollup row for (user, day, task type). Its count and
+interrupted flag go to the day it started on.
+Task.save() and Task.delete() call apply_task_change() inside their own
+transaction, so the rollups move together with the task rows.
+"""
+from collections import defaultdict, namedtuple
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+
+from .aggregates import clipped_period_totals
+from .caching import bump_data_version_on_commit
+from .dates import local_day_range, user_timezone
+from .models import DailyRollup, Task
+
+# Rollups holding less than this after a subtraction are treated as empty
+EMPTY_ROLLUP_SECONDS = 0.001
+
+TaskState = namedtuple('TaskState', ['user_id', 'task_type_id', 'start_time', 'end_time', 'interrupted'])
+
+
+def task_state(task):
+    """Capture the fields that feed the rollups, or None for an ongoing task"""
+    if task is None or task.end_time is None:
+        return None
+    return TaskState(
+        user_id=task.user_id,
+        task_type_id=task.task_type_id,
+        start_time=task.start_time,
+        end_time=task.end_time,
+        interrupted=task.interrupted,
+    )
+
+
+def stored_state(task):
+    """
+    Return the state of a task as last written to the database.
+
+    Uses the snapshot taken when the task was loaded, and only queries when
+    the instance was loaded with deferred fields.
+    """
+    if hasattr(task, '_rollup_state'):
+        return task._rollup_state
+    if task._state.adding or task.pk is None:
+        return None
+
+    row = Task.objects.filter(pk=task.pk).values(*TaskState._fields).first()
+    if row is None or row['end_time'] is None:
+        return None
+    return TaskState(**row)
+
+
+def task_contributions(state, tz):
+    """
+    Return the rollup contributions of a completed task.
+
+    Returns:
+        {(day, task_type_id): (seconds, task_count, interrupted_count)}
+    """
+    day = state.start_time.astimezone(tz).date()
+    last_day = state.end_time.astimezone(tz).date()
+    interrupted = 1 if state.interrupted else 0
+
+    # Clip the interval to each local day it overlaps (a handful of days at most)
+    contributions = {(day, state.task_type_id): (0.0, 1, interrupted)}
+    while day <= last_day:
+        day_start, day_end = local_day_range(tz, day, day)
+        seconds = (min(state.end_time, day_end) - max(state.start_time, day_start)).total_seconds()
+        if seconds > 0:
+            _, count, day_interrupted = contributions.get((day, state.task_type_id), (0.0, 0, 0))
+            contributions[(day, state.task_type_id)] = (seconds, count, day_interrupted)
+        day += timedelta(days=1)
+    return contributions
+
+
+def apply_task_change(user, before, after):
+    """
+    Move a task's contribution from its previous state to its new one.
+
+    Args:
+        user: Owner of the task
+        before: TaskState as last persisted, or None
+        after: TaskState as now persisted, or None (ongoing or deleted)
+    """
+    apply_task_changes(user, [(before, after)])
+
+
+def apply_task_changes(user, changes):
+    """
+    Move the contributions of several tasks at once.
+
+    Deltas are summed first, so each affected rollup row is written once
+    however many of the tasks touch it.
+
+    Args:
+        user: Owner of the tasks
+        changes: (before, after) TaskState pairs, as for apply_task_change()
+    """
+    changes = [(before, after) for before, after in changes if before != after]
+    if not changes:
+        return
+
+    tz = user_timezone(user)
+    deltas = defaultdict(lambda: [0.0, 0, 0])
+    for before, after in changes:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            for key, values in task_contributions(state, tz).items():
+                for index, value in enumerate(values):
+                    deltas[key][index] += sign * value
+
+    with transaction.atomic():
+        for (day, task_type_id), (seconds, count, interrupted) in sorted(deltas.items()):
+            if not (seconds or count or interrupted):
+                continue
+
+            rollup, _ = DailyRollup.objects.select_for_update().get_or_create(
+                user=user,
+                day=day,
+                task_type_id=task_type_id,
+            )
+            DailyRollup.objects.filter(pk=rollup.pk).update(
+                total_seconds=F('total_seconds') + seconds,
+                task_count=F('task_count') + count,
+                interrupted_count=F('interrupted_count') + interrupted,
+            )
+            # Drop rows that no longer hold any tracked time (allowing for float residue)
+            DailyRollup.objects.filter(
+                pk=rollup.pk,
+                task_count__lte=0,
+                total_seconds__lt=EMPTY_ROLLUP_SECONDS,
+            ).delete()
+
+
+def rebuild_user_rollups(user):
+    """
+    Recompute all rollups for a user from their tasks.
+
+    Returns the number of rollup rows written.
+    """
+    tz = user_timezone(user)
+    rows = clipped_period_totals(user, 'day', tz)
+
+    with transaction.atomic():
+        DailyRollup.objects.filter(user=user).delete()
+        DailyRollup.objects.bulk_create(
+            DailyRollup(
+                user=user,
+                day=row['bucket'],
+                task_type_id=row['task_type_id'],
+                total_seconds=row['total_duration'],
+                task_count=row['task_count'],
+                interrupted_count=row['interrupted_count'],
+            )
+            for row in rows
+        )
+        bump_data_version_on_commit(user.id)
+
+    return len(rows)
+
@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
 from django.contrib.auth.models import User
-from .models import Profile, TaskType
+from .caching import bump_data_version_on_commit
+from .models import Profile, TaskType, Task
 
 
 @receiver(post_save, sender=User)
@@ -31,3 +32,12 @@ def save_user_profile(sender, instance, **kwargs):
     """Ensure profile exists and is saved"""
     if hasattr(instance, 'profile'):
         instance.profile.save()
+
+
+@receiver(post_save, sender=Task)
+@receiver(post_delete, sender=Task)
+@receiver(post_save, sender=TaskType)
+@receiver(post_delete, sender=TaskType)
+def invalidate_analytics_cache(sender, instance, **kwargs):
+    """Bump the owner's analytics data version on any task or task type change"""
+    bump_data_version_on_commit(instance.user_id)
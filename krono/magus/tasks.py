@@ -1,17 +1,53 @@
-import csv
-import io
 from datetime import datetime
 from celery import shared_task
+from celery.exceptions import SoftTimeLimitExceeded
+from django.conf import settings
 from django.contrib.auth.models import User
 from django.core.mail import EmailMessage
+from django.db import transaction
 from django.utils import timezone
-from .models import Task
+from .artifacts import (
+    artifact_path,
+    build_artifact,
+    cache_while_streaming,
+    cached_artifact,
+    evict_export_cache,
+    export_cache_key,
+    purge_expired_artifacts,
+)
+from .exporting import (
+    DEFAULT_EXPORT_FORMAT,
+    changed_queryset,
+    deleted_queryset,
+    delta_records,
+    export_blocks,
+    export_bytes,
+    export_filename,
+    export_queryset,
+    get_export_format,
+    purge_task_deletions,
+    user_export_records,
+)
+from .dates import user_timezone
+from .importing import run_task_import
+from .mailing import send_pooled
+from .models import ExportArtifact, ScheduledExport, Task, TaskImport
 import logging
 
 logger = logging.getLogger('magus')
 
+# Results are never read, so no task stores one. Export jobs run on the
+# exports queue (see CELERY_TASK_ROUTES) under a soft time limit, which
+# raises SoftTimeLimitExceeded inside the task so it can record the failure
+# before the hard limit kills the worker process.
+EXPORT_TASK_OPTIONS = {
+    'ignore_result': True,
+    'soft_time_limit': settings.EXPORT_TASK_SOFT_TIME_LIMIT,
+    'time_limit': settings.EXPORT_TASK_TIME_LIMIT,
+}
 
-@shared_task
+
+@shared_task(ignore_result=True)
 def check_heartbeats():
     """Legacy heartbeat check - kept for compatibility"""
     threshold = timezone.now() - timezone.timedelta(seconds=60)
@@ -20,7 +56,7 @@ def check_heartbeats():
         handle_missed_heartbeat.delay(user.id, user.username)
 
 
-@shared_task
+@shared_task(ignore_result=True)
 def handle_missed_heartbeat(user_id, username):
     """Legacy heartbeat handler - kept for compatibility"""
     logger.info(f"User {username} missed a heartbeat.")
@@ -40,103 +76,338 @@ def handle_missed_heartbeat(user_id, username):
         logger.warning(f"User with id {user_id} does not exist")
 
 
-@shared_task
-def send_csv_export_email(user_id, start_date_str, end_date_str, email_to):
+def export_email(user, start_date, end_date, email_to, export_format=DEFAULT_EXPORT_FORMAT):
+    """
+    Build an export and the email carrying it as an attachment.
+    
+    Args:
+        user: Owner of the tasks
+        start_date: First local day (inclusive)
+        end_date: Last local day (inclusive)
+        email_to: Email address to send to
+        export_format: Name of an export format (see magus.exporting.EXPORT_FORMATS)
+    
+    Returns:
+        EmailMessage
+    """
+    fmt = get_export_format(export_format)
+    
+    tasks = export_queryset(user, start_date, end_date)
+    cache_key = export_cache_key(user, start_date, end_date, fmt)
+    artifact = cached_artifact(user, cache_key) if cache_key else None
+    if artifact is not None:
+        with open(artifact_path(artifact.file_name), 'rb') as f:
+            content = f.read()
+    else:
+        blocks = export_blocks(fmt, user_export_records(user, start_date, end_date))
+        if cache_key:
+            blocks = cache_while_streaming(user, start_date, end_date, fmt, cache_key, blocks)
+        content = b''.join(blocks)
+    
+    return _export_message(
+        user,
+        email_to,
+        fmt,
+        subject=f'MAGUS Time Tracking Export - {start_date} to {end_date}',
+        details=[
+            f'Date Range: {start_date} to {end_date}',
+            f'Total Entries: {tasks.count()}',
+        ],
+        filename=export_filename(fmt, start_date, end_date),
+        content=content,
+    )
+
+
+def export_changes_email(user, since, until, email_to, include_deletions=False,
+                         export_format=DEFAULT_EXPORT_FORMAT):
+    """
+    Build the email of an incremental export: the tasks created or changed in (since, until].
+    
+    Args:
+        user: Owner of the tasks
+        since: Aware datetime of the previous run (exclusive)
+        until: Aware datetime of this run (inclusive)
+        email_to: Email address to send to
+        include_deletions: Also list tasks deleted in the window
+        export_format: Name of an export format (see magus.exporting.EXPORT_FORMATS)
+    
+    Returns:
+        EmailMessage
+    """
+    fmt = get_export_format(export_format)
+    
+    changed = changed_queryset(user, since, until)
+    deleted = deleted_queryset(user, since, until) if include_deletions else None
+    tz = user_timezone(user)
+    content = export_bytes(fmt, delta_records(changed, deleted, tzinfo=tz), delta=True)
+    
+    details = [
+        f'Changes Since: {timezone.localtime(since, tz).strftime("%Y-%m-%d %H:%M:%S")}',
+        f'Changed Entries: {changed.count()}',
+    ]
+    if deleted is not None:
+        details.append(f'Deleted Entries: {deleted.count()}')
+    
+    return _export_message(
+        user,
+        email_to,
+        fmt,
+        subject=f'MAGUS Time Tracking Changes - {timezone.localtime(until, tz).date()}',
+        details=details,
+        filename=f'magus_changes_{timezone.localtime(until, tz):%Y-%m-%d_%H%M%S}.{fmt.extension}',
+        content=content,
+    )
+
+
+def _export_message(user, email_to, fmt, subject, details, filename, content):
+    """Build an email with an export attachment and the standard message body"""
+    detail_lines = '\n'.join(f'- {line}' for line in details)
+    body = f"""Hi {user.username},
+
+Your time tracking data export is attached.
+
+Export Details:
+{detail_lines}
+- Generated: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')}
+
+This export was generated from your MAGUS instance.
+"""
+    
+    email = EmailMessage(
+        subject=subject,
+        body=body,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[email_to],
+    )
+    
+    email.attach(filename, content, fmt.content_type)
+    return email
+
+
+@shared_task(**EXPORT_TASK_OPTIONS)
+def send_csv_export_email(user_id, start_date_str, end_date_str, email_to, export_format=DEFAULT_EXPORT_FORMAT):
     """
-    Generate CSV export and send via email.
+    Generate an export and send it via email.
     
     Args:
         user_id: User ID
         start_date_str: Start date in ISO format (YYYY-MM-DD)
         end_date_str: End date in ISO format (YYYY-MM-DD)
         email_to: Email address to send to
+        export_format: Name of an export format (see magus.exporting.EXPORT_FORMATS)
     """
     try:
         user = User.objects.get(id=user_id)
         start_date = datetime.fromisoformat(start_date_str).date()
         end_date = datetime.fromisoformat(end_date_str).date()
+        failures = send_pooled([export_email(user, start_date, end_date, email_to, export_format)])
+        if failures:
+            raise failures[0]
+        logger.info(f"{export_format} export sent to {email_to} for user {user.username}")
         
-        # Get tasks
-        tasks = Task.objects.filter(
-            user=user,
-            start_time__date__gte=start_date,
-            start_time__date__lte=end_date,
-            end_time__isnull=False
-        ).select_related('task_type').order_by('start_time')
-        
-        # Generate CSV
-        output = io.StringIO()
-        writer = csv.writer(output)
-        
-        # Header
-        writer.writerow([
-            'Date',
-            'Task Type',
-            'Start Time',
-            'End Time',
-            'Duration (HH:MM:SS)',
-            'Interrupted',
-            'Notes',
-            'Edited'
-        ])
-        
-        # Rows
-        for task in tasks:
-            duration_seconds = task.duration
-            hours = int(duration_seconds // 3600)
-            minutes = int((duration_seconds % 3600) // 60)
-            seconds = int(duration_seconds % 60)
-            duration_str = f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+    except User.DoesNotExist:
+        logger.error(f"User with id {user_id} does not exist")
+    except Exception as e:
+        logger.error(f"Error generating export: {str(e)}")
+        raise
+
+
+@shared_task(ignore_result=True)
+def dispatch_scheduled_exports():
+    """
+    Queue every due scheduled export.
+    
+    Due rows are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED and
+    moved to their next run time in the same transaction, so concurrent
+    dispatchers split the work instead of sending duplicates. Sends are
+    queued once the batch commits.
+    
+    Returns the number of exports queued.
+    """
+    now = timezone.now()
+    batch_size = settings.SCHEDULED_EXPORT_BATCH_SIZE
+    queued = 0
+    
+    while True:
+        with transaction.atomic():
+            batch = list(
+                ScheduledExport.objects.select_for_update(skip_locked=True, of=('self',))
+                .select_related('user__profile')
+                .filter(is_active=True, next_scheduled__lte=now)
+                .order_by('next_scheduled')[:batch_size]
+            )
+            if not batch:
+                break
             
-            # Convert to user timezone
-            start_local = timezone.localtime(task.start_time)
-            end_local = timezone.localtime(task.end_time) if task.end_time else None
+            sends = []
+            for export in batch:
+                start_date, end_date = export.export_range(export.next_scheduled)
+                since = export.last_sent if export.incremental else None
+                sends.append((
+                    export.id,
+                    start_date.isoformat(),
+                    end_date.isoformat(),
+                    now.isoformat(),
+                    since.isoformat() if since else None,
+                ))
+                export.next_scheduled = export.calculate_next_scheduled(after=now)
+                export.updated_at = now
+            ScheduledExport.objects.bulk_update(batch, ['next_scheduled', 'updated_at'])
             
-            writer.writerow([
-                start_local.strftime('%Y-%m-%d'),
-                task.task_type.name,
-                start_local.strftime('%Y-%m-%d %H:%M:%S'),
-                end_local.strftime('%Y-%m-%d %H:%M:%S') if end_local else '',
-                duration_str,
-                'Yes' if task.interrupted else 'No',
-                task.notes,
-                'Yes' if task.edited_by_user else 'No',
-            ])
+            transaction.on_commit(lambda sends=sends: _queue_scheduled_sends(sends))
         
-        # Create email
-        subject = f'MAGUS Time Tracking Export - {start_date} to {end_date}'
-        body = f"""Hi {user.username},
+        queued += len(batch)
+        if len(batch) < batch_size:
+            break
+    
+    if queued:
+        logger.info(f"Queued {queued} scheduled exports")
+    return queued
 
-Your time tracking data export is attached.
 
-Export Details:
-- Date Range: {start_date} to {end_date}
-- Total Entries: {tasks.count()}
-- Generated: {timezone.now().strftime('%Y-%m-%d %H:%M:%S')}
+def _queue_scheduled_sends(sends):
+    """Queue the claimed scheduled exports in batches sharing one mail connection"""
+    batch_size = settings.SCHEDULED_EXPORT_EMAIL_BATCH_SIZE
+    for offset in range(0, len(sends), batch_size):
+        send_scheduled_export_batch.delay(sends[offset:offset + batch_size])
 
-This export was generated from your MAGUS instance.
-"""
-        
-        email = EmailMessage(
-            subject=subject,
-            body=body,
-            from_email='noreply@magus.local',
-            to=[email_to],
-        )
-        
-        # Attach CSV
-        email.attach(
-            f'magus_export_{start_date}_{end_date}.csv',
-            output.getvalue(),
-            'text/csv'
-        )
-        
-        email.send()
-        
-        logger.info(f"CSV export sent to {email_to} for user {user.username}")
+
+@shared_task(**EXPORT_TASK_OPTIONS)
+def send_scheduled_export_batch(sends):
+    """
+    Send runs of scheduled exports over one mail connection.
+    
+    Every run's email is built first; a run whose export fails is logged and
+    skipped. The emails are then sent together (see magus.mailing), and each
+    delivered run is recorded as sent. Runs that could not be delivered keep
+    their last_sent, so the next run of an incremental export also covers
+    their changes.
+    
+    Args:
+        sends: One [scheduled_export_id, start_date_str, end_date_str,
+            until_str, since_str] list per run (see send_scheduled_export)
+    
+    Returns the number of exports sent.
+    """
+    exports = ScheduledExport.objects.select_related('user__profile').in_bulk([args[0] for args in sends])
+    
+    runs, messages = [], []
+    for scheduled_export_id, start_date_str, end_date_str, until_str, since_str in sends:
+        export = exports.get(scheduled_export_id)
+        if export is None or not export.is_active:
+            logger.info(f"Scheduled export {scheduled_export_id} no longer active, skipping")
+            continue
         
-    except User.DoesNotExist:
-        logger.error(f"User with id {user_id} does not exist")
+        until = datetime.fromisoformat(until_str) if until_str else timezone.now()
+        try:
+            if since_str:
+                message = export_changes_email(
+                    export.user,
+                    datetime.fromisoformat(since_str),
+                    until,
+                    export.email_to,
+                    include_deletions=export.include_deletions,
+                )
+            else:
+                start_date = datetime.fromisoformat(start_date_str).date()
+                end_date = datetime.fromisoformat(end_date_str).date()
+                message = export_email(export.user, start_date, end_date, export.email_to)
+        except SoftTimeLimitExceeded:
+            logger.warning(f"Time limit reached, sending {len(messages)} of {len(sends)} scheduled exports")
+            break
+        except Exception as e:  # noqa: BLE001 - one failing export must not hold up the batch
+            logger.error(f"Error generating scheduled export {export.id}: {e}")
+            continue
+        runs.append((export.id, until))
+        messages.append(message)
+    
+    failures = send_pooled(messages)
+    for index, (scheduled_export_id, until) in enumerate(runs):
+        if index not in failures:
+            # The next incremental run picks up exactly where this one's window ended
+            ScheduledExport.objects.filter(id=scheduled_export_id).update(last_sent=until)
+    
+    sent = len(runs) - len(failures)
+    if runs:
+        logger.info(f"Sent {sent} of {len(runs)} scheduled exports")
+    return sent
+
+
+@shared_task(**EXPORT_TASK_OPTIONS)
+def send_scheduled_export(scheduled_export_id, start_date_str, end_date_str, until_str=None, since_str=None):
+    """
+    Send one run of a scheduled export and record it as sent.
+    
+    Incremental exports that have run before send the tasks changed between
+    the previous run and this one; all others send the run's date range.
+    
+    Args:
+        scheduled_export_id: ScheduledExport ID
+        start_date_str: Start date in ISO format (YYYY-MM-DD)
+        end_date_str: End date in ISO format (YYYY-MM-DD)
+        until_str: ISO datetime the run was claimed at (becomes last_sent)
+        since_str: ISO datetime of the previous run, for incremental exports
+    """
+    return send_scheduled_export_batch([[scheduled_export_id, start_date_str, end_date_str, until_str, since_str]])
+
+
+@shared_task(**EXPORT_TASK_OPTIONS)
+def build_export_artifact(artifact_id):
+    """
+    Write an export artifact to disk.
+    
+    Args:
+        artifact_id: ExportArtifact ID
+    """
+    try:
+        artifact = ExportArtifact.objects.select_related('user').get(id=artifact_id)
+    except ExportArtifact.DoesNotExist:
+        logger.warning(f"Export artifact {artifact_id} does not exist")
+        return
+    
+    try:
+        build_artifact(artifact)
+        logger.info(f"Export artifact {artifact_id} written ({artifact.size} bytes)")
+    except Exception as e:
+        logger.error(f"Error building export artifact {artifact_id}: {e}")
+        raise
+
+
+@shared_task(ignore_result=True)
+def purge_export_artifacts():
+    """Delete expired export artifacts and their files, then trim the export cache"""
+    count = purge_expired_artifacts()
+    evicted = evict_export_cache()
+    if count or evicted:
+        logger.info(f"Purged {count} expired and evicted {evicted} cached export artifacts")
+
+
+@shared_task(ignore_result=True)
+def purge_deletion_tombstones():
+    """Delete task tombstones no incremental export still needs"""
+    count = purge_task_deletions()
+    if count:
+        logger.info(f"Purged {count} task deletion tombstones")
+
+
+@shared_task(**EXPORT_TASK_OPTIONS)
+def import_task_file(task_import_id):
+    """
+    Import an uploaded task file.
+    
+    Args:
+        task_import_id: TaskImport ID
+    """
+    try:
+        task_import = TaskImport.objects.select_related('user__profile').get(id=task_import_id)
+    except TaskImport.DoesNotExist:
+        logger.warning(f"Task import {task_import_id} does not exist")
+        return
+    
+    try:
+        run_task_import(task_import)
+        logger.info(f"Task import {task_import_id} created {task_import.created_count} tasks, "
+                    f"skipped {task_import.skipped_count} rows")
     except Exception as e:
-        logger.error(f"Error generating CSV export: {str(e)}")
+        logger.error(f"Error importing task file {task_import_id}: {e}")
         raise
@@ -0,0 +1,34 @@
+"""
+Shared pytest fixtures for MAGUS tests
+"""
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def local_memory_cache(settings):
+    """Run tests against an isolated in-process cache instead of Redis"""
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'magus-tests',
+        }
+    }
+    from django.core.cache import cache
+
+    cache.clear()
+    yield
+    cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def export_artifact_root(settings, tmp_path):
+    """Write export artifacts to a per-test directory"""
+    settings.EXPORT_ARTIFACT_ROOT = str(tmp_path / 'exports')
+    return settings.EXPORT_ARTIFACT_ROOT
+
+
+@pytest.fixture(autouse=True)
+def task_import_root(settings, tmp_path):
+    """Save import uploads to a per-test directory"""
+    settings.TASK_IMPORT_ROOT = str(tmp_path / 'imports')
+    return settings.TASK_IMPORT_ROOT
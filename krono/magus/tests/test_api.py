@@ -1,10 +1,19 @@
 """
 API endpoint tests for MAGUS
 """
+import gzip
+import json
+from datetime import UTC, datetime, timedelta
+from zoneinfo import ZoneInfo
+
 import pytest
-from rest_framework.test import APIClient
 from django.contrib.auth.models import User
-from magus.models import TaskType
+from django.core.cache import cache
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from magus.current_task import current_task_key
+from magus.models import Task, TaskType
 
 
 @pytest.mark.django_db
@@ -108,3 +117,940 @@ class TestTaskTrackingAPI:
         assert response.status_code == 200
         assert response.data['end_time'] is not None
 
+    def test_second_open_task_is_rejected_by_the_schema(self):
+        """Test a start racing past a stale pointer is answered as already tracking"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        open_task = Task.objects.create(user=user, task_type=task_type, start_time=timezone.now())
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        # What a concurrent start sees before the other one commits
+        cache.set(current_task_key(user.id), {'task': None})
+
+        response = client.post('/api/tasks/start/', {'task_type_id': task_type.id})
+        assert response.status_code == 400
+        assert response.data['current_task_id'] == open_task.id
+
+        cache.set(current_task_key(user.id), {'task': None})
+        response = client.post('/api/tasks/', {
+            'task_type': task_type.id,
+            'start_time': timezone.now().isoformat(),
+        })
+        assert response.status_code == 400
+        assert 'end_time' in response.data
+        assert Task.objects.filter(user=user, end_time__isnull=True).count() == 1
+        assert client.get('/api/tasks/current/').data['id'] == open_task.id
+
+
+
+    def test_date_filter_uses_profile_timezone(self):
+        """Test start_date/end_date select tasks by the user's local day"""
+        from datetime import UTC, datetime
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        user.profile.timezone = 'Asia/Tokyo'
+        user.profile.save()
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        # 2024-03-01 23:30 UTC is 2024-03-02 08:30 in Tokyo
+        start = datetime(2024, 3, 1, 23, 30, tzinfo=UTC)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(hours=1))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/tasks/', {'start_date': '2024-03-02', 'end_date': '2024-03-02', 'count': 'true'})
+        assert response.status_code == 200
+        assert response.data['count'] == 1
+        
+        response = client.get('/api/tasks/', {'start_date': '2024-03-01', 'end_date': '2024-03-01', 'count': 'true'})
+        assert response.data['count'] == 0
+        
+        response = client.get('/api/tasks/', {'start_date': '03/01/2024'})
+        assert response.status_code == 400
+    
+    def test_task_list_pages_by_cursor(self, monkeypatch, django_assert_num_queries):
+        """Test cursor pages walk the history once in either direction, ties included"""
+        from django.db.models import F
+
+        from magus.api.pagination import TaskCursorPagination
+        
+        monkeypatch.setattr(TaskCursorPagination, 'page_size', 3)
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        start = datetime(2024, 3, 1, 9, 0, tzinfo=UTC)
+        for hour in (0, 1, 1, 1, 2, 3, 4):
+            Task.objects.create(user=user, task_type=task_type, start_time=start + timedelta(hours=hour),
+                                end_time=start + timedelta(hours=hour, minutes=30))
+        Task.objects.create(user=user, task_type=task_type, start_time=start + timedelta(hours=5))
+        newest_first = list(Task.objects.filter(user=user).order_by('-start_time', '-id').values_list('id', flat=True))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        # Load the current task pointer, which the list's ETag check reads
+        client.get('/api/tasks/current/')
+        pages, url = [], '/api/tasks/'
+        while url:
+            with django_assert_num_queries(1):
+                response = client.get(url)
+            assert 'count' not in response.data
+            pages.append([task['id'] for task in response.data['results']])
+            url = response.data['next']
+        assert [len(page) for page in pages] == [3, 3, 2]
+        assert [task_id for page in pages for task_id in page] == newest_first
+        
+        response = client.get(response.data['previous'])
+        assert [task['id'] for task in response.data['results']] == pages[1]
+        response = client.get(response.data['previous'])
+        assert [task['id'] for task in response.data['results']] == pages[0]
+        assert response.data['previous'] is None
+        
+        # The open task's NULL end_time sorts last ascending and first descending
+        for ordering in ('end_time', '-end_time', 'created_at'):
+            ids, url = [], f'/api/tasks/?ordering={ordering}&count=true'
+            while url:
+                response = client.get(url)
+                assert response.data['count'] == 8
+                ids += [task['id'] for task in response.data['results']]
+                url = response.data['next']
+            field = F(ordering.lstrip('-'))
+            if ordering.startswith('-'):
+                expected = Task.objects.order_by(field.desc(nulls_first=True), '-id')
+            else:
+                expected = Task.objects.order_by(field.asc(nulls_last=True), 'id')
+            assert ids == list(expected.filter(user=user).values_list('id', flat=True))
+        
+        assert client.get('/api/tasks/', {'cursor': 'bogus'}).status_code == 404
+    
+    def test_task_list_side_loads_types_and_sparse_fields(self, django_assert_num_queries):
+        """Test the compact list mode sends each task type once and only the requested fields"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        first_type, second_type = TaskType.objects.filter(user=user)[:2]
+        start = datetime(2024, 3, 1, 9, 0, tzinfo=UTC)
+        for hour in range(6):
+            Task.objects.create(user=user, task_type=(first_type, second_type)[hour % 2],
+                                start_time=start + timedelta(hours=hour),
+                                end_time=start + timedelta(hours=hour, minutes=30))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        full = client.get('/api/tasks/')
+        
+        with django_assert_num_queries(2):
+            response = client.get('/api/tasks/', {'include': 'task_types'})
+        assert response.status_code == 200
+        task = response.data['results'][0]
+        assert 'task_type_detail' not in task
+        assert task['task_type'] == second_type.id
+        assert set(task) | {'task_type_detail'} == set(full.data['results'][0]) | {'task_type'}
+        assert {t['id'] for t in response.data['included']['task_types']} == {first_type.id, second_type.id}
+        assert len(response.content) < len(full.content)
+        
+        response = client.get('/api/tasks/', {'include': 'task_types', 'fields': 'id,task_type,start_time'})
+        assert [set(task) for task in response.data['results']] == [{'id', 'task_type', 'start_time'}] * 6
+        assert len(response.data['included']['task_types']) == 2
+        
+        response = client.get('/api/tasks/', {'fields': 'id,duration'})
+        assert set(response.data['results'][0]) == {'id', 'duration'}
+        assert 'included' not in response.data
+        
+        response = client.get('/api/tasks/', {'fields': 'id,task_type'})
+        assert response.status_code == 400
+        assert 'task_type' in response.data['fields']
+    
+    def test_current_supports_conditional_get(self, django_capture_on_commit_callbacks):
+        """Test /tasks/current/ and the list answer 304 until the data changes, but never while tracking"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/tasks/current/')
+        assert response.status_code == 200
+        etag = response['ETag']
+        assert 'private' in response['Cache-Control']
+        assert 'Last-Modified' not in response
+        
+        response = client.get('/api/tasks/current/', HTTP_IF_NONE_MATCH=etag)
+        assert response.status_code == 304
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post('/api/tasks/start/', {'task_type_id': task_type.id})
+        
+        # The running duration changes on every read: always send the body
+        for url in ('/api/tasks/current/', '/api/tasks/'):
+            first = client.get(url)
+            assert 'ETag' not in first
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+            assert response.status_code == 200
+        assert response.data['results'][0]['task_type_detail']['id'] == task_type.id
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post('/api/tasks/stop/')
+        
+        response = client.get('/api/tasks/')
+        assert response['ETag'] != etag
+        response = client.get('/api/tasks/', HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+
+    def test_current_is_served_from_the_task_pointer(self, django_capture_on_commit_callbacks,
+                                                     django_assert_num_queries):
+        """Test /tasks/current/ needs no query once read, and follows stops, switches and renames"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        first_type, second_type = TaskType.objects.filter(user=user)[:2]
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+
+        with django_capture_on_commit_callbacks(execute=True):
+            started = client.post('/api/tasks/start/', {'task_type_id': first_type.id}).data
+
+        with django_assert_num_queries(1):
+            client.get('/api/tasks/current/')
+        with django_assert_num_queries(0):
+            response = client.get('/api/tasks/current/')
+        assert response.data['id'] == started['id']
+        assert response.data['start_time'] == started['start_time']
+        assert response.data['duration'] >= 0
+
+        with django_capture_on_commit_callbacks(execute=True):
+            switched = client.post('/api/tasks/interrupt/', {'task_type_id': second_type.id}).data
+        assert client.get('/api/tasks/current/').data['id'] == switched['new_task']['id']
+
+        with django_capture_on_commit_callbacks(execute=True):
+            client.patch(f'/api/task-types/{second_type.id}/', {'name': 'Renamed'})
+        assert client.get('/api/tasks/current/').data['task_type_detail']['name'] == 'Renamed'
+
+        tracking_key = current_task_key(user.id)
+        tracking = cache.get(tracking_key)
+        with django_capture_on_commit_callbacks(execute=True):
+            client.post('/api/tasks/stop/')
+        # A read that loaded the open task before the stop committed stores it late
+        cache.set(tracking_key, tracking)
+
+        assert client.get('/api/tasks/current/').data is None
+        with django_assert_num_queries(0):
+            assert client.get('/api/tasks/current/').data is None
+        with django_capture_on_commit_callbacks(execute=True):
+            assert client.post('/api/tasks/start/', {'task_type_id': first_type.id}).status_code == 201
+
+@pytest.mark.django_db
+class TestAnalyticsAPI:
+    """Test analytics endpoints"""
+    
+    def test_summary_aggregates_by_task_type(self):
+        """Test today's summary sums durations and counts per task type"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        deep_work, email = TaskType.objects.filter(user=user)[:2]
+        
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=deep_work, start_time=start,
+                            end_time=start + timedelta(hours=2))
+        Task.objects.create(user=user, task_type=deep_work, start_time=start + timedelta(hours=2),
+                            end_time=start + timedelta(hours=3), interrupted=True)
+        Task.objects.create(user=user, task_type=email, start_time=start + timedelta(hours=3),
+                            end_time=start + timedelta(hours=4))
+        # Ongoing tasks are excluded
+        Task.objects.create(user=user, task_type=email, start_time=start + timedelta(hours=4))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/analytics/summary/')
+        
+        assert response.status_code == 200
+        assert response.data['total_tracked'] == 4 * 3600
+        assert response.data['total_tracked_formatted'] == '4h 0m'
+        first = response.data['task_types'][0]
+        assert first['task_type_id'] == deep_work.id
+        assert first['task_type_name'] == deep_work.name
+        assert first['total_duration'] == 3 * 3600
+        assert first['task_count'] == 2
+        assert first['interrupted_count'] == 1
+        assert first['duration_formatted'] == '3h 0m'
+        assert first['percentage'] == 75
+    
+    def test_breakdown_response_shapes(self):
+        """Test daily and weekly breakdowns keep their per-type fields"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(minutes=90))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        daily = client.get('/api/analytics/daily/', {'date': start.date().isoformat()})
+        assert daily.status_code == 200
+        assert daily.data['task_types'][0]['task_count'] == 1
+        assert 'interrupted_count' not in daily.data['task_types'][0]
+        
+        weekly = client.get('/api/analytics/weekly/')
+        assert weekly.status_code == 200
+        assert weekly.data['total_tracked_formatted'] == '1h 30m'
+        assert 'task_count' not in weekly.data['task_types'][0]
+    
+    def test_weekly_range_uses_single_query(self, django_assert_num_queries):
+        """Test long ranges are zero-filled from one grouped query"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(hours=1))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        start_date = (start - timedelta(days=89)).date()
+        with django_assert_num_queries(1):
+            response = client.get('/api/analytics/weekly/', {
+                'start_date': start_date.isoformat(),
+                'end_date': start.date().isoformat(),
+            })
+        
+        assert response.status_code == 200
+        assert len(response.data['daily_data']) == 90
+        assert response.data['daily_data'][0]['total_duration'] == 0
+        assert response.data['daily_data'][-1]['total_duration'] == 3600
+        assert response.data['daily_data'][-1]['task_types'][0]['task_type_id'] == task_type.id
+    
+    def test_analytics_responses_are_cached_until_data_changes(self, django_capture_on_commit_callbacks):
+        """Test repeat requests hit the cache and task writes invalidate it"""
+        from magus.caching import cache_stats
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        first = client.get('/api/analytics/summary/')
+        second = client.get('/api/analytics/summary/')
+        assert first['X-Cache'] == 'MISS'
+        assert second['X-Cache'] == 'HIT'
+        assert second.data == first.data
+        
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        with django_capture_on_commit_callbacks(execute=True):
+            Task.objects.create(user=user, task_type=task_type, start_time=start,
+                                end_time=start + timedelta(hours=1))
+        
+        third = client.get('/api/analytics/summary/')
+        assert third['X-Cache'] == 'MISS'
+        assert third.data['total_tracked'] == 3600
+        
+        stats = cache_stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 2
+    
+    def test_analytics_are_computed_when_the_cache_is_down(self, monkeypatch):
+        """Test cache backend errors fall back to computing the response"""
+        from redis.exceptions import ConnectionError as RedisConnectionError
+        
+        def unavailable(*args, **kwargs):
+            raise RedisConnectionError('Connection refused')
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        monkeypatch.setattr(cache, 'get', unavailable)
+        response = client.get('/api/analytics/summary/')
+        
+        assert response.status_code == 200
+        assert 'X-Cache' not in response
+        assert 'ETag' not in response
+    
+    def test_timeseries_hourly_buckets_in_user_timezone(self):
+        """Test hourly buckets are zero-filled and truncated in the profile timezone"""
+        from datetime import UTC, datetime
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        user.profile.timezone = 'Asia/Kolkata'
+        user.profile.save()
+        deep_work, email = TaskType.objects.filter(user=user)[:2]
+        
+        # 03:30 UTC is 09:00 in Kolkata (UTC+5:30)
+        start = datetime(2024, 3, 2, 3, 30, tzinfo=UTC)
+        Task.objects.create(user=user, task_type=deep_work, start_time=start,
+                            end_time=start + timedelta(minutes=45))
+        Task.objects.create(user=user, task_type=email, start_time=start + timedelta(minutes=50),
+                            end_time=start + timedelta(minutes=55))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/analytics/timeseries/', {
+            'granularity': 'hour',
+            'start_date': '2024-03-02',
+            'end_date': '2024-03-02',
+            'task_type': str(deep_work.id),
+        })
+        
+        assert response.status_code == 200
+        buckets = response.data['buckets']
+        assert len(buckets) == 24
+        assert buckets[9]['start'] == '2024-03-02T09:00:00+05:30'
+        assert buckets[9]['total_duration'] == 45 * 60
+        assert sum(bucket['total_duration'] for bucket in buckets) == 45 * 60
+        assert [item['task_type_id'] for item in response.data['task_types']] == [deep_work.id]
+    
+    def test_timeseries_rejects_invalid_granularity(self):
+        """Test unknown granularities are rejected"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/analytics/timeseries/', {'granularity': 'minute'})
+        assert response.status_code == 400
+        
+        response = client.get('/api/analytics/timeseries/', {'granularity': 'month'})
+        assert response.status_code == 200
+        assert len(response.data['buckets']) in (12, 13)
+    
+    def test_heatmap_rejects_malformed_dates(self):
+        """Test a malformed heatmap date is a 400, not a server error"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        for param in ('start_date', 'end_date'):
+            response = client.get('/api/analytics/heatmap/', {param: '03/01/2024'})
+            assert response.status_code == 400
+            assert param in response.data['error']
+    
+    def test_timeseries_splits_tasks_across_days(self):
+        """Test a task running past midnight counts toward both days"""
+        from datetime import datetime
+        from zoneinfo import ZoneInfo
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = datetime(2024, 3, 1, 23, 0, tzinfo=ZoneInfo('America/Denver'))
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(hours=3))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/analytics/timeseries/', {
+            'granularity': 'day',
+            'start_date': '2024-03-01',
+            'end_date': '2024-03-03',
+        })
+        
+        assert response.status_code == 200
+        assert [bucket['total_duration'] for bucket in response.data['buckets']] == [3600, 7200, 0]
+        assert response.data['task_types'][0]['task_count'] == 1
+        
+        # Ranges clip tasks that started before them
+        response = client.get('/api/analytics/timeseries/', {
+            'granularity': 'hour',
+            'start_date': '2024-03-02',
+            'end_date': '2024-03-02',
+        })
+        assert response.data['total_tracked'] == 7200
+        assert response.data['buckets'][0]['total_duration'] == 3600
+        assert response.data['task_types'][0]['task_count'] == 0
+    
+    def test_analytics_conditional_get_skips_queries(self, django_assert_num_queries):
+        """Test a matching If-None-Match returns 304 without touching the database"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/analytics/weekly/')
+        assert response.status_code == 200
+        
+        with django_assert_num_queries(0):
+            response = client.get('/api/analytics/weekly/', HTTP_IF_NONE_MATCH=response['ETag'])
+        assert response.status_code == 304
+    
+    def test_dashboard_matches_widget_endpoints_in_one_query(self, django_assert_num_queries):
+        """Test the dashboard answers every widget from one query with the same shapes"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = timezone.localtime().replace(hour=0, minute=30, second=0, microsecond=0)
+        for days_ago in (0, 3, 40):
+            task_start = start - timedelta(days=days_ago)
+            Task.objects.create(user=user, task_type=task_type, start_time=task_start,
+                                end_time=task_start + timedelta(minutes=45))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        with django_assert_num_queries(1):
+            response = client.get('/api/analytics/dashboard/')
+        assert response.status_code == 200
+        
+        widgets = response.data['widgets']
+        assert list(widgets) == ['summary', 'weekly', 'monthly', 'heatmap']
+        for name in widgets:
+            assert widgets[name] == client.get(f'/api/analytics/{name}/').data
+        
+        response = client.get('/api/analytics/dashboard/', {'widgets': 'heatmap,summary'})
+        assert list(response.data['widgets']) == ['summary', 'heatmap']
+        
+        response = client.get('/api/analytics/dashboard/', {'widgets': 'bogus'})
+        assert response.status_code == 400
+    
+    def test_session_stats_percentiles_gaps_and_streaks(self):
+        """Test session statistics computed in SQL over a day of sessions"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        type_a, type_b = TaskType.objects.filter(user=user)[:2]
+        
+        day = (timezone.localtime() - timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+        sessions = [
+            (type_a, 0, 10, False),
+            (type_a, 12, 32, False),   # 2 minute gap continues the streak
+            (type_b, 34, 64, True),    # interrupted: ends the streak
+            (type_a, 64, 104, False),
+            (type_b, 180, 210, False),  # 76 minute gap
+        ]
+        for task_type, start, end, interrupted in sessions:
+            Task.objects.create(user=user, task_type=task_type, interrupted=interrupted,
+                                start_time=day + timedelta(minutes=start),
+                                end_time=day + timedelta(minutes=end))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/analytics/sessions/', {
+            'start_date': day.date().isoformat(),
+            'end_date': day.date().isoformat(),
+        })
+        assert response.status_code == 200
+        
+        by_type = {item['task_type_id']: item for item in response.data['task_types']}
+        assert by_type[type_a.id]['session_count'] == 3
+        assert by_type[type_a.id]['median_duration'] == 1200
+        assert by_type[type_a.id]['p90_duration'] == pytest.approx(2160)
+        assert by_type[type_b.id]['interruption_rate'] == 0.5
+        
+        overall = response.data['overall']
+        assert overall['session_count'] == 5
+        assert overall['interruption_rate'] == 0.2
+        assert overall['total_duration'] == 130 * 60
+        
+        gaps = response.data['gaps']
+        assert gaps['count'] == 4
+        assert gaps['median'] == 120
+        assert gaps['longest'] == 76 * 60
+        
+        streak = response.data['longest_streak']
+        assert streak['session_count'] == 3
+        assert streak['total_duration'] == 3600
+        
+        response = client.get('/api/analytics/sessions/', {'max_gap': 'soon'})
+        assert response.status_code == 400
+
+
+@pytest.mark.django_db
+class TestExportAPI:
+    """Test export endpoints"""
+    
+    def test_download_streams_csv(self):
+        """Test the CSV download is streamed with a header and one row per task"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        for hour in range(3):
+            task_start = start + timedelta(hours=hour)
+            Task.objects.create(user=user, task_type=task_type, start_time=task_start,
+                                end_time=task_start + timedelta(minutes=30, seconds=5),
+                                notes=f'note, {hour}')
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/export/download/')
+        assert response.status_code == 200
+        assert response.streaming
+        assert response['Content-Type'] == 'text/csv'
+        
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        assert lines[0].startswith('Date,Task Type,Start Time')
+        assert len(lines) == 4
+        assert '00:30:05' in lines[1]
+        assert lines[1].endswith('"note, 0",No')
+    
+    def test_download_formats(self):
+        """Test NDJSON and gzip formats and rejection of unknown formats"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(minutes=90), interrupted=True)
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        response = client.get('/api/export/download/', {'format': 'ndjson.gz'})
+        assert response.status_code == 200
+        assert response['Content-Type'] == 'application/gzip'
+        assert response['Content-Disposition'].endswith('.ndjson.gz"')
+        
+        lines = gzip.decompress(b''.join(response.streaming_content)).decode().splitlines()
+        record = json.loads(lines[0])
+        assert len(lines) == 1
+        assert record['task_type'] == task_type.name
+        assert record['duration_seconds'] == 5400
+        assert record['interrupted'] is True
+        
+        response = client.get('/api/export/download/', {'format': 'xlsx'})
+        assert response.status_code == 400
+
+    def test_download_renders_times_in_profile_timezone(self):
+        """Test exported times use the profile timezone, across a DST change"""
+        from magus.dates import LocalTimeConverter
+
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        user.profile.timezone = 'America/New_York'
+        user.profile.save()
+        task_type = TaskType.objects.filter(user=user).first()
+
+        # 18:00 EST on March 9th, then 01:30 EST -> 03:30 EDT over the spring-forward gap
+        Task.objects.create(user=user, task_type=task_type,
+                            start_time=datetime(2024, 3, 9, 23, 0, tzinfo=UTC),
+                            end_time=datetime(2024, 3, 9, 23, 45, tzinfo=UTC))
+        Task.objects.create(user=user, task_type=task_type,
+                            start_time=datetime(2024, 3, 10, 6, 30, tzinfo=UTC),
+                            end_time=datetime(2024, 3, 10, 7, 30, tzinfo=UTC))
+
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.get('/api/export/download/',
+                              {'start_date': '2024-03-09', 'end_date': '2024-03-10', 'format': 'ndjson'})
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+
+        assert [r['start_time'] for r in records] == ['2024-03-09T18:00:00-05:00', '2024-03-10T01:30:00-05:00']
+        assert records[1]['end_time'] == '2024-03-10T03:30:00-04:00'
+        assert records[1]['date'] == '2024-03-10'
+        assert records[1]['duration_seconds'] == 3600
+
+        # The precomputed offsets agree with the timezone over a whole year
+        tz = ZoneInfo('America/New_York')
+        start = datetime(2024, 1, 1, tzinfo=UTC)
+        to_local = LocalTimeConverter(tz, start, start + timedelta(days=366))
+        for hour in range(0, 366 * 24, 7):
+            value = start + timedelta(hours=hour, minutes=13, seconds=27)
+            local = value.astimezone(tz)
+            assert to_local(value) == (local.date().isoformat(), local.strftime('%H:%M:%S'),
+                                       local.isoformat()[-6:])
+
+    def test_email_export_attaches_requested_format(self, mailoutbox):
+        """Test the email task attaches the export in the requested format"""
+        from magus.tasks import send_csv_export_email
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(minutes=30))
+        
+        day = start.date().isoformat()
+        send_csv_export_email(user.id, day, day, 'me@example.com', 'csv.gz')
+        
+        filename, content, mimetype = mailoutbox[0].attachments[0]
+        assert filename == f'magus_export_{day}_{day}.csv.gz'
+        assert mimetype == 'application/gzip'
+        assert gzip.decompress(content).decode().count('\n') == 2
+    
+    def test_export_artifact_download_through_signed_link(self, settings, export_artifact_root,
+                                                          django_capture_on_commit_callbacks):
+        """Test spooled exports are written by the job and handed to nginx via a signed link"""
+        from pathlib import Path
+
+        from magus.tasks import build_export_artifact
+        
+        tmp_path = Path(export_artifact_root)
+        settings.EXPORT_ACCEL_REDIRECT_PREFIX = '/protected-exports/'
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(minutes=30))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        with django_capture_on_commit_callbacks() as callbacks:
+            response = client.post('/api/export/artifacts/', {'format': 'ndjson'})
+        assert response.status_code == 201
+        assert response.data['status'] == 'pending'
+        assert response.data['download_url'] is None
+        assert len(callbacks) == 1
+        
+        artifact_id = response.data['id']
+        build_export_artifact(artifact_id)
+        
+        response = client.get(f'/api/export/artifacts/{artifact_id}/')
+        assert response.data['status'] == 'ready'
+        assert response.data['size'] > 0
+        
+        anonymous = APIClient()
+        download = anonymous.get(response.data['download_url'])
+        assert download.status_code == 200
+        assert download['X-Accel-Redirect'] == f'/protected-exports/{user.id}/{artifact_id}.ndjson'
+        assert download['Content-Type'] == 'application/x-ndjson'
+        assert download.content == b''
+        assert (tmp_path / str(user.id) / f'{artifact_id}.ndjson').read_text().count('\n') == 1
+        
+        settings.EXPORT_ACCEL_REDIRECT_PREFIX = ''
+        download = anonymous.get(response.data['download_url'])
+        assert b''.join(download.streaming_content).count(b'\n') == 1
+        
+        (tmp_path / str(user.id) / f'{artifact_id}.ndjson').unlink()
+        assert anonymous.get(response.data['download_url']).status_code == 410
+        
+        tampered = response.data['download_url'].rstrip('/') + 'x/'
+        assert anonymous.get(tampered).status_code == 404
+    
+    def test_repeat_downloads_are_served_from_the_artifact_cache(self, settings,
+                                                                 django_capture_on_commit_callbacks):
+        """Test identical downloads hit the stored artifact until the data changes"""
+        from magus.artifacts import evict_export_cache
+        from magus.models import ExportArtifact
+        
+        settings.EXPORT_ACCEL_REDIRECT_PREFIX = '/protected-exports/'
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0)
+        Task.objects.create(user=user, task_type=task_type, start_time=start,
+                            end_time=start + timedelta(minutes=30))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        first = client.get('/api/export/download/', {'format': 'csv.gz'})
+        assert first['X-Export-Cache'] == 'MISS'
+        body = b''.join(first.streaming_content)
+        
+        second = client.get('/api/export/download/', {'format': 'csv.gz'})
+        assert second['X-Export-Cache'] == 'HIT'
+        assert second['X-Accel-Redirect'].startswith('/protected-exports/')
+        artifact = ExportArtifact.objects.get(user=user)
+        assert artifact.size == len(body)
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            Task.objects.create(user=user, task_type=task_type, start_time=start + timedelta(hours=1),
+                                end_time=start + timedelta(hours=2))
+        third = client.get('/api/export/download/', {'format': 'csv.gz'})
+        assert third['X-Export-Cache'] == 'MISS'
+        b''.join(third.streaming_content)
+        
+        newest = ExportArtifact.objects.exclude(pk=artifact.pk).get(user=user)
+        assert evict_export_cache(max_bytes=newest.size) == 1
+        assert list(ExportArtifact.objects.filter(user=user)) == [newest]  # Least recently used went first
+
+
+@pytest.mark.django_db
+class TestImportAPI:
+    """Test bulk task imports"""
+    
+    def test_import_round_trips_an_export(self, django_capture_on_commit_callbacks):
+        """Test an exported CSV imports into another account, skipping bad and overlapping rows"""
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from magus.models import DailyRollup
+        
+        source = User.objects.create_user(username='source', password='testpass123')
+        task_type = TaskType.objects.filter(user=source).first()
+        start = timezone.localtime().replace(hour=9, minute=0, second=0, microsecond=0) - timedelta(days=1)
+        for hour in range(3):
+            Task.objects.create(user=source, task_type=task_type, start_time=start + timedelta(hours=hour),
+                                end_time=start + timedelta(hours=hour, minutes=45), notes=f'note, {hour}',
+                                interrupted=hour == 1)
+        
+        client = APIClient()
+        client.force_authenticate(user=source)
+        exported = b''.join(client.get('/api/export/download/').streaming_content)
+        extra = (
+            f'2024-01-01,{task_type.name},2024-01-01 10:00:00,2024-01-01 09:00:00,,No,,No\r\n'
+            f'{start:%Y-%m-%d},Unknown,{(start + timedelta(hours=5)):%Y-%m-%d %H:%M:%S},'
+            f'{(start + timedelta(hours=6)):%Y-%m-%d %H:%M:%S},,No,,No\r\n'
+        ).encode()
+        
+        target = User.objects.create_user(username='target', password='testpass123')
+        target_type = TaskType.objects.get(user=target, name=task_type.name)
+        # Overlaps the second exported task
+        Task.objects.create(user=target, task_type=target_type, start_time=start + timedelta(hours=1, minutes=30),
+                            end_time=start + timedelta(hours=1, minutes=50))
+        client.force_authenticate(user=target)
+        
+        with django_capture_on_commit_callbacks(execute=True):
+            response = client.post('/api/tasks/import/', {
+                'file': SimpleUploadedFile('legacy.csv', exported + extra),
+            }, format='multipart')
+        
+        assert response.status_code == 201
+        assert response.data['created'] == 2
+        assert response.data['skipped'] == 3
+        assert [error['line'] for error in response.data['errors']] == [3, 5, 6]
+        assert response.data['errors'][0]['error'] == 'Overlaps an existing task'
+        assert response.data['errors'][1]['error'] == 'End time must be after start time'
+        assert "Unknown task type 'Unknown'" in response.data['errors'][2]['error']
+        
+        imported = Task.objects.filter(user=target, is_manual_entry=True).order_by('start_time')
+        assert [task.notes for task in imported] == ['note, 0', 'note, 2']
+        assert imported[0].start_time == start
+        assert DailyRollup.objects.get(user=target, task_type=target_type).task_count == 3
+        
+        response = client.get('/api/analytics/summary/', {'date': start.date().isoformat()})
+        assert response.status_code == 200
+    
+    def test_large_import_runs_as_a_job(self, settings, task_import_root, django_capture_on_commit_callbacks):
+        """Test large uploads are queued and report progress until done"""
+        import os
+
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        from magus.tasks import import_task_file
+        
+        settings.TASK_IMPORT_SYNC_MAX_BYTES = 0
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        start = datetime(2024, 3, 9, 15, 0, tzinfo=UTC)
+        lines = [
+            json.dumps({'task_type': 'Reading', 'start_time': (start + timedelta(hours=hour)).isoformat(),
+                        'end_time': (start + timedelta(hours=hour, minutes=30)).isoformat(),
+                        'interrupted': False, 'notes': '', 'edited': True})
+            for hour in range(5)
+        ]
+        body = gzip.compress(('\n'.join(lines) + '\n').encode())
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        with django_capture_on_commit_callbacks() as callbacks:
+            response = client.post('/api/tasks/import/', {
+                'file': SimpleUploadedFile('tasks.ndjson.gz', body),
+                'create_types': 'true',
+            }, format='multipart')
+        
+        assert response.status_code == 202
+        assert response.data['status'] == 'pending'
+        assert response.data['format'] == 'ndjson.gz'
+        assert len(callbacks) == 1
+        
+        import_task_file(response.data['id'])
+        
+        response = client.get(f"/api/task-imports/{response.data['id']}/")
+        assert response.data['status'] == 'done'
+        assert response.data['processed_rows'] == response.data['total_rows'] == 5
+        assert response.data['created_count'] == 5
+        assert Task.objects.filter(user=user, task_type__name='Reading', edited_by_user=True).count() == 5
+        assert os.listdir(os.path.join(task_import_root, str(user.id))) == []
+
+
+@pytest.mark.django_db
+class TestTaskBatchAPI:
+    """Test batch task mutations"""
+    
+    def test_batch_applies_all_operations_in_one_transaction(self, django_capture_on_commit_callbacks,
+                                                             django_assert_max_num_queries):
+        """Test creates, updates and deletes are applied together and keep rollups and tombstones"""
+        from magus.models import DailyRollup, TaskDeletion
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        first_type, second_type = TaskType.objects.filter(user=user)[:2]
+        start = datetime(2024, 3, 4, 16, 0, tzinfo=UTC)
+        kept, removed = (
+            Task.objects.create(user=user, task_type=first_type, start_time=start + timedelta(hours=hour),
+                                end_time=start + timedelta(hours=hour, minutes=30))
+            for hour in range(2)
+        )
+        tracking = Task.objects.create(user=user, task_type=first_type, start_time=start + timedelta(hours=3))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        # Independent of the batch size: one statement per kind of write, one per rollup row
+        with django_capture_on_commit_callbacks(execute=True), django_assert_max_num_queries(25):
+            response = client.post('/api/tasks/batch/', {'operations': [
+                {'op': 'update', 'id': kept.id, 'data': {'task_type': second_type.id, 'notes': 'fixed'}},
+                {'op': 'delete', 'id': removed.id},
+                {'op': 'update', 'id': tracking.id, 'data': {'end_time': (start + timedelta(hours=4)).isoformat()}},
+                *({'op': 'create', 'data': {
+                    'task_type': first_type.id,
+                    'start_time': (start + timedelta(hours=5 + hour)).isoformat(),
+                    'end_time': (start + timedelta(hours=5 + hour, minutes=15)).isoformat(),
+                }} for hour in range(3)),
+                {'op': 'create', 'data': {'task_type': first_type.id,
+                                          'start_time': (start + timedelta(hours=9)).isoformat()}},
+            ]}, format='json')
+        
+        assert response.status_code == 200
+        results = response.data['results']
+        assert [result['status'] for result in results] == [200, 204, 200, 201, 201, 201, 201]
+        assert results[0]['task']['task_type_detail']['id'] == second_type.id
+        assert results[1]['id'] == removed.id
+        
+        kept.refresh_from_db()
+        assert kept.notes == 'fixed' and kept.edited_by_user
+        assert not Task.objects.filter(id=removed.id).exists()
+        assert TaskDeletion.objects.filter(user=user, task_id=removed.id).exists()
+        created = Task.objects.filter(id__in=[result['id'] for result in results[3:]])
+        assert all(task.is_manual_entry and not task.edited_by_user for task in created)
+        assert len(created) == 4
+        assert not kept.is_manual_entry
+        
+        rollups = {rollup.task_type_id: rollup for rollup in DailyRollup.objects.filter(user=user)}
+        assert rollups[second_type.id].task_count == 1
+        assert rollups[first_type.id].task_count == 4
+        assert rollups[first_type.id].total_seconds == 3600 + 3 * 900
+        
+        assert client.get('/api/tasks/current/').data['id'] == results[-1]['id']
+    
+    def test_invalid_batch_reports_errors_per_operation(self):
+        """Test one invalid operation rejects the whole batch with per-operation errors"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        start = timezone.now() - timedelta(hours=5)
+        task = Task.objects.create(user=user, task_type=task_type, start_time=start,
+                                   end_time=start + timedelta(hours=1))
+        foreign = Task.objects.create(user=other, task_type=TaskType.objects.filter(user=other).first(),
+                                      start_time=start, end_time=start + timedelta(hours=1))
+        Task.objects.create(user=user, task_type=task_type, start_time=start + timedelta(hours=2))
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        response = client.post('/api/tasks/batch/', {'operations': [
+            {'op': 'update', 'id': task.id, 'data': {'notes': 'valid'}},
+            {'op': 'update', 'id': task.id, 'data': {'end_time': (start - timedelta(hours=1)).isoformat()}},
+            {'op': 'delete', 'id': foreign.id},
+            {'op': 'create', 'data': {'task_type': task_type.id, 'start_time': timezone.now().isoformat()}},
+        ]}, format='json')
+        
+        assert response.status_code == 400
+        errors = response.data['operations']
+        assert errors[0] == {}
+        assert 'id' in errors[1] and 'id' in errors[2]
+        assert 'end_time' in errors[3]
+        
+        task.refresh_from_db()
+        assert task.notes == ''
+        assert Task.objects.filter(id=foreign.id).exists()
+        
+        response = client.post('/api/tasks/batch/', {'operations': [
+            {'op': 'update', 'id': task.id, 'data': {'end_time': (start - timedelta(hours=1)).isoformat()}},
+        ]}, format='json')
+        assert response.data['operations'][0]['end_time'] == ['End time must be after start time.']
+        
+        response = client.post('/api/tasks/batch/', {'operations': [{'op': 'move'}, {'op': 'delete'}]}, format='json')
+        assert 'op' in response.data['operations'][0]
+        assert 'id' in response.data['operations'][1]
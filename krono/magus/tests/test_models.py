@@ -1,9 +1,14 @@
 """
 Basic model tests for MAGUS
 """
+import io
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
 import pytest
 from django.contrib.auth.models import User
-from magus.models import TaskType, Task, APIKey
+from django.utils import timezone
+from magus.models import TaskType, Task, APIKey, DailyRollup, ScheduledExport
 
 
 @pytest.mark.django_db
@@ -52,3 +57,384 @@ class TestModels:
         key_hash = APIKey.hash_key(key)
         assert len(key_hash) == 64  # SHA-256 hex
 
+
+
+@pytest.mark.django_db
+class TestDailyRollups:
+    """Test incremental maintenance of the analytics rollups"""
+    
+    def test_rollups_follow_task_lifecycle(self):
+        """Test rollups track tasks through stop, edit and delete"""
+        from datetime import timedelta
+
+        from django.utils import timezone
+        from rest_framework.test import APIClient
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        deep_work, email = TaskType.objects.filter(user=user)[:2]
+        
+        client = APIClient()
+        client.force_authenticate(user=user)
+        
+        # Ongoing tasks are not rolled up
+        response = client.post('/api/tasks/start/', {'task_type_id': deep_work.id})
+        task_id = response.data['id']
+        assert not DailyRollup.objects.filter(user=user).exists()
+        
+        client.post('/api/tasks/stop/')
+        rollup = DailyRollup.objects.get(user=user)
+        assert rollup.task_type == deep_work
+        assert rollup.task_count == 1
+        assert rollup.interrupted_count == 0
+        
+        # Editing moves the contribution to the new task type and day
+        start = timezone.now() - timedelta(days=3)
+        response = client.patch(f'/api/tasks/{task_id}/', {
+            'task_type': email.id,
+            'start_time': start.isoformat(),
+            'end_time': (start + timedelta(hours=2)).isoformat(),
+        })
+        assert response.status_code == 200
+        rollup = DailyRollup.objects.get(user=user)
+        assert rollup.task_type == email
+        assert rollup.day == timezone.localtime(start).date()
+        assert rollup.total_seconds == 7200
+        
+        response = client.delete(f'/api/tasks/{task_id}/')
+        assert response.status_code == 204
+        assert not DailyRollup.objects.filter(user=user).exists()
+    
+    def test_rebuild_rollups_command(self):
+        """Test the rebuild command reproduces incrementally maintained rollups"""
+        from datetime import timedelta
+
+        from django.core.management import call_command
+        from django.utils import timezone
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        start = timezone.now() - timedelta(days=2)
+        for offset in range(3):
+            Task.objects.create(
+                user=user,
+                task_type=task_type,
+                start_time=start + timedelta(hours=offset),
+                end_time=start + timedelta(hours=offset, minutes=30),
+                interrupted=offset == 0,
+            )
+        
+        fields = ('day', 'task_type', 'total_seconds', 'task_count', 'interrupted_count')
+        expected = list(DailyRollup.objects.filter(user=user).values(*fields))
+        assert expected
+        
+        DailyRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        
+        assert list(DailyRollup.objects.filter(user=user).values(*fields)) == expected
+    
+    def test_admin_bulk_delete_updates_rollups(self, rf):
+        """Test the admin's delete action removes tasks from the rollups and records tombstones"""
+        from datetime import timedelta
+
+        from django.contrib.admin.sites import site
+
+        from magus.models import TaskDeletion
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        start = timezone.now() - timedelta(days=1)
+        tasks = [
+            Task.objects.create(
+                user=owner,
+                task_type=TaskType.objects.filter(user=owner).first(),
+                start_time=start,
+                end_time=start + timedelta(hours=1),
+            )
+            for owner in (user, user, other)
+        ]
+        
+        site._registry[Task].delete_queryset(rf.post('/'), Task.objects.filter(pk__in=[t.pk for t in tasks]))
+        
+        assert not Task.objects.exists()
+        assert not DailyRollup.objects.exists()
+        assert TaskDeletion.objects.filter(user=user).count() == 2
+        assert TaskDeletion.objects.filter(user=other).count() == 1
+    
+    def test_tasks_crossing_midnight_are_split_across_days(self):
+        """Test incremental and rebuilt rollups clip tasks to local days"""
+        from datetime import datetime, timedelta
+        from zoneinfo import ZoneInfo
+
+        from django.core.management import call_command
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        task_type = TaskType.objects.filter(user=user).first()
+        
+        # 22:00 to 02:00 the next morning in the profile timezone (America/Denver)
+        start = datetime(2024, 3, 1, 22, 0, tzinfo=ZoneInfo('America/Denver'))
+        task = Task.objects.create(user=user, task_type=task_type, start_time=start,
+                                   end_time=start + timedelta(hours=4), interrupted=True)
+        
+        fields = ('day', 'total_seconds', 'task_count', 'interrupted_count')
+        expected = [
+            {'day': start.date() + timedelta(days=1), 'total_seconds': 7200, 'task_count': 0, 'interrupted_count': 0},
+            {'day': start.date(), 'total_seconds': 7200, 'task_count': 1, 'interrupted_count': 1},
+        ]
+        assert list(DailyRollup.objects.filter(user=user).values(*fields)) == expected
+        
+        DailyRollup.objects.all().delete()
+        call_command('rebuild_rollups', stdout=io.StringIO())
+        assert list(DailyRollup.objects.filter(user=user).values(*fields)) == expected
+        
+        task.delete()
+        assert not DailyRollup.objects.filter(user=user).exists()
+
+
+@pytest.mark.django_db
+class TestScheduledExports:
+    """Test scheduled export timing and dispatch"""
+    
+    def test_monthly_schedule_follows_the_calendar(self):
+        """Test monthly runs keep their day of month and local time"""
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        denver = ZoneInfo('America/Denver')
+        jan_31 = datetime(2027, 1, 31, 10, 0, tzinfo=denver)
+        
+        export = ScheduledExport.objects.create(user=user, frequency='monthly',
+                                                email_to='me@example.com', next_scheduled=jan_31)
+        ScheduledExport.objects.filter(pk=export.pk).update(created_at=jan_31 - timedelta(days=31))
+        export.refresh_from_db()
+        
+        feb = export.calculate_next_scheduled(after=jan_31)
+        assert feb == datetime(2027, 2, 28, 10, 0, tzinfo=denver)
+        
+        export.next_scheduled = feb
+        march = export.calculate_next_scheduled(after=feb)
+        assert march == datetime(2027, 3, 31, 10, 0, tzinfo=denver)  # After the DST change
+        
+        assert export.export_range(march) == (date(2027, 2, 28), date(2027, 3, 30))
+    
+    def test_dispatcher_claims_due_exports_in_batches(self, settings, mailoutbox,
+                                                      django_capture_on_commit_callbacks):
+        """Test due exports are claimed once, advanced, and sent"""
+        from magus.tasks import dispatch_scheduled_exports, send_scheduled_export
+        
+        settings.SCHEDULED_EXPORT_BATCH_SIZE = 2
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        now = timezone.now()
+        
+        due = [
+            ScheduledExport.objects.create(user=user, frequency='daily', email_to=f'{i}@example.com',
+                                           next_scheduled=now - timedelta(minutes=i + 1))
+            for i in range(3)
+        ]
+        inactive = ScheduledExport.objects.create(user=user, frequency='daily', email_to='x@example.com',
+                                                  next_scheduled=now - timedelta(minutes=5), is_active=False)
+        
+        with django_capture_on_commit_callbacks() as callbacks:
+            assert dispatch_scheduled_exports() == 3
+        assert len(callbacks) == 2  # One queueing callback per batch
+        
+        for export in due:
+            export.refresh_from_db()
+            assert export.next_scheduled > now
+        inactive.refresh_from_db()
+        assert inactive.next_scheduled < now
+        
+        with django_capture_on_commit_callbacks():
+            assert dispatch_scheduled_exports() == 0
+        
+        yesterday = (timezone.localtime(now) - timedelta(days=1)).date().isoformat()
+        send_scheduled_export(due[0].id, yesterday, yesterday)
+        due[0].refresh_from_db()
+        assert due[0].last_sent is not None
+        assert mailoutbox[0].to == ['0@example.com']
+    
+    def test_incremental_export_sends_changes_and_deletions(self, mailoutbox):
+        """Test incremental runs send only tasks changed since the last run, plus deletions"""
+        from magus.tasks import send_scheduled_export
+        
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        user.profile.timezone = 'Pacific/Kiritimati'  # UTC+14: the local date differs from the server's
+        user.profile.save()
+        task_type = TaskType.objects.filter(user=user).first()
+        now = timezone.now()
+        last_sent = now - timedelta(hours=1)
+        
+        old, changed, deleted = [
+            Task.objects.create(user=user, task_type=task_type,
+                                start_time=now - timedelta(days=3, hours=i),
+                                end_time=now - timedelta(days=3, hours=i) + timedelta(minutes=20))
+            for i in range(3)
+        ]
+        Task.objects.filter(pk__in=[old.pk, deleted.pk]).update(updated_at=last_sent - timedelta(hours=1))
+        deleted_id = deleted.pk
+        deleted.delete()
+        
+        export = ScheduledExport.objects.create(user=user, frequency='daily', email_to='me@example.com',
+                                                next_scheduled=now, last_sent=last_sent,
+                                                incremental=True, include_deletions=True)
+        
+        until = now + timedelta(seconds=1)
+        day = timezone.localtime(now).date().isoformat()
+        send_scheduled_export(export.id, day, day, until.isoformat(), last_sent.isoformat())
+        
+        filename, content, _mimetype = mailoutbox[0].attachments[0]
+        lines = content.splitlines()
+        local_until = timezone.localtime(until, ZoneInfo('Pacific/Kiritimati'))
+        assert mailoutbox[0].subject.endswith(str(local_until.date()))
+        assert filename == f'magus_changes_{local_until:%Y-%m-%d_%H%M%S}.csv'
+        assert lines[0].startswith('Task ID,Change,Date')
+        assert lines[1].startswith(f'{changed.pk},upsert,')
+        assert lines[2].startswith(f'{deleted_id},deleted,')
+        assert len(lines) == 3
+        
+        export.refresh_from_db()
+        assert export.last_sent == until
+    
+    def test_tombstones_are_purged_once_sent(self, settings):
+        """Test tombstones are kept only until every incremental export has sent them"""
+        from magus.models import TaskDeletion
+        from magus.tasks import purge_deletion_tombstones
+        
+        settings.TASK_DELETION_RETENTION = timedelta(days=30)
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        other = User.objects.create_user(username='other', password='testpass123')
+        now = timezone.now()
+        ScheduledExport.objects.create(user=user, frequency='daily', email_to='me@example.com',
+                                       next_scheduled=now, last_sent=now - timedelta(days=2),
+                                       incremental=True, include_deletions=True)
+        
+        def tombstone(owner, age):
+            deletion = TaskDeletion.objects.create(user=owner, task_id=1)
+            TaskDeletion.objects.filter(pk=deletion.pk).update(deleted_at=now - age)
+            return deletion.pk
+        
+        tombstone(user, timedelta(days=3))  # Sent by the last run
+        pending = tombstone(user, timedelta(days=1))
+        tombstone(other, timedelta(hours=1))  # No incremental export to send it
+        
+        purge_deletion_tombstones()
+        assert list(TaskDeletion.objects.values_list('pk', flat=True)) == [pending]
+        
+        # A paused export holds tombstones only for the retention window
+        settings.TASK_DELETION_RETENTION = timedelta(hours=12)
+        purge_deletion_tombstones()
+        assert not TaskDeletion.objects.exists()
+    
+    def test_batch_shares_one_connection_and_retries_per_message(self, settings, mailoutbox, monkeypatch):
+        """Test a batch opens one connection, retries transient errors and records only delivered runs"""
+        import smtplib
+
+        from django.core.mail.backends import locmem
+
+        from magus import mailing
+        from magus.tasks import send_scheduled_export_batch
+        
+        settings.EMAIL_RETRY_BACKOFF = 0
+        user = User.objects.create_user(username='testuser', password='testpass123')
+        now = timezone.now()
+        exports = [
+            ScheduledExport.objects.create(user=user, frequency='daily', email_to=f'{i}@example.com',
+                                           next_scheduled=now)
+            for i in range(3)
+        ]
+        
+        connections = []
+        get_connection = mailing.get_connection
+        
+        def counting_get_connection(*args, **kwargs):
+            """Record every connection handed out"""
+            connections.append(get_connection(*args, **kwargs))
+            return connections[-1]
+        
+        attempts_left = {'1@example.com': 1, '2@example.com': 10}
+        send_messages = locmem.EmailBackend.send_messages
+        
+        def flaky_send_messages(backend, messages):
+            """Drop the connection for the first attempts to some recipients"""
+            recipient = messages[0].to[0]
+            if attempts_left.get(recipient):
+                attempts_left[recipient] -= 1
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            return send_messages(backend, messages)
+        
+        monkeypatch.setattr(mailing, 'get_connection', counting_get_connection)
+        monkeypatch.setattr(locmem.EmailBackend, 'send_messages', flaky_send_messages)
+        
+        day = (timezone.localtime(now) - timedelta(days=1)).date().isoformat()
+        sent = send_scheduled_export_batch([[export.id, day, day, now.isoformat(), None] for export in exports])
+        
+        assert sent == 2
+        assert len(connections) == 1
+        assert [message.to for message in mailoutbox] == [['0@example.com'], ['1@example.com']]
+        assert attempts_left['2@example.com'] == 10 - (settings.EMAIL_SEND_RETRIES + 1)
+        
+        last_sent = [ScheduledExport.objects.get(pk=export.pk).last_sent for export in exports]
+        assert last_sent == [now, now, None]
+    
+    def test_pooled_delivery_over_smtp(self, settings):
+        """Test messages reach a local SMTP server over a single session"""
+        import socket
+
+        from aiosmtpd.controller import Controller
+        from django.core.mail import EmailMessage
+
+        from magus.mailing import send_pooled
+        
+        class Recorder:
+            """aiosmtpd handler keeping the session and recipients of each message"""
+            
+            def __init__(self):
+                self.deliveries = []
+            
+            async def handle_DATA(self, server, session, envelope):
+                """Record the message and accept it"""
+                self.deliveries.append((id(session), envelope.rcpt_tos))
+                return '250 Message accepted for delivery'
+        
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        
+        handler = Recorder()
+        controller = Controller(handler, hostname='127.0.0.1', port=port)
+        controller.start()
+        try:
+            settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+            settings.EMAIL_HOST, settings.EMAIL_PORT = '127.0.0.1', port
+            settings.EMAIL_USE_TLS = False
+            settings.EMAIL_HOST_USER = settings.EMAIL_HOST_PASSWORD = ''
+            
+            messages = [EmailMessage('Export', 'Body', 'noreply@magus.local', [f'{i}@example.com'])
+                        for i in range(3)]
+            assert send_pooled(messages) == {}
+        finally:
+            controller.stop()
+        
+        assert [rcpt for _, rcpt in handler.deliveries] == [[f'{i}@example.com'] for i in range(3)]
+        assert len({session for session, _ in handler.deliveries}) == 1
+
+
+class TestCeleryRouting:
+    """Test task routing to worker queues"""
+    
+    def test_housekeeping_and_exports_use_separate_queues(self):
+        """Test heartbeats never share a queue with export jobs, and export jobs are time-limited"""
+        from celery import current_app
+
+        from magus import tasks
+        
+        def queue(task):
+            """Return the name of the queue a task is sent to"""
+            return current_app.amqp.router.route({}, task.name)['queue'].name
+        
+        assert queue(tasks.check_heartbeats) == queue(tasks.handle_missed_heartbeat) == 'realtime'
+        assert queue(tasks.dispatch_scheduled_exports) == queue(tasks.purge_export_artifacts) == 'maintenance'
+        assert queue(tasks.purge_deletion_tombstones) == 'maintenance'
+        for task in (tasks.send_csv_export_email, tasks.send_scheduled_export_batch,
+                     tasks.build_export_artifact, tasks.import_task_file):
+            assert queue(task) == 'exports'
+            assert task.soft_time_limit < task.time_limit
+            assert task.ignore_result